@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Bot API call accounting per interaction
+Every update handled sets the current interaction (e.g. "exam_answer");
+every Bot API request made while handling it, including delayed
+follow-ups, is counted against that interaction
+"""
+
+import re
+from contextvars import ContextVar, Token
+from typing import Dict, Optional
+
+from telegram import Update
+
+import bot_metrics
+
+_current: ContextVar[Optional[str]] = ContextVar("interaction", default=None)
+
+# Trailing ids in callback data ("exam_answer_3_1" -> "exam_answer")
+_ID_SUFFIX = re.compile(r"(_-?\d+)+$")
+
+# Commands the bot registers; anything else a user types is "command_other",
+# so made-up commands don't create new metric names
+KNOWN_COMMANDS = frozenset({"start", "cancel", "lessons", "progress", "reload_lessons"})
+
+
+def interaction_name(update: object) -> str:
+    """Low-cardinality name of what the user did"""
+    if isinstance(update, Update):
+        if update.callback_query and update.callback_query.data:
+            if update.callback_query.data.startswith("e:"):
+                # Signed exam state - unique per press
+                return "exam_signed"
+            return _ID_SUFFIX.sub("", update.callback_query.data)
+        message = update.effective_message
+        if message and message.text:
+            if message.text.startswith("/"):
+                words = message.text[1:].split(maxsplit=1)
+                command = words[0].split("@", 1)[0].lower() if words else ""
+                return "command_" + (command if command in KNOWN_COMMANDS else "other")
+            return "text"
+        return "other"
+    return "unknown"
+
+
+def _interactions(name: str) -> bot_metrics.Counter:
+    return bot_metrics.counter(f'interactions_total{{interaction="{name}"}}', "Updates handled per interaction")
+
+
+def _calls(name: str) -> bot_metrics.Counter:
+    return bot_metrics.counter(f'bot_api_calls_total{{interaction="{name}"}}', "Bot API requests per interaction")
+
+
+def begin(name: str) -> Token:
+    """Start counting API calls for an interaction in the current context"""
+    _interactions(name).inc()
+    return _current.set(name)
+
+
+def attach(name: Optional[str]) -> Token:
+    """Count calls in the current context against an existing interaction"""
+    return _current.set(name)
+
+
+def end(token: Token) -> None:
+    _current.reset(token)
+
+
+def current() -> Optional[str]:
+    return _current.get()
+
+
+def record(endpoint: str) -> None:
+    """Count one Bot API request against the current interaction"""
+    _calls(_current.get() or "background").inc()
+    bot_metrics.counter(f'bot_api_requests_total{{endpoint="{endpoint}"}}', "Bot API requests per endpoint").inc()
+
+
+def calls_per_interaction() -> Dict[str, float]:
+    """Average Bot API calls per handled update, by interaction"""
+    averages = {}
+    for name, value in bot_metrics.snapshot().items():
+        if name.startswith('interactions_total{interaction="') and value:
+            interaction = name[len('interactions_total{interaction="'):-2]
+            averages[interaction] = round(_calls(interaction).value / value, 2)
+    return averages
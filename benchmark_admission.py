@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: inbound admission control under a burst
+
+Simulates an announcement: many users arrive at once, most browsing the
+menus and opening lessons, some in the middle of an exam. Compares plain
+FIFO slot allocation with priority slots plus load shedding (the
+PerUserUpdateProcessor policy) and reports how long exam answers wait,
+how many updates of each class were answered "busy" and the peak queue.
+
+Usage:
+    python benchmark_admission.py [--users 1500] [--slots 16]
+"""
+
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+from keyed_scheduler import KeyedSerializer
+
+CRITICAL, NORMAL, LOW = 0, 1, 2
+NAMES = {CRITICAL: "exam/registration", NORMAL: "lesson", LOW: "menu"}
+
+# (priority, share of traffic, handler time in seconds)
+BURST_MIX = [
+    (CRITICAL, 0.20, 0.010),
+    (NORMAL, 0.30, 0.050),
+    (LOW, 0.50, 0.020),
+]
+
+
+def make_burst(users: int, seed: int = 23):
+    """(user, priority, handler time, arrival offset) tuples over ~2 seconds"""
+    rng = random.Random(seed)
+    priorities = [p for p, _, _ in BURST_MIX]
+    weights = [w for _, w, _ in BURST_MIX]
+    durations = {p: d for p, _, d in BURST_MIX}
+    burst = []
+    for user in range(users):
+        arrival = rng.uniform(0, 2.0)
+        for _ in range(rng.randint(1, 3)):
+            priority = rng.choices(priorities, weights)[0]
+            burst.append((user, priority, durations[priority], arrival))
+            arrival += rng.uniform(0.05, 0.5)
+    burst.sort(key=lambda item: item[3])
+    return burst
+
+
+async def run(burst, slots: int, admission: bool, shed_low: int, shed_normal: int):
+    serializer = KeyedSerializer(slots)
+    waits = {p: [] for p in NAMES}
+    shed = {p: 0 for p in NAMES}
+    peak = 0
+    start = time.perf_counter()
+
+    async def handle(user, priority, duration, arrival):
+        nonlocal peak
+        delay = arrival - (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        queued = serializer.waiting()
+        peak = max(peak, queued)
+        limit = {LOW: shed_low, NORMAL: shed_normal}.get(priority)
+        if admission and limit is not None and queued >= limit:
+            shed[priority] += 1
+            return
+        queued_at = time.perf_counter()
+
+        async def work():
+            waits[priority].append(time.perf_counter() - queued_at)
+            await asyncio.sleep(duration)
+
+        await serializer.run(user, work(), priority if admission else 0)
+
+    await asyncio.gather(*(handle(*item) for item in burst))
+    return time.perf_counter() - start, waits, shed, peak
+
+
+def p95(values):
+    return statistics.quantiles(values, n=20)[-1] if len(values) >= 20 else max(values, default=0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1500)
+    parser.add_argument("--slots", type=int, default=16)
+    parser.add_argument("--shed-low", type=int, default=200)
+    parser.add_argument("--shed-normal", type=int, default=600)
+    args = parser.parse_args()
+
+    burst = make_burst(args.users)
+    print(f"Burst: {len(burst)} updates from {args.users} users, {args.slots} handler slots\n")
+    for label, admission in (("FIFO (before)", False), ("priority + shedding", True)):
+        elapsed, waits, shed, peak = asyncio.run(
+            run(burst, args.slots, admission, args.shed_low, args.shed_normal)
+        )
+        print(f"{label}: drained in {elapsed:.1f}s, peak queue {peak}")
+        for priority, name in NAMES.items():
+            values = waits[priority]
+            median = statistics.median(values) if values else 0.0
+            print(f"  {name:<18} handled {len(values):>5}  shed {shed[priority]:>5}  "
+                  f"wait p50 {median * 1000:>7.0f} ms  p95 {p95(values) * 1000:>7.0f} ms")
+        print()
+
+
+if __name__ == "__main__":
+    main()
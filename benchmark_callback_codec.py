@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: signed exam callback data codec
+
+Measures encode/decode throughput of ExamCodec and the size of the
+callback data for exams of different lengths (Telegram allows 64 bytes),
+and compares with a naive JSON + full HMAC encoding of the same state.
+Also checks that tampered or foreign-user data is rejected, and runs
+every local lesson's exam with all answers correct the way EXAM_UI=stateless
+would (signed buttons, or a stored session for exams with text questions)
+to check that each one can be passed.
+
+Usage:
+    python benchmark_callback_codec.py [--iterations 100000]
+"""
+
+import hmac
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+
+from exam_codec import (
+    ACTION_ANSWER, MAX_CALLBACK_BYTES, MAX_QUESTIONS, ExamCodec, ExamToken, InvalidCallbackData,
+    fits_callback_data, session_from_token, token_for
+)
+from exam_session import ExamSession
+from lesson_cache import question_from_row
+
+try:
+    from lessons_content_new import get_all_lessons
+except ImportError:
+    from lessons_content import get_all_lessons
+
+SECRET = hashlib.sha256(b"benchmark").digest()
+USER_ID = 123456789
+
+
+def random_token(rng: random.Random, questions: int) -> ExamToken:
+    index = rng.randrange(questions)
+    answers = tuple(rng.randint(1, 4) if i < index else 0 for i in range(questions))
+    shown = sum(1 << i for i in range(index) if rng.random() < 0.2)
+    return ExamToken(ACTION_ANSWER, rng.randint(1, 15), index, rng.randrange(4),
+                     rng.randrange(1 << 16), shown, answers)
+
+
+def json_encode(token: ExamToken, user_id: int) -> str:
+    payload = json.dumps(token._asdict(), separators=(",", ":"))
+    mac = hmac.new(SECRET, f"{user_id}:{payload}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(payload.encode() + mac).decode()
+
+
+def bench(label: str, func, items, iterations: int) -> None:
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(items[i % len(items)])
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<22} {iterations / elapsed:>12,.0f} ops/s  ({elapsed / iterations * 1e6:.2f} us/op)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(19)
+    codec = ExamCodec(SECRET)
+
+    print(f"Callback data size (limit {MAX_CALLBACK_BYTES} bytes):")
+    print(f"  {'questions':>9} {'signed codec':>13} {'json + hmac':>12}")
+    for questions in (5, 10, 20, MAX_QUESTIONS):
+        token = random_token(rng, questions)
+        compact = len(codec.encode(token, USER_ID))
+        naive = len(json_encode(token, USER_ID))
+        fits = "ok" if compact <= MAX_CALLBACK_BYTES else "TOO LONG"
+        print(f"  {questions:>9} {compact:>10} B {fits:<2} {naive:>9} B")
+
+    tokens = [random_token(rng, rng.randint(5, 20)) for _ in range(1000)]
+    encoded = [codec.encode(token, USER_ID) for token in tokens]
+    assert all(codec.decode(data, USER_ID) == token for data, token in zip(encoded, tokens))
+
+    print(f"\nThroughput ({args.iterations:,} operations):")
+    bench("encode", lambda t: codec.encode(t, USER_ID), tokens, args.iterations)
+    bench("decode + verify", lambda d: codec.decode(d, USER_ID), encoded, args.iterations)
+    bench("json + hmac encode", lambda t: json_encode(t, USER_ID), tokens, args.iterations)
+
+    rejected = 0
+    for data in encoded[:200]:
+        tampered = data[:-3] + ("A" if data[-3] != "A" else "B") + data[-2:]
+        for candidate, user_id in ((tampered, USER_ID), (data, USER_ID + 1)):
+            try:
+                codec.decode(candidate, user_id)
+            except InvalidCallbackData:
+                rejected += 1
+    print(f"\nRejected {rejected}/400 tampered or foreign-user buttons")
+
+    print("\nLocal lessons, EXAM_UI=stateless, all answers correct:")
+    failed = []
+    for lesson_number, questions in local_exams():
+        mode, percent, passed = run_exam(codec, lesson_number, questions)
+        types = ",".join(sorted({q.question_type for q in questions}))
+        print(f"  lesson {lesson_number:>2}  {types:<22} {mode:<8} {percent:>3}%  {'pass' if passed else 'FAIL'}")
+        if not passed:
+            failed.append(lesson_number)
+    if failed:
+        raise SystemExit(f"Lessons that can't be passed: {failed}")
+
+
+def local_exams():
+    """(lesson number, questions) of every local lesson with an exam"""
+    question_id = 1
+    for lesson in get_all_lessons():
+        questions = []
+        for number, question in enumerate(lesson.get("questions") or [], 1):
+            questions.append(question_from_row(dict(question, id=question_id, lesson_id=lesson["lesson_number"],
+                                                    question_number=number)))
+            question_id += 1
+        if questions:
+            yield lesson["lesson_number"], tuple(questions)
+
+
+def run_exam(codec: ExamCodec, lesson_number: int, questions) -> tuple:
+    """Answer every question correctly; returns (mode, score percent, passed)"""
+    session = ExamSession(lesson_number, lesson_number, questions)
+    if not fits_callback_data(questions):
+        # Stored session: option buttons and typed answers both record the answer
+        for index, question in enumerate(questions):
+            session.record_answer(index, question.correct_answer, True)
+            session.current = index + 1
+        return "session", session.score()[2], session.passed()
+    while not session.finished:
+        question = session.question(session.current)
+        option = [o.strip() for o in question.options].index(question.correct_answer.strip())
+        # Every press goes through encode -> callback_data -> decode, as between two workers
+        data = codec.encode(token_for(session, ACTION_ANSWER, option), USER_ID)
+        token = codec.decode(data, USER_ID)
+        session = session_from_token(token, lesson_number, questions)
+        session.record_answer(session.current, question.options[token.option], True)
+        session.current += 1
+    return "signed", session.score()[2], session.passed()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: repeated button presses with and without deduplication
+
+Simulates users pressing lesson and exam buttons, a share of them twice
+in quick succession (double taps), and counts how many handler runs -
+each a database read and a message - the deduplicator saves. Also
+measures its overhead per press and its memory after the TTL passes.
+
+Usage:
+    python benchmark_callback_dedup.py [--presses 20000] [--double-tap 0.3]
+"""
+
+import time
+import random
+import asyncio
+import argparse
+
+from callback_dedup import CallbackDeduplicator
+
+HANDLER_TIME = 0.002
+
+
+def make_presses(count: int, double_tap: float, seed: int = 22):
+    """(user, data, message_id, delay before the press) tuples"""
+    rng = random.Random(seed)
+    presses = []
+    while len(presses) < count:
+        user = rng.randrange(500)
+        data = rng.choice([f"lesson_{rng.randint(1, 15)}", f"start_exam_{rng.randint(1, 15)}",
+                           f"exam_answer_{rng.randrange(10)}_{rng.randrange(4)}"])
+        message_id = rng.randrange(1, 50)
+        presses.append((user, data, message_id, 0.0))
+        if rng.random() < double_tap:
+            # Second tap while the first is still running or just after it
+            presses.append((user, data, message_id, rng.uniform(0.0, 0.004)))
+    return presses
+
+
+async def run(presses, dedup: bool):
+    runs = 0
+    deduplicator = CallbackDeduplicator(ttl=3)
+
+    async def handler():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(HANDLER_TIME)
+
+    async def press(user, data, message_id, delay):
+        await asyncio.sleep(delay)
+        if dedup:
+            await deduplicator.run((user, data, message_id), handler)
+        else:
+            await handler()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(press(*p) for p in presses))
+    return runs, time.perf_counter() - start, deduplicator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--presses", type=int, default=20000)
+    parser.add_argument("--double-tap", type=float, default=0.3, help="share of presses that are double taps")
+    args = parser.parse_args()
+
+    presses = make_presses(args.presses, args.double_tap)
+    plain_runs, plain_time, _ = asyncio.run(run(presses, dedup=False))
+    dedup_runs, dedup_time, deduplicator = asyncio.run(run(presses, dedup=True))
+
+    print(f"{len(presses)} presses ({args.double_tap:.0%} double taps)")
+    print(f"  handler runs without dedup: {plain_runs:>7}  ({plain_time:.2f}s)")
+    print(f"  handler runs with dedup:    {dedup_runs:>7}  ({dedup_time:.2f}s)")
+    print(f"  saved: {plain_runs - dedup_runs} runs ({1 - dedup_runs / plain_runs:.1%})")
+
+    key = (1, "lesson_1", 1)
+    deduplicator.recent(key)
+    iterations = 200000
+    start = time.perf_counter()
+    for _ in range(iterations):
+        deduplicator.recent(key)
+    print(f"  lookup overhead: {(time.perf_counter() - start) / iterations * 1e6:.2f} us/press")
+    print(f"  keys held: {len(deduplicator)} (expire after the TTL)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: collapsing the startup backlog
+
+Builds the backlog a few hours of downtime leaves behind: users hammering
+/start or the menu buttons while the bot doesn't answer, mixed with users
+going through signup (/start, name, phone) and lesson answers. Reports
+how many updates collapse() drops and how long it takes. Also checks that
+only repeated taps in a row are dropped: a /start that begins a new flow
+after other updates from the same user is kept.
+
+Usage:
+    python benchmark_catch_up.py [--users 2000] [--updates 20]
+"""
+
+import time
+import random
+import argparse
+
+from telegram import Update
+
+from catch_up import collapse
+
+CHAT = {"id": 1, "type": "private"}
+
+
+class Backlog:
+    """Update dicts with increasing ids, as getUpdates returns them"""
+
+    def __init__(self):
+        self.updates = []
+
+    def message(self, user: int, text: str) -> None:
+        self._add(user, {"message": {
+            "message_id": len(self.updates) + 1, "date": 0, "chat": dict(CHAT, id=user),
+            "from": {"id": user, "is_bot": False, "first_name": "U"}, "text": text,
+        }})
+
+    def tap(self, user: int, data: str) -> None:
+        self._add(user, {"callback_query": {
+            "id": str(len(self.updates) + 1), "chat_instance": "c", "data": data,
+            "from": {"id": user, "is_bot": False, "first_name": "U"},
+        }})
+
+    def _add(self, user: int, body: dict) -> None:
+        self.updates.append(Update.de_json(dict(body, update_id=len(self.updates) + 1), None))
+
+
+def make_backlog(users: int, per_user: int, seed: int = 21) -> Backlog:
+    rng = random.Random(seed)
+    per_user_events = []
+    for user in range(1, users + 1):
+        events = []
+        while len(events) < per_user:
+            kind = rng.random()
+            if kind < 0.4:
+                events += [("message", "/start")] * rng.randint(1, 6)
+            elif kind < 0.6:
+                events += [("tap", "main_menu")] * rng.randint(1, 4)
+            elif kind < 0.8:
+                events += [("message", "/start"), ("message", "Ann"), ("message", "+100200300")]
+            else:
+                events += [("tap", f"answer_{rng.randint(0, 3)}") for _ in range(rng.randint(1, 5))]
+        per_user_events.append([(user, event) for event in events[:per_user]])
+    backlog = Backlog()
+    # Interleave users the way their updates arrive
+    queues = [events for events in per_user_events if events]
+    while queues:
+        events = rng.choice(queues)
+        user, (kind, value) = events.pop(0)
+        getattr(backlog, kind)(user, value)
+        if not events:
+            queues.remove(events)
+    return backlog
+
+
+def check_flows_kept() -> None:
+    backlog = Backlog()
+    backlog.message(7, "/start")
+    backlog.message(8, "/start")
+    backlog.message(7, "Ann")
+    backlog.message(7, "+100200300")
+    backlog.message(8, "/start")
+    backlog.message(7, "/start")
+    backlog.tap(7, "main_menu")
+    backlog.tap(7, "main_menu")
+    kept, dropped = collapse(backlog.updates)
+    # Only user 8's first /start and user 7's first main_menu are repeats in a row
+    assert [u.update_id for u in dropped] == [2, 7], [u.update_id for u in dropped]
+    assert [u.update_id for u in kept] == [1, 3, 4, 5, 6, 8]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--updates", type=int, default=20, help="backlog updates per user")
+    args = parser.parse_args()
+
+    check_flows_kept()
+    backlog = make_backlog(args.users, args.updates)
+    started = time.perf_counter()
+    kept, dropped = collapse(backlog.updates)
+    elapsed = time.perf_counter() - started
+
+    total = len(backlog.updates)
+    print(f"{args.users} users, {total:,} backlog updates")
+    print(f"  kept:      {len(kept):,}")
+    print(f"  collapsed: {len(dropped):,} ({len(dropped) / total:.0%})")
+    print(f"  collapse() took {elapsed * 1000:.1f} ms ({elapsed / total * 1e6:.2f} us per update)")
+
+
+if __name__ == "__main__":
+    main()
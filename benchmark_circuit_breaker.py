@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: Supabase outage with and without the circuit breaker
+
+Runs LessonRepository against a fake client that hangs during a simulated
+outage (a black-holed connection) and answers normally before and after
+it. Users keep opening lessons throughout; reports how long their queries
+take during the outage, how many hit the dead database and how soon after
+recovery queries go through again. Times are scaled down: the outage
+lasts seconds instead of minutes.
+
+Usage:
+    python benchmark_circuit_breaker.py [--users 50] [--outage 3] [--timeout 0.5]
+"""
+
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+from lesson_db import LessonRepository
+
+
+class FakeClient:
+    """Just enough of the Supabase query builder; hangs while ``down`` is set"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.down = False
+        self.calls = 0
+        self.calls_while_down = 0
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        self.calls += 1
+        if self.down:
+            self.calls_while_down += 1
+            # Worker thread stuck on a socket until the HTTP client gives up
+            time.sleep(self.latency * 40)
+            raise ConnectionError("connection timed out")
+        time.sleep(self.latency)
+        return type("Result", (), {"data": [], "count": 0})()
+
+
+async def run(args, breaker: bool):
+    client = FakeClient(args.latency)
+    repository = LessonRepository(
+        client, max_workers=args.workers, call_timeout=args.timeout,
+        failure_threshold=args.threshold if breaker else 10 ** 9,
+        reset_timeout=args.reset
+    )
+    during, after = [], []
+    outage_start, outage_end = 1.0, 1.0 + args.outage
+    end = outage_end + 2.0
+    recovered_at = None
+    start = time.perf_counter()
+
+    async def user(seed):
+        nonlocal recovered_at
+        rng = random.Random(seed)
+        while True:
+            await asyncio.sleep(rng.uniform(0.05, 0.3))
+            now = time.perf_counter() - start
+            if now >= end:
+                return
+            client.down = outage_start <= now < outage_end
+            began = time.perf_counter()
+            try:
+                await repository.get_questions(1)
+                ok = True
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - began
+            if outage_start <= now < outage_end:
+                during.append(elapsed)
+            elif now >= outage_end:
+                after.append(elapsed)
+                if ok and recovered_at is None:
+                    recovered_at = now - outage_end
+
+    await asyncio.gather(*(user(i) for i in range(args.users)))
+    repository.close()
+    return during, after, recovered_at, client.calls_while_down
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--outage", type=float, default=3.0, help="seconds the database is down")
+    parser.add_argument("--timeout", type=float, default=0.5, help="DB_CALL_TIMEOUT")
+    parser.add_argument("--threshold", type=int, default=5, help="DB_FAILURE_THRESHOLD")
+    parser.add_argument("--reset", type=float, default=0.5, help="DB_RESET_TIMEOUT")
+    parser.add_argument("--latency", type=float, default=0.01, help="healthy query time")
+    parser.add_argument("--workers", type=int, default=8, help="DB_MAX_WORKERS")
+    args = parser.parse_args()
+
+    print(f"{args.users} users, {args.outage:.1f}s outage, {args.timeout}s query timeout\n")
+    for label, breaker in (("no breaker (before)", False), ("circuit breaker", True)):
+        during, after, recovered_at, dead_calls = asyncio.run(run(args, breaker))
+        print(f"{label}:")
+        print(f"  during outage: {len(during)} queries, p50 {statistics.median(during) * 1000:.0f} ms, "
+              f"max {max(during) * 1000:.0f} ms, {dead_calls} reached the database")
+        recovered = f"{recovered_at:.2f}s" if recovered_at is not None else "not within the run"
+        print(f"  after outage:  p50 {statistics.median(after) * 1000:.0f} ms, "
+              f"first success after {recovered}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
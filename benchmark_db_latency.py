@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: handler latency for concurrent users with injected DB delay
+
+Compares calling the synchronous Supabase client straight on the event
+loop (old behaviour) with going through LessonRepository.
+No network access needed - a fake client sleeps to simulate PostgREST.
+
+Usage:
+    python benchmark_db_latency.py [--users 50] [--delays 0,0.02,0.1]
+"""
+
+import time
+import asyncio
+import argparse
+import statistics
+
+from lesson_db import LessonRepository
+
+
+class FakeResult:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    """Mimics the postgrest query builder; execute() blocks for `delay` seconds"""
+
+    def __init__(self, delay: float):
+        self._delay = delay
+
+    def __getattr__(self, name):
+        # select / eq / order / upsert ... all return the builder
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        time.sleep(self._delay)
+        return FakeResult([{"id": 1, "status": "confirmed", "is_completed": True}])
+
+
+class FakeClient:
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def table(self, name):
+        return FakeQuery(self.delay)
+
+
+QUERIES_PER_HANDLER = 3
+
+
+async def blocking_handler(client: FakeClient, arrival: float) -> float:
+    """Old style: sync execute() on the event loop"""
+    for _ in range(QUERIES_PER_HANDLER):
+        client.table("lessons").select("*").eq("lesson_number", 1).execute()
+    return time.perf_counter() - arrival
+
+
+async def repository_handler(repo: LessonRepository, arrival: float) -> float:
+    """New style: every query awaited through the repository"""
+    for _ in range(QUERIES_PER_HANDLER):
+        await repo.get_lesson(1)
+    return time.perf_counter() - arrival
+
+
+async def run_round(users: int, delay: float):
+    client = FakeClient(delay)
+
+    # All users arrive at the same moment; latency is measured from arrival.
+    # Blocking baseline: handlers are scheduled concurrently but the loop is
+    # held by each execute(), so users queue behind each other.
+    start = time.perf_counter()
+    blocking = await asyncio.gather(*(blocking_handler(client, start) for _ in range(users)))
+    blocking_wall = time.perf_counter() - start
+
+    repo = LessonRepository(client)
+    start = time.perf_counter()
+    pooled = await asyncio.gather(*(repository_handler(repo, start) for _ in range(users)))
+    pooled_wall = time.perf_counter() - start
+    repo.close()
+
+    return blocking, blocking_wall, pooled, pooled_wall
+
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _describe(values, wall: float) -> str:
+    return (
+        f"p50={statistics.median(values) * 1000:8.1f}ms  "
+        f"p95={_percentile(values, 95) * 1000:8.1f}ms  "
+        f"wall={wall * 1000:8.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="concurrent users")
+    parser.add_argument("--delays", default="0,0.02,0.1", help="comma-separated DB delays in seconds")
+    args = parser.parse_args()
+
+    delays = [float(d) for d in args.delays.split(",") if d.strip()]
+
+    print("=" * 70)
+    print(f"DB latency benchmark: {args.users} concurrent users, {QUERIES_PER_HANDLER} queries/handler")
+    print("=" * 70)
+    for delay in delays:
+        blocking, blocking_wall, pooled, pooled_wall = asyncio.run(run_round(args.users, delay))
+        print(f"\nInjected DB delay: {delay * 1000:.0f}ms")
+        print(f"  blocking   {_describe(blocking, blocking_wall)}")
+        print(f"  repository {_describe(pooled, pooled_wall)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: memory of concurrent exam sessions
+
+Compares the old per-user exam state (a private copy of every question
+row plus seven loose user_data keys) with ExamSession, which points at
+the shared question bank records, and the size of each as persisted
+(pickled user_data).
+
+Usage:
+    python benchmark_exam_memory.py [--sessions 10000] [--questions 5]
+"""
+
+import json
+import pickle
+import argparse
+import tracemalloc
+
+from lesson_cache import question_from_row
+from exam_session import EXAM_SESSION_KEY, ExamSession
+
+try:
+    from lessons_content_new import get_all_lessons
+except ImportError:
+    from lessons_content import get_all_lessons
+
+
+def build_question_rows(questions_per_lesson: int):
+    """Question rows shaped like the PostgREST response, from the local lessons"""
+    rows = []
+    question_id = 1
+    for lesson in get_all_lessons():
+        samples = lesson.get("questions") or []
+        if not samples:
+            continue
+        for number in range(1, questions_per_lesson + 1):
+            sample = samples[(number - 1) % len(samples)]
+            options = sample.get("options")
+            rows.append({
+                "id": question_id,
+                "lesson_id": lesson["lesson_number"],
+                "question_number": number,
+                "question_text": sample["question_text"],
+                "correct_answer": sample["correct_answer"],
+                "options": options if isinstance(options, str) or options is None else json.dumps(options, ensure_ascii=False),
+                "question_type": sample.get("question_type", "text"),
+                "explanation": sample.get("explanation"),
+                "created_at": "2025-12-01T00:00:00+00:00",
+            })
+            question_id += 1
+    return rows
+
+
+def group_by_lesson(rows):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row["lesson_id"], []).append(row)
+    return grouped
+
+
+def old_sessions(grouped_rows, count: int):
+    """Every exam start decoded a fresh JSON response: private copies of all rows"""
+    lesson_ids = sorted(grouped_rows)
+    payloads = {lesson_id: json.dumps(grouped_rows[lesson_id]) for lesson_id in lesson_ids}
+    sessions = []
+    for i in range(count):
+        lesson_id = lesson_ids[i % len(lesson_ids)]
+        sessions.append({
+            "exam_questions": json.loads(payloads[lesson_id]),
+            "exam_current_question": 2,
+            "exam_lesson_id": lesson_id,
+            "exam_lesson_number": lesson_id,
+            "exam_answers": [
+                {"question_id": 1, "user_answer": "3", "is_correct": True},
+                {"question_id": 2, "user_answer": "4", "is_correct": False},
+            ],
+            "exam_shown_answers": set(),
+            "waiting_exam_answer": True,
+        })
+    return sessions
+
+
+def new_sessions(bank, count: int):
+    lesson_ids = sorted(bank)
+    sessions = []
+    for i in range(count):
+        lesson_id = lesson_ids[i % len(lesson_ids)]
+        session = ExamSession(lesson_id, lesson_id, bank[lesson_id])
+        session.record_answer(0, "3", True)
+        session.record_answer(1, "4", False)
+        session.current = 2
+        sessions.append({EXAM_SESSION_KEY: session})
+    return sessions
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return result, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10000, help="concurrent exam sessions")
+    parser.add_argument("--questions", type=int, default=5, help="questions per lesson exam")
+    args = parser.parse_args()
+
+    rows = build_question_rows(max(2, args.questions))
+    grouped_rows = group_by_lesson(rows)
+
+    # Shared bank is built once, outside the measurement
+    bank = {
+        lesson_id: tuple(question_from_row(row) for row in lesson_rows)
+        for lesson_id, lesson_rows in grouped_rows.items()
+    }
+
+    old, old_size = measure(lambda: old_sessions(grouped_rows, args.sessions))
+    new, new_size = measure(lambda: new_sessions(bank, args.sessions))
+    old_stored = len(pickle.dumps(old[0], protocol=pickle.HIGHEST_PROTOCOL))
+    new_stored = len(pickle.dumps(new[0], protocol=pickle.HIGHEST_PROTOCOL))
+
+    print("=" * 70)
+    print(f"Exam session memory: {args.sessions} sessions, {max(2, args.questions)} questions each")
+    print("=" * 70)
+    print(f"  old user_data state : {old_size / 1024 / 1024:8.2f} MiB  ({old_size / args.sessions:8.0f} B/session)")
+    print(f"  ExamSession         : {new_size / 1024 / 1024:8.2f} MiB  ({new_size / args.sessions:8.0f} B/session)")
+    if new_size:
+        print(f"  reduction           : {old_size / new_size:8.1f}x")
+    print(f"  persisted per user  : {old_stored:8d} B -> {new_stored} B (question ids only)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: throughput with updates sharded over worker processes
+
+Generates mixed traffic from many users, splits it with shard_for (the
+ingress routing) and runs each shard in its own process with the same
+per-user KeyedSerializer the bot uses. Handlers spend part of their time
+on the CPU (rendering, pickling state) and part waiting on I/O, so one
+process is limited by its single core while several scale out. Reports
+throughput per worker count, the scaling efficiency, how evenly users
+spread over the shards and whether every user's updates stayed in order.
+
+Usage:
+    python benchmark_sharded_workers.py [--users 400] [--updates 10] [--workers 1,2,4]
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import multiprocessing
+
+from keyed_scheduler import KeyedSerializer
+from sharding import shard_for
+from benchmark_update_scheduler import make_traffic
+
+# CPU time per update in seconds (handler code, rendering, state pickling)
+CPU_TIME = 0.002
+
+
+def burn(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def run_shard(traffic, slots: int):
+    seen = {}
+    serializer = KeyedSerializer(slots)
+
+    async def handle(user: int, seq: int, io_time: float) -> None:
+        burn(CPU_TIME)
+        await asyncio.sleep(io_time)
+        seen.setdefault(user, []).append(seq)
+
+    tasks = [asyncio.create_task(serializer.run(user, handle(user, seq, io_time)))
+             for user, seq, io_time in traffic]
+    await asyncio.gather(*tasks)
+    return seen
+
+
+def worker(traffic, slots: int, start_barrier, results) -> None:
+    start_barrier.wait()
+    seen = asyncio.run(run_shard(traffic, slots))
+    ordered = all(seqs == sorted(seqs) for seqs in seen.values())
+    results.put((time.perf_counter(), sum(len(s) for s in seen.values()), ordered))
+
+
+def run(traffic, workers: int, slots: int):
+    shards = [[] for _ in range(workers)]
+    for item in traffic:
+        shards[shard_for(item[0], workers)].append(item)
+
+    start_barrier = multiprocessing.Barrier(workers + 1)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(shard, slots, start_barrier, results))
+                 for shard in shards]
+    for process in processes:
+        process.start()
+    start_barrier.wait()
+    start = time.perf_counter()
+    finished = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    elapsed = max(end for end, _, _ in finished) - start
+    handled = sum(count for _, count, _ in finished)
+    ordered = all(ok for _, _, ok in finished)
+    return elapsed, handled, ordered, [len(shard) for shard in shards]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=400)
+    parser.add_argument("--updates", type=int, default=10, help="updates per user")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--slots", type=int, default=16, help="UPDATE_CONCURRENCY per worker")
+    args = parser.parse_args()
+
+    traffic = make_traffic(args.users, args.updates)
+    print(f"{len(traffic)} updates from {args.users} users, {CPU_TIME * 1000:.0f} ms CPU per update, "
+          f"{os.cpu_count()} CPUs\n")
+    print(f"{'workers':>7} {'seconds':>8} {'updates/s':>10} {'speedup':>8} {'efficiency':>10} "
+          f"{'shard sizes':>24}  ordered")
+
+    baseline = None
+    for workers in (int(w) for w in args.workers.split(",")):
+        elapsed, handled, ordered, sizes = run(traffic, workers, args.slots)
+        assert handled == len(traffic)
+        rate = handled / elapsed
+        baseline = baseline or rate
+        speedup = rate / baseline
+        print(f"{workers:>7} {elapsed:>8.2f} {rate:>10.0f} {speedup:>7.2f}x {speedup / workers:>9.0%} "
+              f"{str(sizes):>24}  {'yes' if ordered else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: cold start of the bot process
+
+Imports workshop_signup_bot in fresh interpreters (the first thing a
+woken Railway/Render service does) and reports the median wall time plus
+an import-time breakdown from ``python -X importtime``. Also times the
+modules that are now loaded lazily, i.e. what the old eager startup paid
+on top. Needs the bot's requirements installed; no network is used.
+
+Usage:
+    python benchmark_startup.py [--runs 5] [--top 15]
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+# Loaded on first use instead of at import since the fast-start change
+LAZY_MODULES = ["supabase", "jdatetime", "lessons_content_new"]
+
+# Enough configuration for the module to import; nothing connects at import time
+BENCH_ENV = {
+    "BOT_TOKEN": "123456:benchmark",
+    "SUPABASE_URL": "https://example.supabase.co",
+    "SUPABASE_KEY": "benchmark",
+}
+
+
+def run_python(code: str, importtime: bool = False):
+    args = [sys.executable]
+    if importtime:
+        args += ["-X", "importtime"]
+    args += ["-c", code]
+    env = dict(os.environ, **BENCH_ENV)
+    start = time.perf_counter()
+    proc = subprocess.run(args, capture_output=True, text=True, env=env,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.perf_counter() - start, proc
+
+
+def wall_time(code: str, runs: int):
+    """Median wall time of running ``code`` in a fresh interpreter, or None if it fails"""
+    times = []
+    for _ in range(runs):
+        elapsed, proc = run_python(code)
+        if proc.returncode != 0:
+            return None, proc.stderr.strip().splitlines()[-1:]
+        times.append(elapsed)
+    return statistics.median(times), None
+
+
+def import_breakdown(module: str):
+    """Direct imports of ``module`` as (cumulative us, self us, name), its total, and every module loaded"""
+    _, proc = run_python(f"import {module}", importtime=True)
+    rows = []
+    children = []
+    loaded = set()
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        loaded.add(name.strip())
+        # Nesting is shown by two spaces per level; level 1 = imported by ``module`` itself
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        # Children are printed before their parent
+        if depth == 1:
+            children.append((int(cumulative_us), int(self_us), name.strip()))
+        elif depth == 0:
+            if name.strip() == module:
+                rows, total_us = children, int(cumulative_us)
+            children = []
+    return sorted(rows, reverse=True), total_us, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    baseline, _ = wall_time("pass", args.runs)
+    print(f"Interpreter start:            {baseline * 1000:8.1f} ms")
+
+    bot_time, error = wall_time("import workshop_signup_bot", args.runs)
+    if bot_time is None:
+        print(f"Bot import failed: {' '.join(error)}")
+        print("Install requirements.txt to benchmark the startup path.")
+        return
+    print(f"Bot module import (median):   {bot_time * 1000:8.1f} ms")
+
+    print("\nDeferred modules (previously imported at startup):")
+    deferred_total = 0.0
+    for module in LAZY_MODULES:
+        elapsed, error = wall_time(f"import {module}", args.runs)
+        if elapsed is None:
+            print(f"  {module:<24} not importable ({' '.join(error)})")
+            continue
+        cost = max(0.0, elapsed - baseline)
+        deferred_total += cost
+        print(f"  {module:<24} {cost * 1000:8.1f} ms")
+    print(f"  {'total':<24} {deferred_total * 1000:8.1f} ms (upper bound - shared deps are counted per module)")
+
+    rows, total_us, loaded = import_breakdown("workshop_signup_bot")
+    print(f"\nTop {args.top} imports by cumulative time ({total_us / 1000:.1f} ms in total):")
+    print(f"  {'module':<36} {'cumulative':>12} {'self':>10}")
+    for cumulative, self_us, name in rows[:args.top]:
+        print(f"  {name:<36} {cumulative / 1000:9.1f} ms {self_us / 1000:7.1f} ms")
+
+    eager = [module for module in LAZY_MODULES if module in loaded]
+    if eager:
+        print(f"\n⚠️  Still imported at startup: {', '.join(eager)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: update throughput with per-user ordering
+
+Simulates mixed bot traffic - menu taps, exam answers and slow lesson
+deliveries from many users - and compares serial processing (the old
+Application without concurrent updates) with KeyedSerializer. Also
+verifies that every user's updates were handled in the order they arrived.
+
+Usage:
+    python benchmark_update_scheduler.py [--users 200] [--updates 5] [--slots 1,4,16,64]
+"""
+
+import time
+import random
+import asyncio
+import argparse
+
+from keyed_scheduler import KeyedSerializer
+
+# (kind, share of traffic, simulated handler time in seconds)
+TRAFFIC_MIX = [
+    ("menu", 0.40, 0.005),
+    ("exam_answer", 0.45, 0.010),
+    ("send_lesson", 0.15, 0.050),
+]
+
+
+def make_traffic(users: int, updates_per_user: int, seed: int = 7):
+    """Interleaved (user, sequence number, handler time) tuples"""
+    rng = random.Random(seed)
+    kinds = [kind for kind, _, _ in TRAFFIC_MIX]
+    weights = [share for _, share, _ in TRAFFIC_MIX]
+    durations = {kind: duration for kind, _, duration in TRAFFIC_MIX}
+    pending = {user: 0 for user in range(users)}
+    traffic = []
+    while pending:
+        user = rng.choice(list(pending))
+        kind = rng.choices(kinds, weights)[0]
+        traffic.append((user, pending[user], durations[kind]))
+        pending[user] += 1
+        if pending[user] == updates_per_user:
+            del pending[user]
+    return traffic
+
+
+async def handle(user: int, seq: int, duration: float, seen: dict) -> None:
+    # Handler time is I/O (Telegram / database), not CPU
+    await asyncio.sleep(duration)
+    seen.setdefault(user, []).append(seq)
+
+
+async def run_serial(traffic):
+    seen = {}
+    start = time.perf_counter()
+    for user, seq, duration in traffic:
+        await handle(user, seq, duration, seen)
+    return time.perf_counter() - start, seen
+
+
+async def run_keyed(traffic, slots: int):
+    seen = {}
+    serializer = KeyedSerializer(slots)
+    start = time.perf_counter()
+    # Like PTB: one task per update, created in arrival order
+    tasks = [asyncio.create_task(serializer.run(user, handle(user, seq, duration, seen)))
+             for user, seq, duration in traffic]
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - start, seen
+
+
+def ordered(seen: dict) -> bool:
+    return all(seqs == sorted(seqs) for seqs in seen.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=5, help="updates per user")
+    parser.add_argument("--slots", default="1,4,16,64", help="comma-separated concurrency levels")
+    args = parser.parse_args()
+
+    traffic = make_traffic(args.users, args.updates)
+    total = len(traffic)
+
+    print("=" * 70)
+    print(f"Update throughput: {args.users} users x {args.updates} updates = {total} updates")
+    print("=" * 70)
+
+    elapsed, seen = asyncio.run(run_serial(traffic))
+    print(f"  serial (old)      {total / elapsed:9.1f} updates/s   ordered={ordered(seen)}")
+    for slots in [int(s) for s in args.slots.split(",") if s.strip()]:
+        elapsed, seen = asyncio.run(run_keyed(traffic, slots))
+        print(f"  keyed, {slots:3d} slots  {total / elapsed:9.1f} updates/s   ordered={ordered(seen)}")
+
+
+if __name__ == '__main__':
+    main()
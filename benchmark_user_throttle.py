@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: per-user throttle against spamming users
+
+Simulates a minute of traffic on a simulated clock: regular users tapping
+a database-backed button every few seconds and a few users spamming
+/start and lesson buttons. Reports how many requests reach the handlers
+(and Supabase) per group, the memory the throttle holds per tracked user
+and the cost of one check.
+
+Usage:
+    python benchmark_user_throttle.py [--users 2000] [--spammers 20] [--spam-rate 10]
+"""
+
+import time
+import random
+import argparse
+import tracemalloc
+
+from user_throttle import USER_BURST, USER_RATE, UserThrottle
+
+DURATION = 60.0
+
+
+def make_events(users: int, spammers: int, spam_rate: float, seed: int = 24):
+    """(time, user, is_spammer) sorted by time"""
+    rng = random.Random(seed)
+    events = []
+    for user in range(users):
+        t = rng.uniform(0, 5)
+        while t < DURATION:
+            events.append((t, user, False))
+            t += rng.uniform(3, 15)
+    for spammer in range(users, users + spammers):
+        t = rng.uniform(0, 1)
+        while t < DURATION:
+            events.append((t, spammer, True))
+            t += rng.expovariate(spam_rate)
+    events.sort()
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--spammers", type=int, default=20)
+    parser.add_argument("--spam-rate", type=float, default=10, help="requests per second per spammer")
+    args = parser.parse_args()
+
+    events = make_events(args.users, args.spammers, args.spam_rate)
+    throttle = UserThrottle()
+    sent = {False: 0, True: 0}
+    allowed = {False: 0, True: 0}
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for t, user, spammer in events:
+        sent[spammer] += 1
+        if throttle.allow(user, now=t):
+            allowed[spammer] += 1
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    print(f"{DURATION:.0f}s of traffic, budget {USER_RATE}/s with a burst of {USER_BURST:.0f}")
+    for spammer, label in ((False, f"{args.users} regular users"), (True, f"{args.spammers} spammers")):
+        print(f"  {label:<20} sent {sent[spammer]:>6}  reached handlers {allowed[spammer]:>6} "
+              f"({allowed[spammer] / max(1, sent[spammer]):.0%})")
+    total_sent, total_allowed = sum(sent.values()), sum(allowed.values())
+    print(f"  database-backed requests saved: {total_sent - total_allowed} of {total_sent}")
+    print(f"  tracked users: {len(throttle)}, ~{held / max(1, len(throttle)):.0f} bytes each")
+
+    iterations = 200000
+    start = time.perf_counter()
+    for i in range(iterations):
+        throttle.allow(i % 1000)
+    print(f"  check cost: {(time.perf_counter() - start) / iterations * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal in-process metrics for the learning bot
+Counters and gauges are registered by name and can be dumped as text
+(Prometheus exposition format) or as a dict for logging
+"""
+
+import threading
+from typing import Dict, Union
+
+
+class Counter:
+    """Monotonically increasing value"""
+
+    __slots__ = ("name", "help", "_value", "_lock")
+
+    def __init__(self, name: str, help: str = ""):
+        self.name = name
+        self.help = help
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: Union[int, float] = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> Union[int, float]:
+        return self._value
+
+
+class Gauge:
+    """Value that can go up and down"""
+
+    __slots__ = ("name", "help", "_value", "_lock")
+
+    def __init__(self, name: str, help: str = ""):
+        self.name = name
+        self.help = help
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value: Union[int, float]) -> None:
+        self._value = value
+
+    def inc(self, amount: Union[int, float] = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: Union[int, float] = 1) -> None:
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self) -> Union[int, float]:
+        return self._value
+
+
+_registry: Dict[str, Union[Counter, Gauge]] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(cls, name: str, help: str):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, help)
+            _registry[name] = metric
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} already registered as {type(metric).__name__}")
+        return metric
+
+
+def counter(name: str, help: str = "") -> Counter:
+    """Get or register a counter"""
+    return _get_or_create(Counter, name, help)
+
+
+def gauge(name: str, help: str = "") -> Gauge:
+    """Get or register a gauge"""
+    return _get_or_create(Gauge, name, help)
+
+
+def snapshot() -> Dict[str, Union[int, float]]:
+    """Current value of every registered metric"""
+    with _registry_lock:
+        return {name: metric.value for name, metric in sorted(_registry.items())}
+
+
+def render_text() -> str:
+    """Render all metrics in Prometheus text exposition format
+
+    Labels may be embedded in the metric name, e.g.
+    ``bot_api_calls_total{endpoint="sendMessage"}``.
+    """
+    lines = []
+    seen_families = set()
+    with _registry_lock:
+        metrics = sorted(_registry.items())
+    for name, metric in metrics:
+        family = name.split("{", 1)[0]
+        if family not in seen_families:
+            seen_families.add(family)
+            kind = "counter" if isinstance(metric, Counter) else "gauge"
+            if metric.help:
+                lines.append(f"# HELP {family} {metric.help}")
+            lines.append(f"# TYPE {family} {kind}")
+        lines.append(f"{name} {metric.value}")
+    return "\n".join(lines) + "\n"
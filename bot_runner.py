@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Process lifecycle for the learning bot
+Connects the application's own bot (no throwaway Bot just for getMe)
+and runs polling on the same event loop as the startup work
+"""
+
+import signal
+import asyncio
+import logging
+from typing import Optional
+
+from telegram import Bot, Update
+from telegram.ext import Application
+
+from catch_up import UpdateWatermark, catch_up
+
+logger = logging.getLogger(__name__)
+
+
+def stop_signal_event() -> asyncio.Event:
+    """Event set on SIGINT/SIGTERM (must be called inside the running loop)"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: fall back to KeyboardInterrupt
+            pass
+    return stop_event
+
+
+async def connect_bot(bot: Bot, max_retries: int = 3) -> bool:
+    """Initialize ``bot`` (this calls getMe), retrying on network errors
+
+    The initialized bot is the one the application keeps using -
+    Application.initialize() skips bots that are already initialized.
+    """
+    for attempt in range(max_retries):
+        try:
+            logger.info(f"Testing connection to Telegram API (attempt {attempt + 1}/{max_retries})...")
+            await bot.initialize()
+            logger.info(f"✅ Connection successful! Bot: @{bot.username}")
+            return True
+        except Exception as e:
+            error_msg = str(e)
+            if attempt < max_retries - 1:
+                wait_time = (attempt + 1) * 2
+                logger.warning(f"⚠️  Connection failed (attempt {attempt + 1}/{max_retries}): {error_msg[:100]}")
+                logger.info(f"⏳ Retrying in {wait_time} seconds...")
+                await asyncio.sleep(wait_time)
+            else:
+                logger.error(f"❌ Failed to connect after {max_retries} attempts")
+                logger.error(f"Error: {error_msg}")
+    return False
+
+
+async def run_polling(application: Application, watermark: Optional[UpdateWatermark] = None) -> None:
+    """Long-poll getUpdates until SIGINT/SIGTERM
+
+    Same steps as Application.run_polling, but inside the caller's event
+    loop so a bot initialized during startup is reused. With a
+    ``watermark`` the updates that queued up while the bot was down are
+    processed first; without one they are dropped.
+    """
+    stop_event = stop_signal_event()
+    tasks = []
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+
+        if watermark is not None:
+            await application.start()
+            try:
+                report = await catch_up(application, watermark)
+            except Exception as e:
+                # Polling picks the backlog up anyway, only without collapsing
+                logger.warning(f"⚠️  Backlog catch-up failed: {e}")
+                report = None
+            if report is not None:
+                tasks.append(report)
+            tasks.append(asyncio.create_task(watermark.run()))
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        else:
+            # drop_pending_updates also deletes a previously registered webhook
+            await application.updater.start_polling(
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True
+            )
+            await application.start()
+
+        try:
+            await stop_event.wait()
+        finally:
+            logger.info("⏹  Stopping polling...")
+            if application.updater.running:
+                await application.updater.stop()
+            await application.stop()
+            for task in tasks:
+                task.cancel()
+            if watermark is not None:
+                watermark.save()
+
+    if application.post_shutdown:
+        await application.post_shutdown(application)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Warm-start snapshot of the bot's caches
+The lesson catalog, question bank, cached progress and registration index
+are written to a compressed file on shutdown and at intervals, and loaded
+on boot so the first requests after a wake-up are served from memory
+"""
+
+import os
+import gzip
+import json
+import time
+import asyncio
+import logging
+from typing import Optional, Set
+
+import bot_metrics
+
+logger = logging.getLogger(__name__)
+
+# Snapshot file; put it on a persistent disk to survive redeploys
+CACHE_SNAPSHOT_PATH = os.environ.get("CACHE_SNAPSHOT_PATH", "cache_snapshot.json.gz").strip()
+# Seconds between periodic snapshots (0 = only on shutdown)
+CACHE_SNAPSHOT_INTERVAL = float(os.environ.get("CACHE_SNAPSHOT_INTERVAL", "600"))
+
+# Bump when the layout changes; older snapshots are ignored
+SNAPSHOT_FORMAT = 2
+
+snapshot_saves = bot_metrics.counter("cache_snapshot_saves_total", "Cache snapshots written")
+snapshot_restored = bot_metrics.counter("cache_snapshot_restored_total", "Boots that restored the cache snapshot")
+snapshot_rejected = bot_metrics.counter("cache_snapshot_rejected_total", "Snapshots ignored (stale, unreadable or other format)")
+
+
+class CacheSnapshot:
+    """Saves and restores the caches to and from ``path``
+
+    The catalog is only trusted if the database lesson watermark still
+    matches the one it was loaded with, and the question bank only if the
+    questions watermark does too. When the database is unreachable the
+    snapshot is still better than local content, so it is installed as
+    stale and revalidated on first use.
+    Cached progress is restored only while it would not have been evicted
+    as idle anyway; confirmed registrations are never revoked, so they are
+    always restored.
+    """
+
+    def __init__(self, repository, catalog, question_bank, progress, registrations,
+                 path: str = CACHE_SNAPSHOT_PATH, progress_max_age: Optional[float] = None):
+        self._repository = repository
+        self._catalog = catalog
+        self._question_bank = question_bank
+        self._progress = progress
+        self._registrations = registrations
+        self._path = path
+        self._progress_max_age = progress_max_age
+        self._saving = asyncio.Lock()
+
+    def _build(self) -> Optional[dict]:
+        catalog = self._catalog.export_state()
+        if catalog is None:
+            return None
+        return {
+            "format": SNAPSHOT_FORMAT,
+            "saved_at": time.time(),
+            "catalog": catalog,
+            "questions": self._question_bank.export_state(),
+            "progress": self._progress.export_state(),
+            "registrations": self._registrations.export_state(),
+        }
+
+    def _write(self, snapshot: dict) -> int:
+        payload = json.dumps(snapshot, ensure_ascii=False, separators=(",", ":"), default=str)
+        data = gzip.compress(payload.encode("utf-8"), compresslevel=6)
+        # Write next to the target and rename, so a crash never leaves half a file
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path)
+        return len(data)
+
+    async def save(self) -> bool:
+        """Write the snapshot without blocking the event loop"""
+        snapshot = self._build()
+        if snapshot is None:
+            return False
+        async with self._saving:
+            try:
+                size = await asyncio.get_running_loop().run_in_executor(None, self._write, snapshot)
+            except OSError as e:
+                logger.warning(f"⚠️  Could not write cache snapshot: {e}")
+                return False
+        snapshot_saves.inc()
+        logger.info(f"💾 Cache snapshot saved: {self._path} ({size / 1024:.1f} KiB)")
+        return True
+
+    def _read(self) -> Optional[dict]:
+        try:
+            with open(self._path, "rb") as f:
+                snapshot = json.loads(gzip.decompress(f.read()).decode("utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError) as e:
+            snapshot_rejected.inc()
+            logger.warning(f"⚠️  Ignoring unreadable cache snapshot: {e}")
+            return None
+        if snapshot.get("format") != SNAPSHOT_FORMAT:
+            snapshot_rejected.inc()
+            logger.info("ℹ️  Ignoring cache snapshot written in another format")
+            return None
+        return snapshot
+
+    async def restore(self) -> Set[str]:
+        """Load the snapshot into the caches; returns the names of the parts restored"""
+        snapshot = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        if snapshot is None:
+            return set()
+
+        restored = set()
+        catalog = snapshot["catalog"]
+        saved_watermark = catalog.get("watermark")
+        # Local content ships with the code and loads fast - only database content is restored
+        if self._repository.available and saved_watermark is not None:
+            try:
+                current = await self._repository.get_lessons_watermark()
+                trusted, stale = tuple(current) == tuple(saved_watermark), False
+            except Exception as e:
+                # Database down: serve the snapshot rather than local content, check again later
+                logger.warning(f"⚠️  Could not validate cache snapshot: {e}")
+                trusted, stale = True, True
+
+            if trusted:
+                self._catalog.restore(catalog, stale=stale)
+                restored.add("catalog")
+                if await self._restore_questions(snapshot.get("questions"), stale):
+                    restored.add("questions")
+            else:
+                snapshot_rejected.inc()
+                logger.info("ℹ️  Lesson content changed since the snapshot; loading it fresh")
+
+        age = time.time() - snapshot.get("saved_at", 0)
+        if self._progress_max_age is None or age < self._progress_max_age:
+            self._progress.restore(snapshot.get("progress") or [])
+            restored.add("progress")
+        self._registrations.restore(snapshot.get("registrations") or [])
+        restored.add("registrations")
+
+        snapshot_restored.inc()
+        logger.info(f"✅ Cache snapshot restored ({', '.join(sorted(restored))}; {age:.0f}s old)")
+        return restored
+
+    async def _restore_questions(self, questions: Optional[dict], stale: bool) -> bool:
+        """Install the saved question bank if the questions watermark still matches"""
+        saved_watermark = (questions or {}).get("watermark")
+        if saved_watermark is None:
+            return False
+        if not stale:
+            try:
+                current = await self._repository.get_questions_watermark()
+            except Exception as e:
+                logger.warning(f"⚠️  Could not validate saved questions: {e}")
+                stale = True
+            else:
+                if tuple(current) != tuple(saved_watermark):
+                    logger.info("ℹ️  Questions changed since the snapshot; loading them fresh")
+                    return False
+        return self._question_bank.restore(questions, stale=stale) > 0
+
+    async def run(self, interval: float = CACHE_SNAPSHOT_INTERVAL) -> None:
+        """Save the snapshot every ``interval`` seconds until cancelled"""
+        if interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.save()
+            except Exception as e:
+                logger.error(f"Error saving cache snapshot: {e}", exc_info=True)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Suppression of repeated inline button presses
+A double tap on a button delivers two identical callback queries; only
+the first one runs the handler, the repeat is just acknowledged
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+import bot_metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds an identical press (same user, button data and message) counts as a repeat
+CALLBACK_DEDUP_TTL = float(os.environ.get("CALLBACK_DEDUP_TTL", "3"))
+
+duplicates_suppressed = bot_metrics.counter("callback_duplicates_total", "Repeated button presses not handled again")
+duplicates_coalesced = bot_metrics.counter("callback_coalesced_total", "Repeated presses that waited for the first one")
+
+_MISSING = object()
+
+
+class CallbackDeduplicator:
+    """Runs a coroutine once per key within ``ttl`` seconds
+
+    A repeat that arrives while the first call is still running waits for
+    it and gets its result; a repeat within ``ttl`` after it finished gets
+    the result straight away. A call that raised is forgotten, so the
+    next press runs again.
+    """
+
+    def __init__(self, ttl: float = CALLBACK_DEDUP_TTL):
+        self._ttl = ttl
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        # key -> (expires_at, result); insertion order is expiry order
+        self._finished: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def _prune(self, now: float) -> None:
+        while self._finished:
+            key, (expires_at, _) = next(iter(self._finished.items()))
+            if expires_at > now:
+                break
+            del self._finished[key]
+
+    def recent(self, key: Hashable) -> Any:
+        """Result of a finished call for ``key`` within the TTL, else _MISSING"""
+        now = time.monotonic()
+        self._prune(now)
+        entry = self._finished.get(key)
+        return _MISSING if entry is None else entry[1]
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Tuple[bool, Any]:
+        """(True, result) if ``call`` ran, (False, first result) for a repeat"""
+        result = self.recent(key)
+        if result is not _MISSING:
+            duplicates_suppressed.inc()
+            return False, result
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            duplicates_suppressed.inc()
+            duplicates_coalesced.inc()
+            return False, await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await call()
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting for it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            self._finished[key] = (time.monotonic() + self._ttl, result)
+            self._finished.move_to_end(key)
+            return True, result
+        finally:
+            del self._in_flight[key]
+
+    def __len__(self) -> int:
+        return len(self._finished) + len(self._in_flight)
+
+
+callback_deduplicator = CallbackDeduplicator()
+
+
+def deduplicated(func):
+    """Decorator for callback query handlers: a repeated press is only acknowledged"""
+    @wraps(func)
+    async def wrapper(update, context, *args, **kwargs):
+        query = update.callback_query
+        if query is None or query.message is None:
+            return await func(update, context, *args, **kwargs)
+        key = (query.from_user.id, query.data, query.message.message_id)
+        ran, result = await callback_deduplicator.run(key, lambda: func(update, context, *args, **kwargs))
+        if not ran:
+            logger.debug(f"Ignored repeated press of {query.data!r} by user {query.from_user.id}")
+            try:
+                # Stop the button's loading spinner; the first press did the work
+                await query.answer()
+            except Exception:
+                pass
+        return result
+    return wrapper
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Startup catch-up of updates sent while the bot was down
+Instead of dropping the pending updates, the backlog is fetched in large
+batches, repeated navigation taps are collapsed and the rest is handled
+like live traffic (parallel across users, in order per user). Fetching
+the next batch confirms the previous one to Telegram, so every batch is
+spooled to disk first and a crash mid-drain resumes from the spool
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+import bot_metrics
+
+logger = logging.getLogger(__name__)
+
+# Process the updates queued while the bot was down (0 = drop them, the old behaviour)
+CATCH_UP = os.environ.get("CATCH_UP", "1").strip().lower() not in ("0", "false", "no")
+# Oldest-first cap on the backlog taken at startup; the rest arrives through normal polling
+CATCH_UP_MAX_UPDATES = int(os.environ.get("CATCH_UP_MAX_UPDATES", "5000"))
+# File holding the id of the last fully processed update (empty = don't persist it)
+UPDATE_OFFSET_PATH = os.environ.get("UPDATE_OFFSET_PATH", "update_offset.json").strip()
+# Seconds between saves of the processed update id
+UPDATE_OFFSET_INTERVAL = float(os.environ.get("UPDATE_OFFSET_INTERVAL", "5"))
+# After a week without updates Telegram starts update ids from a random number,
+# so an older saved id no longer says which updates were processed
+UPDATE_OFFSET_MAX_AGE = 7 * 24 * 3600
+# File holding the fetched backlog until it is drained (empty = don't spool it)
+UPDATE_BACKLOG_PATH = os.environ.get("UPDATE_BACKLOG_PATH", "update_backlog.jsonl").strip()
+
+# getUpdates returns at most 100 updates per call
+BATCH_SIZE = 100
+
+# Taps that only navigate; of several identical ones in a row from a user, the last is enough
+COLLAPSIBLE_COMMANDS = frozenset({"/start", "/lessons", "/progress"})
+COLLAPSIBLE_CALLBACKS = frozenset({"lessons_menu", "main_menu", "my_progress"})
+
+backlog_fetched = bot_metrics.counter("catch_up_fetched_total", "Backlog updates fetched at startup")
+backlog_collapsed = bot_metrics.counter("catch_up_collapsed_total", "Backlog updates dropped as repeated navigation taps")
+backlog_skipped = bot_metrics.counter("catch_up_skipped_total", "Backlog updates skipped as already processed")
+backlog_resumed = bot_metrics.counter("catch_up_resumed_total", "Backlog updates read back from the spool after a restart")
+watermark_resets = bot_metrics.counter("catch_up_watermark_resets_total", "Saved update ids ignored as out of date")
+drain_rate = bot_metrics.gauge("catch_up_drain_rate", "Updates per second while draining the last backlog")
+
+
+class UpdateWatermark:
+    """Highest update id up to which every update has been processed
+
+    Updates run in parallel across users, so they finish out of order;
+    the watermark only moves past an update once it and all earlier ones
+    are done. It is saved to ``path`` so that a restart skips updates
+    that are delivered again - by Telegram when the crash came before
+    they were confirmed, or from the BacklogSpool. The save time is
+    stored with it, since update ids may start over after a quiet week.
+    """
+
+    def __init__(self, path: str = UPDATE_OFFSET_PATH):
+        self._path = path
+        self._in_flight: Set[int] = set()
+        self._highest = 0
+        self._saved = 0
+        self._saved_at: Optional[float] = None
+
+    @property
+    def persistent(self) -> bool:
+        return bool(self._path)
+
+    @property
+    def age(self) -> float:
+        """Seconds since the loaded value was saved (infinite if none was)"""
+        if self._saved_at is None:
+            return float("inf")
+        return time.time() - self._saved_at
+
+    @property
+    def value(self) -> int:
+        if self._in_flight:
+            return min(self._in_flight) - 1
+        return self._highest
+
+    def started(self, update_id: int) -> None:
+        self._in_flight.add(update_id)
+        if update_id > self._highest:
+            self._highest = update_id
+
+    def finished(self, update_id: int) -> None:
+        self._in_flight.discard(update_id)
+
+    def load(self) -> int:
+        if not self._path:
+            return 0
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._highest = self._saved = int(data["last_update_id"])
+            self._saved_at = float(data["saved_at"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"⚠️  Ignoring unreadable {self._path}: {e}")
+        return self._highest
+
+    def reset(self) -> None:
+        """Forget the loaded value; only call before any update has started"""
+        self._highest = self._saved = 0
+        self._saved_at = None
+
+    def save(self) -> None:
+        value = self.value
+        if not self._path or value == self._saved:
+            return
+        tmp_path = f"{self._path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"last_update_id": value, "saved_at": time.time()}, f)
+            os.replace(tmp_path, self._path)
+            self._saved = value
+        except OSError as e:
+            logger.warning(f"⚠️  Could not save processed update id: {e}")
+
+    async def run(self, interval: float = UPDATE_OFFSET_INTERVAL) -> None:
+        """Save every ``interval`` seconds until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            self.save()
+
+    async def wait_for(self, update_id: int, poll: float = 0.2) -> None:
+        while self.value < update_id:
+            await asyncio.sleep(poll)
+
+
+class BacklogSpool:
+    """Fetched backlog updates kept on disk until they are processed
+
+    One update JSON per line, appended batch by batch before the next
+    getUpdates call confirms the batch. A line cut short by a crash is
+    skipped on load.
+    """
+
+    def __init__(self, path: str = UPDATE_BACKLOG_PATH):
+        self._path = path
+
+    def load(self, bot) -> List[Update]:
+        if not self._path:
+            return []
+        updates = []
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        updates.append(Update.de_json(json.loads(line), bot))
+                    except (ValueError, TypeError, KeyError):
+                        continue
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"⚠️  Could not read {self._path}: {e}")
+        return updates
+
+    def append(self, updates: List[Update]) -> None:
+        """Write ``updates`` durably; raises OSError if that fails"""
+        if not self._path or not updates:
+            return
+        lines = [json.dumps(update.to_dict(), ensure_ascii=False, separators=(",", ":")) + "\n"
+                 for update in updates]
+        with open(self._path, "ab+") as f:
+            # Terminate a line cut short by a crash, so it doesn't swallow the next one
+            if f.seek(0, os.SEEK_END) and (f.seek(-1, os.SEEK_END), f.read(1))[1] != b"\n":
+                f.write(b"\n")
+            f.write("".join(lines).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self) -> None:
+        if not self._path:
+            return
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"⚠️  Could not remove {self._path}: {e}")
+
+
+def collapse_key(update: Update) -> Optional[Tuple[int, Hashable]]:
+    """(user, tap) for navigation-only updates, None for everything else"""
+    user = update.effective_user
+    if user is None:
+        return None
+    if update.message and update.message.text:
+        command = update.message.text.split(maxsplit=1)[0].split("@", 1)[0]
+        if command in COLLAPSIBLE_COMMANDS and command == update.message.text.strip():
+            return user.id, command
+    elif update.callback_query and update.callback_query.data in COLLAPSIBLE_CALLBACKS:
+        return user.id, update.callback_query.data
+    return None
+
+
+def collapse(updates: List[Update]) -> Tuple[List[Update], List[Update]]:
+    """Split a backlog into (kept, dropped)
+
+    A tap is dropped only when the same user's next update is the same
+    tap, so a run of identical taps keeps its last one and a tap that
+    starts a new flow (/start, name, phone, /start) is never lost.
+    """
+    # User id -> collapse key of that user's next update (None = not collapsible)
+    following: Dict[int, Optional[Tuple[int, Hashable]]] = {}
+    dropped_ids: Set[int] = set()
+    for update in reversed(updates):
+        user = update.effective_user
+        if user is None:
+            continue
+        key = collapse_key(update)
+        if key is not None and following.get(user.id) == key:
+            dropped_ids.add(update.update_id)
+        following[user.id] = key
+    kept, dropped = [], []
+    for update in updates:
+        (dropped if update.update_id in dropped_ids else kept).append(update)
+    return kept, dropped
+
+
+async def fetch_backlog(application: Application, max_updates: int = CATCH_UP_MAX_UPDATES,
+                        spool: Optional[BacklogSpool] = None) -> List[Update]:
+    """Pull pending updates in batches of 100, oldest first, and confirm them
+
+    Each batch is written to ``spool`` before the next call confirms it,
+    so a crash before the backlog is processed doesn't lose it.
+    """
+    bot = application.bot
+    # getUpdates is refused while a webhook is set; keep its pending updates
+    await bot.delete_webhook(drop_pending_updates=False)
+    updates: List[Update] = []
+    offset = 0
+    while len(updates) < max_updates:
+        batch = await bot.get_updates(offset=offset, limit=BATCH_SIZE, timeout=0,
+                                      allowed_updates=Update.ALL_TYPES)
+        if not batch:
+            break
+        if spool is not None:
+            spool.append(batch)
+        updates.extend(batch)
+        offset = batch[-1].update_id + 1
+    if updates:
+        # Confirm the fetched updates, so polling starts after them
+        await bot.get_updates(offset=offset, limit=1, timeout=0, allowed_updates=Update.ALL_TYPES)
+    return updates
+
+
+def watermark_outdated(watermark: UpdateWatermark, processed: int, fetched: List[Update],
+                       max_updates: int = CATCH_UP_MAX_UPDATES) -> bool:
+    """True if skipping fetched updates at or below ``processed`` could drop new ones
+
+    Telegram only delivers an update at or below the saved id again when
+    it wasn't confirmed before a crash, which leaves it close below. Ids
+    that are further down, or any such ids after more than a week, mean
+    the ids started over.
+    """
+    if not processed or not fetched or fetched[0].update_id > processed:
+        # Nothing would be skipped
+        return False
+    return watermark.age > UPDATE_OFFSET_MAX_AGE or fetched[0].update_id < processed - max_updates
+
+
+async def catch_up(application: Application, watermark: UpdateWatermark,
+                   max_updates: int = CATCH_UP_MAX_UPDATES,
+                   spool: Optional[BacklogSpool] = None) -> Optional[asyncio.Task]:
+    """Queue the backlog for processing; returns a task that logs the drain rate
+
+    Must run after application.start() and before polling starts, so the
+    backlog is queued ahead of any new update. Updates spooled by an
+    earlier run that crashed mid-drain are queued first; the spool is only
+    used with a saved watermark, which tells which of them were processed.
+    A watermark that doesn't fit the pending update ids is ignored.
+    """
+    if spool is None:
+        spool = BacklogSpool() if watermark.persistent else BacklogSpool("")
+    processed = watermark.load()
+    started = time.perf_counter()
+    spooled = spool.load(application.bot)
+    fetched = await fetch_backlog(application, max_updates, spool)
+    backlog_fetched.inc(len(fetched))
+    if watermark_outdated(watermark, processed, fetched, max_updates):
+        # The spool belongs to the old ids and would push the watermark back up
+        logger.warning(f"⚠️  Ignoring saved update id {processed}: pending updates start at "
+                       f"{fetched[0].update_id}; dropping {len(spooled)} spooled updates")
+        watermark_resets.inc()
+        watermark.reset()
+        processed = 0
+        spooled = []
+        spool.clear()
+        spool.append(fetched)
+    by_id = {update.update_id: update for update in spooled}
+    by_id.update((update.update_id, update) for update in fetched)
+    updates = [by_id[update_id] for update_id in sorted(by_id)]
+
+    fresh = [update for update in updates if update.update_id > processed]
+    backlog_skipped.inc(len(updates) - len(fresh))
+    backlog_resumed.inc(sum(1 for update in spooled if update.update_id > processed))
+    kept, dropped = collapse(fresh)
+    backlog_collapsed.inc(len(dropped))
+    if not fresh:
+        spool.clear()
+        if updates:
+            logger.info(f"ℹ️  {len(updates)} pending updates were already processed")
+        return None
+
+    # All backlog ids are in flight before any is processed, so the
+    # watermark can't move past one that is still queued
+    for update in fresh:
+        watermark.started(update.update_id)
+    for update in dropped:
+        watermark.finished(update.update_id)
+    for update in kept:
+        await application.update_queue.put(update)
+    logger.info(f"📥 Catching up on {len(kept)} updates ({len(dropped)} repeated taps collapsed, "
+                f"{len(updates) - len(fresh)} already processed, {len(spooled)} from the spool)")
+
+    async def report() -> None:
+        await watermark.wait_for(fresh[-1].update_id)
+        # Everything spooled is processed; save the watermark before dropping the spool
+        watermark.save()
+        spool.clear()
+        elapsed = time.perf_counter() - started
+        rate = len(kept) / elapsed if elapsed > 0 else 0.0
+        drain_rate.set(round(rate, 1))
+        logger.info(f"✅ Backlog drained: {len(kept)} updates in {elapsed:.1f}s ({rate:.1f} updates/s)")
+
+    return asyncio.create_task(report())
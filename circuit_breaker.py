@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Circuit breaker for the bot's database calls
+After repeated failures calls fail immediately instead of each waiting
+for its own timeout; a background probe closes the circuit again once
+the database answers
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+import bot_metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a dependency that is known to be down"""
+
+
+class CircuitBreaker:
+    """Closed -> open after ``failure_threshold`` consecutive failures
+
+    While open every call fails fast with CircuitOpenError. After
+    ``reset_timeout`` seconds the circuit goes half-open and ``probe`` is
+    run in the background (regular calls keep failing fast meanwhile):
+    success closes the circuit, failure opens it again with the timeout
+    doubled, up to ``max_reset_timeout``.
+    """
+
+    def __init__(self, name: str, probe: Callable[[], Awaitable[object]],
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 max_reset_timeout: float = 300.0):
+        self.name = name
+        self._probe = probe
+        self._failure_threshold = max(1, failure_threshold)
+        self._base_reset_timeout = reset_timeout
+        self._reset_timeout = reset_timeout
+        self._max_reset_timeout = max_reset_timeout
+        self._failures = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self.state = CLOSED
+
+        self._state_gauge = bot_metrics.gauge(
+            f'circuit_state{{name="{name}"}}', "Circuit state: 0 closed, 1 half-open, 2 open"
+        )
+        self._rejected = bot_metrics.counter(
+            f'circuit_rejected_total{{name="{name}"}}', "Calls failed fast while the circuit was open"
+        )
+
+    @property
+    def is_closed(self) -> bool:
+        return self.state == CLOSED
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"⚡ Circuit {self.name}: {self.state} -> {state}")
+        self.state = state
+        self._state_gauge.set(STATE_VALUES[state])
+        bot_metrics.counter(
+            f'circuit_transitions_total{{name="{self.name}",to="{state}"}}', "Circuit state changes"
+        ).inc()
+
+    def check(self) -> None:
+        """Raise CircuitOpenError unless calls may go through"""
+        if self.state != CLOSED:
+            self._rejected.inc()
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit {self.state})")
+
+    def record_success(self) -> None:
+        self._failures = 0
+
+    def record_failure(self) -> None:
+        if self.state != CLOSED:
+            return
+        self._failures += 1
+        if self._failures >= self._failure_threshold:
+            self._open()
+
+    def _open(self) -> None:
+        self._transition(OPEN)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._timer = loop.call_later(self._reset_timeout, self._half_open)
+
+    def _half_open(self) -> None:
+        self._timer = None
+        self._transition(HALF_OPEN)
+        self._probe_task = asyncio.create_task(self._run_probe())
+
+    async def _run_probe(self) -> None:
+        try:
+            await self._probe()
+        except Exception as e:
+            logger.warning(f"⚠️  Circuit {self.name} probe failed: {e}")
+            self._reset_timeout = min(self._reset_timeout * 2, self._max_reset_timeout)
+            self._open()
+            return
+        self._failures = 0
+        self._reset_timeout = self._base_reset_timeout
+        self._transition(CLOSED)
+
+    def close(self) -> None:
+        """Cancel the pending timer and probe (shutdown)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Signed, compact exam state for inline button callback_data
+The whole exam state travels in the button the learner presses, so any
+bot worker can handle the press without a shared session store
+"""
+
+import hmac
+import base64
+import struct
+import hashlib
+import zlib
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+from exam_session import ExamSession
+from lesson_cache import Question
+
+# Prefix of signed exam callback data (handler pattern "^e:")
+PREFIX = "e:"
+# Telegram's limit for callback_data
+MAX_CALLBACK_BYTES = 64
+# Bytes of HMAC-SHA256 kept; 64 bits is plenty for a button that expires with the exam
+MAC_SIZE = 8
+# Questions per exam that fit (shown mask is 32 bits)
+MAX_QUESTIONS = 32
+
+FORMAT_VERSION = 1
+
+ACTION_ANSWER = 0  # option chosen
+ACTION_SHOW = 1    # reveal the answer
+ACTION_NEXT = 2    # continue after a reveal
+
+# version/action, lesson number, question index, option, content tag, shown mask, question count
+_HEADER = struct.Struct(">BBBBHIB")
+
+
+class InvalidCallbackData(ValueError):
+    """callback_data that is malformed, forged or for another user"""
+
+
+class ExamToken(NamedTuple):
+    """State of an exam at the moment a button was rendered, plus the button's action
+
+    ``answers`` has one entry per question: 0 = not answered, otherwise
+    the chosen option index + 1. Questions before ``index`` are answered
+    or revealed, so the running score follows from the answers alone.
+    """
+    action: int
+    lesson_number: int
+    index: int
+    option: int
+    content_tag: int
+    shown_mask: int
+    answers: Tuple[int, ...]
+
+
+def content_tag(questions: Sequence[Question]) -> int:
+    """16-bit tag of a lesson's questions; buttons from an older version are rejected"""
+    key = "|".join(f"{q.id}:{q.correct_answer}:{len(q.options)}" for q in questions)
+    return zlib.crc32(key.encode("utf-8")) & 0xFFFF
+
+
+def _pack_nibbles(values: Sequence[int]) -> bytes:
+    padded = list(values) + [0] * (len(values) % 2)
+    return bytes(padded[i] << 4 | padded[i + 1] for i in range(0, len(padded), 2))
+
+
+def _unpack_nibbles(data: bytes, count: int) -> Tuple[int, ...]:
+    values = []
+    for byte in data:
+        values.append(byte >> 4)
+        values.append(byte & 0x0F)
+    return tuple(values[:count])
+
+
+class ExamCodec:
+    """Encodes ExamTokens as ``e:<base64url(payload + mac)>``
+
+    The MAC covers the payload and the learner's user id, so a button can
+    only be used by the user it was rendered for.
+    """
+
+    def __init__(self, secret: bytes):
+        self._secret = secret
+
+    def _mac(self, user_id: int, payload: bytes) -> bytes:
+        message = user_id.to_bytes(8, "big", signed=True) + payload
+        return hmac.new(self._secret, message, hashlib.sha256).digest()[:MAC_SIZE]
+
+    def encode(self, token: ExamToken, user_id: int) -> str:
+        count = len(token.answers)
+        if count > MAX_QUESTIONS or any(not 0 <= a <= 15 for a in token.answers):
+            raise ValueError("Exam does not fit in callback data")
+        payload = _HEADER.pack(
+            FORMAT_VERSION << 4 | token.action, token.lesson_number, token.index,
+            token.option, token.content_tag, token.shown_mask, count
+        ) + _pack_nibbles(token.answers)
+        data = PREFIX + base64.urlsafe_b64encode(payload + self._mac(user_id, payload)).decode("ascii").rstrip("=")
+        if len(data) > MAX_CALLBACK_BYTES:
+            raise ValueError("Exam does not fit in callback data")
+        return data
+
+    def decode(self, data: str, user_id: int) -> ExamToken:
+        if not data.startswith(PREFIX):
+            raise InvalidCallbackData("not exam callback data")
+        encoded = data[len(PREFIX):]
+        try:
+            raw = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+        except (ValueError, TypeError) as e:
+            raise InvalidCallbackData("bad encoding") from e
+        payload, mac = raw[:-MAC_SIZE], raw[-MAC_SIZE:]
+        if len(payload) < _HEADER.size or not hmac.compare_digest(mac, self._mac(user_id, payload)):
+            raise InvalidCallbackData("bad signature")
+
+        head, lesson_number, index, option, tag, shown_mask, count = _HEADER.unpack_from(payload)
+        if head >> 4 != FORMAT_VERSION or len(payload) != _HEADER.size + (count + 1) // 2:
+            raise InvalidCallbackData("unsupported format")
+        answers = _unpack_nibbles(payload[_HEADER.size:], count)
+        return ExamToken(head & 0x0F, lesson_number, index, option, tag, shown_mask, answers)
+
+
+def fits_callback_data(questions: Sequence[Question]) -> bool:
+    """Whether an exam can run from signed buttons alone
+
+    Buttons only carry chosen options - typed answers to text questions
+    would have nowhere to go, so those exams need a stored session.
+    """
+    return len(questions) <= MAX_QUESTIONS and all(
+        q.question_type == "multiple_choice" and 0 < len(q.options) <= 15 for q in questions
+    )
+
+
+def session_from_token(token: ExamToken, lesson_id: int, questions: Tuple[Question, ...]) -> ExamSession:
+    """Rebuild the exam session a token describes"""
+    session = ExamSession(lesson_id, token.lesson_number, questions)
+    session.current = token.index
+    session.shown_mask = token.shown_mask
+    for i, (question, answer) in enumerate(zip(questions, token.answers)):
+        if answer and answer <= len(question.options):
+            user_answer = question.options[answer - 1]
+            session.answers[i] = (user_answer, user_answer.strip() == question.correct_answer.strip())
+    return session
+
+
+def token_for(session: ExamSession, action: int, option: int = 0,
+              tag: Optional[int] = None) -> ExamToken:
+    """Token for a button on the current question of ``session``"""
+    answers = []
+    for question, answer in zip(session.questions, session.answers):
+        if answer is not None and answer[0] in question.options:
+            answers.append(question.options.index(answer[0]) + 1)
+        else:
+            answers.append(0)
+    return ExamToken(
+        action, session.lesson_number, session.current, option,
+        content_tag(session.questions) if tag is None else tag,
+        session.shown_mask, tuple(answers)
+    )
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Compact per-user exam state
+A session only points at the shared, immutable question records of the
+question bank and keeps the learner's progress in a few small fields
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+from typing import Callable, Dict, List, MutableMapping, Optional, Tuple
+
+import bot_metrics
+from lesson_cache import Question
+
+logger = logging.getLogger(__name__)
+
+# Key under which the session is stored in context.user_data
+EXAM_SESSION_KEY = "exam"
+
+# Minimum score (percent) to pass an exam
+PASS_PERCENT = 70
+
+# Seconds without activity before an unfinished exam is discarded
+EXAM_IDLE_TIMEOUT = float(os.environ.get("EXAM_IDLE_TIMEOUT", "3600"))
+# Seconds between reaper sweeps
+EXAM_REAP_INTERVAL = float(os.environ.get("EXAM_REAP_INTERVAL", "60"))
+
+live_sessions = bot_metrics.gauge("exam_sessions_live", "Exam sessions currently held in memory")
+reaped_sessions = bot_metrics.counter("exam_sessions_reaped_total", "Abandoned exam sessions discarded")
+
+
+class ExamSession:
+    """State of one learner's running exam
+
+    ``questions`` is the tuple returned by the question bank - shared by
+    every learner taking the same exam, never copied. ``answers`` holds one
+    ``(user_answer, is_correct)`` tuple or None per question, and
+    ``shown_mask`` has bit *i* set when the answer to question *i* was
+    revealed (revealed questions don't count towards the score).
+
+    Pickled (for persistence) a session keeps only the question ids; an
+    unpickled session must be ``bind``-ed to the question bank before use.
+    """
+
+    __slots__ = ("lesson_id", "lesson_number", "questions", "current", "answers", "shown_mask",
+                 "_question_ids")
+
+    def __init__(self, lesson_id: int, lesson_number: int, questions: Tuple[Question, ...]):
+        self.lesson_id = lesson_id
+        self.lesson_number = lesson_number
+        self.questions = questions
+        self.current = 0
+        self.answers: List[Optional[Tuple[str, bool]]] = [None] * len(questions)
+        self.shown_mask = 0
+        # Question ids of an unpickled session until it is bound
+        self._question_ids: Optional[Tuple[int, ...]] = None
+
+    def __getstate__(self):
+        question_ids = self._question_ids
+        if question_ids is None:
+            question_ids = tuple(question.id for question in self.questions)
+        return (self.lesson_id, self.lesson_number, question_ids,
+                self.current, self.answers, self.shown_mask)
+
+    def __setstate__(self, state) -> None:
+        (self.lesson_id, self.lesson_number, self._question_ids,
+         self.current, self.answers, self.shown_mask) = state
+        self.questions = ()
+
+    def bind(self, questions: Tuple[Question, ...]) -> bool:
+        """Attach an unpickled session to the bank's questions of its lesson
+
+        Returns False if one of its questions no longer exists (the
+        session can't be continued then).
+        """
+        question_ids = self._question_ids
+        if question_ids is None:
+            return True
+        if tuple(question.id for question in questions) == question_ids:
+            self.questions = questions
+        else:
+            # The lesson's questions changed: keep the session's own order
+            by_id = {question.id: question for question in questions}
+            if any(question_id not in by_id for question_id in question_ids):
+                return False
+            self.questions = tuple(by_id[question_id] for question_id in question_ids)
+        self._question_ids = None
+        return True
+
+    @property
+    def total(self) -> int:
+        return len(self.questions)
+
+    @property
+    def finished(self) -> bool:
+        return self.current >= len(self.questions)
+
+    def question(self, index: int) -> Optional[Question]:
+        if 0 <= index < len(self.questions):
+            return self.questions[index]
+        return None
+
+    def record_answer(self, index: int, user_answer: str, is_correct: bool) -> None:
+        """Store the learner's first answer to question ``index``
+
+        Later attempts (retyping a text answer) don't change the score.
+        """
+        if self.answers[index] is None:
+            self.answers[index] = (user_answer, is_correct)
+
+    def mark_shown(self, index: int) -> None:
+        """Remember that the answer to question ``index`` was revealed"""
+        self.shown_mask |= 1 << index
+
+    def is_shown(self, index: int) -> bool:
+        return bool(self.shown_mask >> index & 1)
+
+    def score(self) -> Tuple[int, int, int]:
+        """Return (correct answers, answered questions, score percent)"""
+        answered = correct = 0
+        for index, answer in enumerate(self.answers):
+            if answer is None or self.is_shown(index):
+                continue
+            answered += 1
+            if answer[1]:
+                correct += 1
+        percent = int(correct / answered * 100) if answered else 0
+        return correct, answered, percent
+
+    def passed(self) -> bool:
+        return self.score()[2] >= PASS_PERCENT
+
+    def answer_rows(self) -> List[Dict]:
+        """Answers in the shape expected by LessonRepository.save_exam_results"""
+        rows = []
+        for question, answer in zip(self.questions, self.answers):
+            if answer is not None:
+                rows.append({
+                    "question_id": question.id,
+                    "user_answer": answer[0],
+                    "is_correct": answer[1]
+                })
+        return rows
+
+
+class SessionReaper:
+    """Discards exam sessions that saw no activity for ``timeout`` seconds
+
+    Deadlines live in a min-heap. ``touch`` pushes a new entry and bumps the
+    user's generation, leaving the older entry stale; ``reap`` pops only
+    entries whose deadline passed, skipping stale ones, so a sweep costs
+    O(expired log n). The heap is rebuilt when stale entries dominate.
+    """
+
+    def __init__(self, timeout: float = EXAM_IDLE_TIMEOUT):
+        self._timeout = timeout
+        self._heap: List[Tuple[float, int, int]] = []
+        # user_id -> (deadline, generation, user_data holding the session)
+        self._live: Dict[int, Tuple[float, int, MutableMapping]] = {}
+        self._generation = 0
+        # Called with the user ids whose sessions were reaped (e.g. to persist the change)
+        self.on_reap: Optional[Callable[[List[int]], None]] = None
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def touch(self, user_id: int, user_data: MutableMapping) -> None:
+        """Record activity on the user's exam session"""
+        self._generation += 1
+        deadline = time.monotonic() + self._timeout
+        self._live[user_id] = (deadline, self._generation, user_data)
+        heapq.heappush(self._heap, (deadline, user_id, self._generation))
+        if len(self._heap) > 2 * len(self._live) + 64:
+            self._compact()
+        live_sessions.set(len(self._live))
+
+    def discard(self, user_id: int) -> None:
+        """Stop tracking a session that ended normally"""
+        if self._live.pop(user_id, None) is not None:
+            live_sessions.set(len(self._live))
+
+    def reap(self, now: Optional[float] = None) -> int:
+        """Drop every expired session; returns how many were dropped"""
+        if now is None:
+            now = time.monotonic()
+        reaped_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, user_id, generation = heapq.heappop(self._heap)
+            entry = self._live.get(user_id)
+            if entry is None or entry[1] != generation:
+                continue  # stale: touched again or already finished
+            del self._live[user_id]
+            entry[2].pop(EXAM_SESSION_KEY, None)
+            reaped_ids.append(user_id)
+        if reaped_ids:
+            reaped_sessions.inc(len(reaped_ids))
+            live_sessions.set(len(self._live))
+            logger.info(f"🧹 Discarded {len(reaped_ids)} idle exam sessions ({len(self._live)} live)")
+            if self.on_reap is not None:
+                self.on_reap(reaped_ids)
+        return len(reaped_ids)
+
+    async def run(self, interval: float = EXAM_REAP_INTERVAL) -> None:
+        """Sweep periodically until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"Error reaping exam sessions: {e}")
+
+    def _compact(self) -> None:
+        self._heap = [(deadline, user_id, generation)
+                      for user_id, (deadline, generation, _) in self._live.items()]
+        heapq.heapify(self._heap)
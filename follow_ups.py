@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Delayed follow-up messages for the learning bot
+Handlers schedule "send this in a moment" work and return immediately
+instead of sleeping, so they don't hold a handler slot while waiting
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+import api_calls
+import bot_metrics
+
+logger = logging.getLogger(__name__)
+
+# A follow-up gets (context, data); context has .bot and the user's .user_data
+FollowUp = Callable[[Any, Any], Awaitable[None]]
+
+follow_ups_scheduled = bot_metrics.counter("follow_ups_scheduled_total", "Delayed follow-up messages scheduled")
+follow_ups_failed = bot_metrics.counter("follow_ups_failed_total", "Delayed follow-up messages that raised")
+
+
+async def _run(callback: FollowUp, context, data, interaction: Optional[str]) -> None:
+    # Calls made by the follow-up count against the interaction that scheduled it
+    token = api_calls.attach(interaction)
+    try:
+        await callback(context, data)
+    except Exception as e:
+        follow_ups_failed.inc()
+        logger.error(f"Error in follow-up {getattr(callback, '__name__', callback)}: {e}", exc_info=True)
+    finally:
+        api_calls.end(token)
+
+
+async def _job_callback(context) -> None:
+    callback, data, interaction = context.job.data
+    await _run(callback, context, data, interaction)
+
+
+def schedule_follow_up(context, delay: float, callback: FollowUp, user_id: int, data: Any = None) -> None:
+    """Run ``callback(context, data)`` after ``delay`` seconds
+
+    Uses the application's JobQueue, whose scheduler keeps all pending
+    timers in one place. Without the job-queue extra it falls back to a
+    loop timer that reuses the handler's context. The callback must check
+    that the user's state still matches - the user may act in between.
+    """
+    follow_ups_scheduled.inc()
+    interaction = api_calls.current()
+    job_queue = getattr(context, "job_queue", None)
+    if job_queue is not None:
+        job_queue.run_once(
+            _job_callback, delay,
+            data=(callback, data, interaction),
+            user_id=user_id, chat_id=user_id,
+            name=f"follow_up_{user_id}"
+        )
+        return
+
+    application = context.application
+    asyncio.get_running_loop().call_later(
+        delay, lambda: application.create_task(_run(callback, context, data, interaction))
+    )
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Per-key ordered scheduling on top of asyncio
+Work for different keys (users) runs in parallel, work for the same key
+runs strictly one after another in arrival order; free slots go to the
+highest-priority work first
+"""
+
+import heapq
+import asyncio
+import itertools
+from typing import Any, Awaitable, Dict, Hashable, List, Optional, Tuple
+
+import bot_metrics
+
+updates_in_flight = bot_metrics.gauge("updates_in_flight", "Updates currently being handled")
+updates_waiting = bot_metrics.gauge("updates_waiting", "Updates waiting behind the same user or a free slot")
+
+
+class _KeyState:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class PrioritySlots:
+    """Semaphore that wakes waiters in (priority, arrival) order; lower goes first"""
+
+    def __init__(self, slots: int):
+        self._free = max(1, slots)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority: int = 0) -> None:
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted a slot just as we were cancelled - hand it on
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+
+
+class KeyedSerializer:
+    """Runs awaitables concurrently across keys, in FIFO order per key
+
+    A key first waits for its own lock (asyncio locks wake waiters in FIFO
+    order), then for one of ``max_concurrent`` global slots. Taking the key
+    lock first means a user with a backlog holds at most one slot. Free
+    slots go to the lowest ``priority`` value first, arrival order within
+    a priority. Key state is dropped as soon as nothing is queued for the
+    key, so memory stays proportional to the users with work in flight.
+    """
+
+    def __init__(self, max_concurrent: int):
+        self._slots = PrioritySlots(max_concurrent)
+        self._keys: Dict[Hashable, _KeyState] = {}
+        # Work not started yet, per priority
+        self._waiting: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def waiting(self, priority: Optional[int] = None) -> int:
+        """Work queued (behind its key or for a slot), of one priority or in total"""
+        if priority is None:
+            return sum(self._waiting.values())
+        return self._waiting.get(priority, 0)
+
+    async def run(self, key: Optional[Hashable], awaitable: Awaitable[Any], priority: int = 0) -> Any:
+        """Await ``awaitable`` once it is its key's turn and a slot is free
+
+        A ``None`` key has no ordering constraint and only waits for a slot.
+        """
+        state = None
+        if key is not None:
+            state = self._keys.get(key)
+            if state is None:
+                state = self._keys[key] = _KeyState()
+            state.users += 1
+
+        updates_waiting.inc()
+        self._waiting[priority] = self._waiting.get(priority, 0) + 1
+        started = False
+        try:
+            if state is not None:
+                await state.lock.acquire()
+            try:
+                await self._slots.acquire(priority)
+                try:
+                    updates_waiting.dec()
+                    self._waiting[priority] -= 1
+                    started = True
+                    updates_in_flight.inc()
+                    try:
+                        return await awaitable
+                    finally:
+                        updates_in_flight.dec()
+                finally:
+                    self._slots.release()
+            finally:
+                if state is not None:
+                    state.lock.release()
+        finally:
+            if not started:
+                # Cancelled while queued: the work never ran
+                updates_waiting.dec()
+                self._waiting[priority] -= 1
+                close = getattr(awaitable, "close", None)
+                if close is not None:
+                    close()
+            if state is not None:
+                state.users -= 1
+                if state.users == 0:
+                    self._keys.pop(key, None)
@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+"""
+In-process lesson catalog cache
+Lessons are loaded once, keyed by lesson_number, and revalidated against
+the database content watermark after the TTL expires
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import bot_metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the catalog is revalidated against the database
+LESSON_CACHE_TTL = float(os.environ.get("LESSON_CACHE_TTL", "300"))
+
+cache_hits = bot_metrics.counter("lesson_cache_hits_total", "Lesson lookups served from memory")
+cache_misses = bot_metrics.counter("lesson_cache_misses_total", "Lesson lookups that needed a load")
+cache_reloads = bot_metrics.counter("lesson_cache_reloads_total", "Full catalog reloads")
+render_hits = bot_metrics.counter("lesson_render_cache_hits_total", "Lesson messages served pre-rendered")
+render_misses = bot_metrics.counter("lesson_render_cache_misses_total", "Lesson messages rendered on demand")
+question_hits = bot_metrics.counter("question_bank_hits_total", "Exam question lookups served from memory")
+question_misses = bot_metrics.counter("question_bank_misses_total", "Exam question lookups loaded from the database")
+
+
+def content_hash(lessons: List[Dict]) -> str:
+    """Stable hash of the catalog content, used as its version"""
+    payload = json.dumps(lessons, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class LessonCatalog:
+    """Lesson rows keyed by lesson_number
+
+    The catalog is versioned by a content hash. After ``ttl`` seconds the
+    next lookup still answers from memory but triggers a background
+    revalidation: a cheap watermark query (row count + max ``updated_at``),
+    followed by a full reload only when the watermark moved.
+    ``invalidate()`` forces a reload on the next lookup.
+    """
+
+    def __init__(self, repository, ttl: float = LESSON_CACHE_TTL,
+                 local_loader: Optional[Callable[[], List[Dict]]] = None):
+        self._repository = repository
+        self._ttl = ttl
+        self._local_loader = local_loader
+        self._lessons: Dict[int, Dict] = {}
+        self._watermark = None
+        self._checked_at = 0.0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._revalidate_task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[str], None]] = []
+        self.version: Optional[str] = None
+        self.source: Optional[str] = None
+
+    def add_listener(self, callback: Callable[[str], None]) -> None:
+        """Register ``callback(new_version)`` to run whenever the content changes"""
+        self._listeners.append(callback)
+
+    def invalidate(self) -> None:
+        """Drop the loaded content; the next lookup reloads it"""
+        self._loaded = False
+        self._watermark = None
+
+    @property
+    def is_stale(self) -> bool:
+        return time.monotonic() - self._checked_at > self._ttl
+
+    async def get(self, lesson_number: int) -> Optional[Dict]:
+        """Return a lesson row or None"""
+        if not self._loaded:
+            cache_misses.inc()
+            await self.refresh()
+        else:
+            cache_hits.inc()
+            if self.is_stale:
+                self._schedule_revalidate()
+        return self._lessons.get(lesson_number)
+
+    async def all(self) -> List[Dict]:
+        """Return every lesson ordered by lesson_number"""
+        if not self._loaded:
+            cache_misses.inc()
+            await self.refresh()
+        else:
+            cache_hits.inc()
+            if self.is_stale:
+                self._schedule_revalidate()
+        return [self._lessons[n] for n in sorted(self._lessons)]
+
+    def stats(self) -> Dict:
+        """Cache counters and current version"""
+        return {
+            "lessons": len(self._lessons),
+            "version": self.version,
+            "source": self.source,
+            "hits": cache_hits.value,
+            "misses": cache_misses.value,
+            "reloads": cache_reloads.value,
+        }
+
+    def export_state(self) -> Optional[Dict]:
+        """Loaded content with its version and watermark (None if not loaded)"""
+        if not self._loaded:
+            return None
+        return {
+            "version": self.version,
+            "source": self.source,
+            "watermark": list(self._watermark) if self._watermark is not None else None,
+            "lessons": [self._lessons[n] for n in sorted(self._lessons)],
+        }
+
+    def restore(self, state: Dict, stale: bool = False) -> None:
+        """Install content from ``export_state`` without notifying listeners
+
+        The caller is responsible for checking that it is still current;
+        with ``stale`` the first lookup revalidates it in the background.
+        """
+        lessons = state["lessons"]
+        watermark = state.get("watermark")
+        self._lessons = {lesson["lesson_number"]: lesson for lesson in lessons}
+        self._watermark = tuple(watermark) if watermark is not None else None
+        self._checked_at = 0.0 if stale else time.monotonic()
+        self._loaded = True
+        self.source = state.get("source")
+        self.version = state.get("version") or content_hash(lessons)
+
+    def _schedule_revalidate(self) -> None:
+        if self._revalidate_task is None or self._revalidate_task.done():
+            self._revalidate_task = asyncio.create_task(self.revalidate())
+
+    async def revalidate(self) -> None:
+        """Reload the catalog only if the database watermark changed"""
+        if self._repository.degraded:
+            # Database down: keep serving what we have rather than swapping in local content
+            return
+        if self._repository.available and self._watermark is not None:
+            try:
+                watermark = await self._repository.get_lessons_watermark()
+                if watermark == self._watermark:
+                    self._checked_at = time.monotonic()
+                    return
+            except Exception as e:
+                logger.warning(f"⚠️  Could not read lessons watermark: {e}")
+        await self.refresh()
+
+    async def refresh(self) -> None:
+        """Load the whole catalog; keep the old content if loading fails"""
+        async with self._lock:
+            lessons, source, watermark = await self._load()
+            self._checked_at = time.monotonic()
+            if not lessons:
+                # Nothing to serve; retry on the next lookup
+                logger.warning("⚠️  Lesson catalog is empty")
+                return
+
+            cache_reloads.inc()
+            version = content_hash(lessons)
+            changed = version != self.version
+            self._lessons = {lesson["lesson_number"]: lesson for lesson in lessons}
+            self._watermark = watermark
+            self._loaded = True
+            self.source = source
+            self.version = version
+
+        if changed:
+            logger.info(f"✅ Lesson catalog loaded from {source}: {len(lessons)} lessons (version {version})")
+            for callback in self._listeners:
+                try:
+                    callback(version)
+                except Exception as e:
+                    logger.error(f"Error in catalog listener: {e}")
+
+    async def _load(self):
+        if self._repository.available and not self._repository.degraded:
+            try:
+                # Read the watermark first so a concurrent edit causes a reload next time
+                try:
+                    watermark = await self._repository.get_lessons_watermark()
+                except Exception as e:
+                    logger.warning(f"⚠️  Could not read lessons watermark: {e}")
+                    watermark = None
+                lessons = await self._repository.get_all_lessons()
+                if lessons:
+                    return lessons, "database", watermark
+            except Exception as e:
+                logger.warning(f"⚠️  Error loading lessons from database: {e}")
+                logger.info("💡 Falling back to local lesson content...")
+
+        if self._local_loader:
+            try:
+                return self._local_loader(), "local", None
+            except Exception as e:
+                logger.error(f"❌ Error loading local lesson content: {e}", exc_info=True)
+        return [], None, None
+
+
+class RenderedLessonCache:
+    """Final lesson message payloads, compiled once per catalog version
+
+    Cleared automatically whenever the catalog content version changes,
+    so a cached payload never outlives the lesson it was built from.
+    """
+
+    def __init__(self, catalog: LessonCatalog):
+        self._items: Dict[int, object] = {}
+        catalog.add_listener(self.clear)
+
+    def get(self, lesson_number: int, build: Callable[[], object]) -> object:
+        """Return the cached payload, building it with ``build()`` on a miss"""
+        item = self._items.get(lesson_number)
+        if item is None:
+            render_misses.inc()
+            item = build()
+            self._items[lesson_number] = item
+        else:
+            render_hits.inc()
+        return item
+
+    def clear(self, version: Optional[str] = None) -> None:
+        self._items.clear()
+
+
+class Question(NamedTuple):
+    """Immutable exam question, shared by every session that uses it"""
+    id: int
+    lesson_id: int
+    question_number: int
+    question_text: str
+    question_type: str
+    correct_answer: str
+    options: Tuple[str, ...]
+    explanation: str
+
+
+def question_from_row(row: Dict) -> Question:
+    """Build a Question from a ``questions`` row, parsing options once"""
+    options = row.get("options") or "[]"
+    if isinstance(options, str):
+        try:
+            options = json.loads(options)
+        except json.JSONDecodeError:
+            logger.error(f"Error parsing options JSON for question {row.get('id')}")
+            options = []
+    return Question(
+        id=row["id"],
+        lesson_id=row["lesson_id"],
+        question_number=row.get("question_number", 0),
+        question_text=row.get("question_text", ""),
+        question_type=row.get("question_type", "text"),
+        correct_answer=row.get("correct_answer") or "",
+        options=tuple(options),
+        explanation=row.get("explanation") or "",
+    )
+
+
+class QuestionBank:
+    """Exam questions indexed by lesson_id
+
+    The whole bank is loaded together with the catalog and reloaded when
+    the catalog content changes. Like the catalog, it is revalidated
+    against its own watermark (question count + max ``updated_at``) after
+    ``ttl`` seconds, so edits to the questions alone are picked up too.
+    Lessons missing from the bank are loaded on demand; ``prefetch`` does
+    that in the background so the exam can start without waiting on the
+    database.
+    """
+
+    def __init__(self, repository, catalog: Optional[LessonCatalog] = None,
+                 ttl: float = LESSON_CACHE_TTL):
+        self._repository = repository
+        self._ttl = ttl
+        self._questions: Dict[int, Tuple[Question, ...]] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._reload_task: Optional[asyncio.Task] = None
+        self._watermark = None
+        self._checked_at = 0.0
+        if catalog is not None:
+            catalog.add_listener(self._on_catalog_change)
+
+    def __contains__(self, lesson_id: int) -> bool:
+        return lesson_id in self._questions
+
+    @property
+    def is_stale(self) -> bool:
+        return time.monotonic() - self._checked_at > self._ttl
+
+    async def load_all(self) -> int:
+        """Load every question of every lesson; returns the question count"""
+        # Read the watermark first so a concurrent edit causes a reload next time
+        try:
+            watermark = await self._repository.get_questions_watermark()
+        except Exception as e:
+            logger.warning(f"⚠️  Could not read questions watermark: {e}")
+            watermark = None
+        rows = await self._repository.get_all_questions()
+        grouped: Dict[int, List[Question]] = {}
+        for row in rows:
+            grouped.setdefault(row["lesson_id"], []).append(question_from_row(row))
+        self._questions = {lesson_id: tuple(items) for lesson_id, items in grouped.items()}
+        self._watermark = watermark
+        self._checked_at = time.monotonic()
+        logger.info(f"✅ Question bank loaded: {len(rows)} questions in {len(grouped)} lessons")
+        return len(rows)
+
+    async def revalidate(self) -> None:
+        """Reload the bank only if the questions watermark changed"""
+        if not self._repository.available or self._repository.degraded:
+            return
+        if self._watermark is not None:
+            try:
+                watermark = await self._repository.get_questions_watermark()
+                if watermark == self._watermark:
+                    self._checked_at = time.monotonic()
+                    return
+            except Exception as e:
+                logger.warning(f"⚠️  Could not read questions watermark: {e}")
+        await self._reload()
+
+    async def get(self, lesson_id: int) -> Tuple[Question, ...]:
+        """Return the questions of a lesson ordered by question number
+
+        The returned tuple and its records are shared between users.
+        """
+        if self._repository.available and self.is_stale:
+            self._schedule_reload(revalidate=True)
+        questions = self._questions.get(lesson_id)
+        if questions is not None:
+            question_hits.inc()
+            return questions
+        question_misses.inc()
+        return await self._load(lesson_id)
+
+    def prefetch(self, lesson_id: int) -> None:
+        """Start loading a lesson's questions in the background if needed"""
+        if lesson_id in self._questions or lesson_id in self._loading:
+            return
+        if not self._repository.available or self._repository.degraded:
+            return
+        task = asyncio.ensure_future(self._load(lesson_id))
+        # Errors surface again on the next get(); just don't leave them unretrieved
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    def invalidate(self) -> None:
+        self._questions = {}
+        self._watermark = None
+
+    def export_state(self) -> Dict:
+        """Loaded questions per lesson as plain lists, with the watermark they were loaded at"""
+        return {
+            "watermark": list(self._watermark) if self._watermark is not None else None,
+            "lessons": {lesson_id: [list(q) for q in questions]
+                        for lesson_id, questions in self._questions.items()},
+        }
+
+    def restore(self, state: Dict, stale: bool = False) -> int:
+        """Install questions from ``export_state``; returns the question count
+
+        As with the catalog, the caller checks the watermark; with
+        ``stale`` the first lookup revalidates in the background.
+        """
+        watermark = state.get("watermark")
+        self._questions = {
+            int(lesson_id): tuple(Question(*row[:6], tuple(row[6]), row[7]) for row in rows)
+            for lesson_id, rows in state["lessons"].items()
+        }
+        self._watermark = tuple(watermark) if watermark is not None else None
+        self._checked_at = 0.0 if stale else time.monotonic()
+        return sum(len(questions) for questions in self._questions.values())
+
+    async def _load(self, lesson_id: int) -> Tuple[Question, ...]:
+        future = self._loading.get(lesson_id)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(lesson_id))
+            self._loading[lesson_id] = future
+            future.add_done_callback(lambda f: self._loading.pop(lesson_id, None))
+        return await future
+
+    async def _fetch(self, lesson_id: int) -> Tuple[Question, ...]:
+        rows = await self._repository.get_questions(lesson_id)
+        questions = tuple(question_from_row(row) for row in rows)
+        self._questions[lesson_id] = questions
+        return questions
+
+    def _on_catalog_change(self, version: str) -> None:
+        if not self._repository.available:
+            return
+        self._schedule_reload()
+
+    def _schedule_reload(self, revalidate: bool = False) -> None:
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.ensure_future(self.revalidate() if revalidate else self._reload())
+
+    async def _reload(self) -> None:
+        try:
+            await self.load_all()
+        except Exception as e:
+            self._checked_at = time.monotonic()
+            logger.warning(f"⚠️  Could not reload question bank: {e}")
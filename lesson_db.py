@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Async data access layer for the learning bot
+Every Supabase call runs on a bounded thread pool so a slow
+PostgREST round trip never blocks the event loop; a circuit breaker
+makes calls fail fast while Supabase is down
+"""
+
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# Worker threads (and therefore concurrent PostgREST requests) per process
+DB_MAX_WORKERS = int(os.environ.get("DB_MAX_WORKERS", "8"))
+# Seconds a single query may take before it counts as failed
+DB_CALL_TIMEOUT = float(os.environ.get("DB_CALL_TIMEOUT", "10"))
+# Consecutive failed queries that open the circuit, and seconds before the first probe
+DB_FAILURE_THRESHOLD = int(os.environ.get("DB_FAILURE_THRESHOLD", "5"))
+DB_RESET_TIMEOUT = float(os.environ.get("DB_RESET_TIMEOUT", "30"))
+
+
+def _is_missing_function(error: Exception) -> bool:
+    """True if PostgREST reported that an RPC function does not exist"""
+    code = getattr(error, "code", None)
+    if code in ("PGRST202", "42883"):
+        return True
+    return "PGRST202" in str(error) or "Could not find the function" in str(error)
+
+
+def is_unavailable(error: Exception) -> bool:
+    """True if ``error`` means the database couldn't be reached
+
+    Open circuit, query timeout or a connection/transport failure - as
+    opposed to an error in the query or in the code handling its result.
+    """
+    if isinstance(error, (CircuitOpenError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    try:
+        # The HTTP client of the Supabase client; only imported once an error happened
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(error, httpx.TransportError)
+
+
+def _is_outage(error: Exception) -> bool:
+    """True for failures that count against the circuit
+
+    Only a timeout or a connection/transport failure says the database
+    is down. PostgREST errors (the database answered), a missing client
+    and bugs in the code building a query don't, and neither does the
+    circuit's own fail-fast error.
+    """
+    return not isinstance(error, CircuitOpenError) and is_unavailable(error)
+
+
+class LessonRepository:
+    """Async wrapper around the synchronous Supabase client
+
+    The Supabase client keeps its own HTTP connection pool; the executor
+    bounds how many requests are in flight against it at the same time.
+    Instead of a client, a ``client_factory`` may be given: the client (and
+    the supabase package) is then created by the first query, on a worker
+    thread, so process start doesn't pay for it.
+
+    Queries taking longer than ``call_timeout`` fail with a timeout. After
+    ``failure_threshold`` consecutive timeouts or transport errors the
+    circuit opens: queries raise CircuitOpenError at once until a
+    background probe (a one-row lessons query) succeeds.
+    """
+
+    def __init__(self, client=None, max_workers: int = DB_MAX_WORKERS,
+                 client_factory: Optional[Callable[[], Any]] = None,
+                 call_timeout: float = DB_CALL_TIMEOUT,
+                 failure_threshold: int = DB_FAILURE_THRESHOLD,
+                 reset_timeout: float = DB_RESET_TIMEOUT):
+        self._client = client
+        self._client_factory = client_factory if client is None else None
+        self._client_lock = threading.Lock()
+        self._max_workers = max(1, max_workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Cleared when the database lacks the submit_exam_results function
+        self._exam_rpc_available = True
+        self._call_timeout = call_timeout
+        self.breaker = CircuitBreaker("supabase", self._probe, failure_threshold, reset_timeout)
+
+    @property
+    def available(self) -> bool:
+        """True when a Supabase client is configured (or can still be created)"""
+        return self._client is not None or self._client_factory is not None
+
+    @property
+    def degraded(self) -> bool:
+        """True while the circuit is not closed - queries fail fast"""
+        return not self.breaker.is_closed
+
+    def _get_client(self):
+        """Return the client, creating it on first use (runs in a worker thread)"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    if self._client_factory is None:
+                        raise RuntimeError("Supabase client not initialized")
+                    try:
+                        self._client = self._client_factory()
+                        logger.info("✅ Supabase client initialized successfully")
+                    except Exception as e:
+                        logger.error(f"❌ Error initializing Supabase client: {e}")
+                        logger.error("Bot will continue but database features will be disabled")
+                        self._client_factory = None
+                        raise RuntimeError("Supabase client not initialized") from e
+        return self._client
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_workers,
+                thread_name_prefix="supabase"
+            )
+        return self._executor
+
+    async def _run(self, func: Callable[[], Any], probe: bool = False) -> Any:
+        """Run a blocking call on the DB executor, through the circuit breaker"""
+        if not self.available:
+            raise RuntimeError("Supabase client not initialized")
+        if not probe:
+            self.breaker.check()
+        loop = asyncio.get_running_loop()
+        try:
+            # The worker thread can't be interrupted, but the caller stops waiting
+            result = await asyncio.wait_for(
+                loop.run_in_executor(self._get_executor(), func), self._call_timeout
+            )
+        except Exception as e:
+            if not probe and _is_outage(e):
+                self.breaker.record_failure()
+            raise
+        if not probe:
+            self.breaker.record_success()
+        return result
+
+    def _execute(self, build: Callable[[Any], Any]) -> Any:
+        """Build a query against the client and execute it (runs in a worker thread)"""
+        return build(self._get_client()).execute()
+
+    async def execute(self, build: Callable[[Any], Any]) -> Any:
+        """Execute a query built by ``build(client)`` off the event loop"""
+        return await self._run(partial(self._execute, build))
+
+    async def _probe(self) -> None:
+        """Health check run by the breaker while half-open"""
+        await self._run(partial(
+            self._execute, lambda c: c.table("lessons").select("id").limit(1)
+        ), probe=True)
+
+    def close(self) -> None:
+        """Shut down the executor; pending queries are allowed to finish"""
+        self.breaker.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    # ==================== users ====================
+
+    async def get_registration(self, telegram_id: int) -> Optional[Dict]:
+        """Return the user's registration row (id, status) or None"""
+        result = await self.execute(
+            lambda c: c.table("users").select("id,status").eq("telegram_id", telegram_id)
+        )
+        return result.data[0] if result.data else None
+
+    async def save_registration(self, telegram_id: int, user_data: Dict, exists: bool) -> None:
+        """Insert a new user or update the existing row"""
+        if exists:
+            await self.execute(
+                lambda c: c.table("users").update(user_data).eq("telegram_id", telegram_id)
+            )
+        else:
+            row = dict(user_data, telegram_id=telegram_id)
+            await self.execute(lambda c: c.table("users").insert(row))
+
+    async def get_confirmed_user_ids(self, page_size: int = 1000) -> List[int]:
+        """Return telegram ids of all confirmed users, fetched page by page"""
+        ids: List[int] = []
+        start = 0
+        while True:
+            end = start + page_size - 1
+            result = await self.execute(
+                lambda c: c.table("users").select("telegram_id")
+                .eq("status", "confirmed").order("id").range(start, end)
+            )
+            rows = result.data or []
+            ids.extend(row["telegram_id"] for row in rows)
+            if len(rows) < page_size:
+                return ids
+            start += page_size
+
+    # ==================== lessons ====================
+
+    async def get_all_lessons(self) -> List[Dict]:
+        """Return every lesson row, ordered by lesson number"""
+        result = await self.execute(
+            lambda c: c.table("lessons").select("*").order("lesson_number")
+        )
+        return result.data or []
+
+    async def get_lessons_watermark(self) -> Tuple[int, Optional[str]]:
+        """Return (row count, latest updated_at) of the lessons table
+
+        Cheap change detector for the catalog cache; any insert, update or
+        delete moves at least one of the two values.
+        """
+        result = await self.execute(
+            lambda c: c.table("lessons").select("updated_at", count="exact")
+            .order("updated_at", desc=True).limit(1)
+        )
+        latest = result.data[0]["updated_at"] if result.data else None
+        return result.count or 0, latest
+
+    async def get_lesson(self, lesson_number: int) -> Optional[Dict]:
+        """Return the full lesson row or None"""
+        result = await self.execute(
+            lambda c: c.table("lessons").select("*").eq("lesson_number", lesson_number)
+        )
+        return result.data[0] if result.data else None
+
+    async def get_questions(self, lesson_id: int) -> List[Dict]:
+        """Return the questions of a lesson ordered by question number"""
+        result = await self.execute(
+            lambda c: c.table("questions").select("*").eq("lesson_id", lesson_id).order("question_number")
+        )
+        return result.data or []
+
+    async def get_questions_watermark(self) -> Tuple[int, Optional[str]]:
+        """Return (row count, latest updated_at) of the questions table"""
+        result = await self.execute(
+            lambda c: c.table("questions").select("updated_at", count="exact")
+            .order("updated_at", desc=True).limit(1)
+        )
+        latest = result.data[0]["updated_at"] if result.data else None
+        return result.count or 0, latest
+
+    async def get_all_questions(self, page_size: int = 1000) -> List[Dict]:
+        """Return every question, ordered by lesson and question number
+
+        Fetched page by page - PostgREST caps a single response at its
+        max-rows setting (1000 by default).
+        """
+        questions: List[Dict] = []
+        start = 0
+        while True:
+            end = start + page_size - 1
+            result = await self.execute(
+                lambda c: c.table("questions").select("*")
+                .order("lesson_id").order("question_number").range(start, end)
+            )
+            rows = result.data or []
+            questions.extend(rows)
+            if len(rows) < page_size:
+                return questions
+            start += page_size
+
+    # ==================== progress ====================
+
+    async def get_completed_lesson_ids(self, telegram_id: int) -> List[int]:
+        """Return ids of all lessons the user completed"""
+        result = await self.execute(
+            lambda c: c.table("user_progress").select("lesson_id,is_completed")
+            .eq("telegram_id", telegram_id).eq("is_completed", True)
+        )
+        return [row["lesson_id"] for row in result.data or []]
+
+    async def save_exam_results(self, telegram_id: int, lesson_id: int,
+                                answers: List[Dict], passed: bool) -> None:
+        """Persist all answers of an exam and, if passed, the lesson progress
+
+        Uses the ``submit_exam_results`` RPC (one request, one transaction).
+        If the function is not installed, falls back to one bulk upsert for
+        the answers plus one progress upsert.
+        """
+        # One row per question - a bulk upsert may not touch a row twice
+        rows = {}
+        for answer in answers:
+            rows[answer["question_id"]] = {
+                "telegram_id": telegram_id,
+                "question_id": answer["question_id"],
+                "user_answer": answer["user_answer"],
+                "is_correct": answer["is_correct"]
+            }
+        rows = list(rows.values())
+
+        if self._exam_rpc_available:
+            params = {
+                "p_telegram_id": telegram_id,
+                "p_lesson_id": lesson_id,
+                "p_answers": [{k: v for k, v in row.items() if k != "telegram_id"} for row in rows],
+                "p_passed": passed
+            }
+            try:
+                await self.execute(lambda c: c.rpc("submit_exam_results", params))
+                return
+            except Exception as e:
+                if not _is_missing_function(e):
+                    raise
+                logger.warning("⚠️  submit_exam_results RPC not found - using bulk upserts")
+                self._exam_rpc_available = False
+
+        if rows:
+            await self.execute(
+                lambda c: c.table("question_answers").upsert(rows, on_conflict="telegram_id,question_id")
+            )
+        if passed:
+            await self.mark_lesson_completed(telegram_id, lesson_id)
+
+    async def mark_lesson_completed(self, telegram_id: int, lesson_id: int) -> None:
+        """Record that the user passed the lesson exam"""
+        row = {
+            "telegram_id": telegram_id,
+            "lesson_id": lesson_id,
+            "is_completed": True,
+            "completed_at": datetime.now(timezone.utc).isoformat()
+        }
+        await self.execute(
+            lambda c: c.table("user_progress").upsert(row, on_conflict="telegram_id,lesson_id")
+        )
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Outbound Telegram rate limiter with priority lanes
+Keeps the bot under Telegram's global and per-chat limits, sends
+interactive replies before background traffic and handles RetryAfter
+"""
+
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import api_calls
+import bot_metrics
+from token_bucket import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Telegram limits (messages per second)
+TG_GLOBAL_RATE = float(os.environ.get("TG_GLOBAL_RATE", "30"))
+TG_CHAT_RATE = float(os.environ.get("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = float(os.environ.get("TG_CHAT_BURST", "3"))
+TG_GROUP_RATE = float(os.environ.get("TG_GROUP_RATE", str(20 / 60)))
+# How often a request is retried after a RetryAfter (flood wait)
+TG_MAX_RETRIES = int(os.environ.get("TG_MAX_RETRIES", "2"))
+
+# Endpoints that are not paced (polling, setup, instant button feedback)
+UNLIMITED_ENDPOINTS = frozenset({
+    "getUpdates", "getMe", "setWebhook", "deleteWebhook", "getWebhookInfo",
+    "answerCallbackQuery", "close", "logOut",
+})
+
+
+class Priority:
+    """Lanes passed as ``rate_limit_args`` to bot methods; lower goes first"""
+    INTERACTIVE = 0   # direct replies to what the user just did (default)
+    BACKGROUND = 1    # automatic follow-ups (next question, next lesson)
+
+    NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+def _lane(rate_limit_args: Any) -> int:
+    if isinstance(rate_limit_args, int) and rate_limit_args in Priority.NAMES:
+        return rate_limit_args
+    if isinstance(rate_limit_args, dict):
+        return _lane(rate_limit_args.get("priority"))
+    return Priority.INTERACTIVE
+
+
+queue_depth = {
+    lane: bot_metrics.gauge(f'outbound_queue_depth{{lane="{name}"}}', "Requests waiting for a global send slot")
+    for lane, name in Priority.NAMES.items()
+}
+sent_requests = bot_metrics.counter("outbound_requests_total", "Paced Bot API requests sent")
+flood_waits = bot_metrics.counter("outbound_retry_after_total", "RetryAfter (flood wait) errors received")
+throttle_seconds = bot_metrics.counter("outbound_throttle_seconds_total", "Time requests spent waiting for the limiter")
+
+
+class PriorityRateLimiter(BaseRateLimiter[Union[int, Dict[str, Any]]]):
+    """Token buckets per chat and globally, with priority lanes
+
+    A request first takes a token from its chat's bucket (FIFO within the
+    chat), then waits for a global token. Global tokens are handed out by
+    a dispatcher in (lane, arrival) order, so a queue of follow-ups never
+    delays a reply to a user. After a RetryAfter the whole limiter pauses
+    for the requested time before retrying.
+    """
+
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE, chat_rate: float = TG_CHAT_RATE,
+                 chat_burst: float = TG_CHAT_BURST, group_rate: float = TG_GROUP_RATE,
+                 max_retries: int = TG_MAX_RETRIES):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._max_retries = max_retries
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for _, _, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Waiting requests per lane"""
+        return {name: int(queue_depth[lane].value) for lane, name in Priority.NAMES.items()}
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Union[int, Dict[str, Any]]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        api_calls.record(endpoint)
+        if endpoint in UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        lane = _lane(rate_limit_args)
+        chat_id = data.get("chat_id")
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, lane)
+            try:
+                result = await callback(*args, **kwargs)
+                sent_requests.inc()
+                return result
+            except RetryAfter as e:
+                flood_waits.inc()
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                loop = asyncio.get_running_loop()
+                self._paused_until = max(self._paused_until, loop.time() + float(delay))
+                if attempt >= self._max_retries:
+                    raise
+                attempt += 1
+                logger.warning(f"⚠️  Flood wait on {endpoint}: retrying in {delay}s (attempt {attempt})")
+
+    async def _acquire(self, chat_id, lane: int) -> None:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        if not self._waiters and loop.time() >= self._paused_until and self._global.try_take():
+            throttle_seconds.inc(loop.time() - started)
+            return
+
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (lane, next(self._counter), future))
+        queue_depth[lane].inc()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        finally:
+            throttle_seconds.inc(loop.time() - started)
+
+    async def _dispatch(self) -> None:
+        """Grant global tokens to waiters in priority order"""
+        loop = asyncio.get_running_loop()
+        while self._waiters:
+            pause = self._paused_until - loop.time()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            wait = self._global.wait_time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            lane, _, future = heapq.heappop(self._waiters)
+            queue_depth[lane].dec()
+            if future.done():
+                continue  # caller was cancelled
+            self._global.try_take()
+            future.set_result(None)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._purge_idle_chats()
+            is_group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            rate = self._group_rate if is_group else self._chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self._chat_burst)
+        return bucket
+
+    def _purge_idle_chats(self) -> None:
+        # A full bucket carries no state - dropping it is free
+        for chat_id in [c for c, bucket in self._chats.items() if bucket.is_full()]:
+            del self._chats[chat_id]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Post recorded Telegram Update JSON to a locally running webhook server
+
+Start the bot with BOT_MODE=webhook WEBHOOK_REGISTER=0 and a WEBHOOK_SECRET, then:
+    python post_update.py sample_updates/start_command.json
+    python post_update.py sample_updates/*.json --url http://localhost:8080/telegram
+"""
+
+import os
+import sys
+import json
+import argparse
+import urllib.request
+import urllib.error
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def post_update(url: str, payload: dict, secret: str) -> int:
+    """POST one update; returns the HTTP status"""
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    request = urllib.request.Request(url, data=body, method="POST")
+    request.add_header("Content-Type", "application/json")
+    if secret:
+        request.add_header("X-Telegram-Bot-Api-Secret-Token", secret)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def main():
+    port = os.environ.get("PORT", os.environ.get("WEBHOOK_PORT", "8080"))
+    path = os.environ.get("WEBHOOK_PATH", "/telegram")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="JSON files with one Update (or a list of Updates)")
+    parser.add_argument("--url", default=f"http://localhost:{port}{path}", help="webhook endpoint")
+    parser.add_argument("--secret", default=os.environ.get("WEBHOOK_SECRET", ""), help="secret token header")
+    args = parser.parse_args()
+
+    failed = 0
+    for path in args.files:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        updates = data if isinstance(data, list) else [data]
+        for update in updates:
+            status = post_update(args.url, update, args.secret)
+            ok = "✅" if status == 200 else "❌"
+            print(f"{ok} {path} update_id={update.get('update_id')} -> HTTP {status}")
+            failed += status != 200
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
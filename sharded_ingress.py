@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Sharded serving mode for the learning bot
+One ingress process receives updates (long polling or webhook) and routes
+each one by user id to one of N worker processes, so every user's updates
+are handled, in order, by the same worker and its caches
+"""
+
+import os
+import sys
+import hmac
+import asyncio
+import logging
+import secrets
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+from telegram import Update
+
+import bot_metrics
+from bot_runner import stop_signal_event
+from catch_up import CATCH_UP
+from sharding import WORKER_COUNT, shard_for, update_user_id
+from webhook_server import SECRET_HEADER, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_URL, webhook_secret
+
+logger = logging.getLogger(__name__)
+
+# Worker i listens on 127.0.0.1:(WORKER_BASE_PORT + i)
+WORKER_BASE_PORT = int(os.environ.get("WORKER_BASE_PORT", "8101"))
+# How the ingress receives updates: polling (getUpdates) or webhook
+INGRESS_MODE = os.environ.get("INGRESS_MODE", "polling").strip().lower()
+# Updates waiting for one worker; further updates for that worker are dropped
+WORKER_QUEUE_SIZE = int(os.environ.get("WORKER_QUEUE_SIZE", "1000"))
+# Seconds an update is retried against a worker that is down before it is dropped
+FORWARD_RETRY_SECONDS = float(os.environ.get("FORWARD_RETRY_SECONDS", "30"))
+
+forward_failures = bot_metrics.counter("ingress_forward_failures_total", "Forwarding attempts that failed")
+worker_restarts = bot_metrics.counter("ingress_worker_restarts_total", "Worker processes restarted after exiting")
+
+
+def _worker_path(path: str, index: int) -> str:
+    # bot_state.sqlite3 -> bot_state.worker0.sqlite3
+    directory, name = os.path.split(path)
+    root, dot, ext = name.partition(".")
+    return os.path.join(directory, f"{root}.worker{index}{dot}{ext}")
+
+
+class ShardRouter:
+    """Forwards updates to worker webhooks, one queue per worker
+
+    A worker's updates are posted one at a time, so each user's updates
+    reach their worker in the order Telegram sent them. A worker that is
+    briefly down (restarting) is retried for up to ``retry_seconds`` per
+    update. Routing never waits: when a worker's queue is full the update
+    is dropped, so one stuck worker can't stall the other shards.
+    """
+
+    def __init__(self, workers: int, base_port: int = WORKER_BASE_PORT,
+                 secret_token: str = "", path: str = WEBHOOK_PATH,
+                 retry_seconds: float = FORWARD_RETRY_SECONDS):
+        self._retry_seconds = retry_seconds
+        self._urls = [f"http://127.0.0.1:{base_port + i}{path}" for i in range(workers)]
+        self._headers = {SECRET_HEADER: secret_token} if secret_token else {}
+        self._queues: List[asyncio.Queue] = [asyncio.Queue(WORKER_QUEUE_SIZE) for _ in range(workers)]
+        self._routed = [
+            bot_metrics.counter(f'ingress_routed_total{{worker="{i}"}}', "Updates forwarded to a worker")
+            for i in range(workers)
+        ]
+        self._depth = [
+            bot_metrics.gauge(f'ingress_queue_depth{{worker="{i}"}}', "Updates waiting to be forwarded to a worker")
+            for i in range(workers)
+        ]
+        # Drop warnings are logged at most every 10 s per worker
+        self._last_drop_log = [float("-inf")] * workers
+        self._unlogged_drops = [0] * workers
+        self._dropped = [
+            bot_metrics.counter(f'ingress_dropped_total{{worker="{i}"}}', "Updates dropped: worker queue full or retries exhausted")
+            for i in range(workers)
+        ]
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        self._tasks = [asyncio.create_task(self._forward(i)) for i in range(len(self._queues))]
+
+    def route(self, update: dict) -> Optional[int]:
+        """Queue ``update`` for its worker; returns the worker, or None if it was dropped"""
+        index = shard_for(update_user_id(update), len(self._queues))
+        try:
+            self._queues[index].put_nowait(update)
+        except asyncio.QueueFull:
+            self._drop(index, update, "queue full")
+            return None
+        self._depth[index].set(self._queues[index].qsize())
+        return index
+
+    def _drop(self, index: int, update: dict, reason: str) -> None:
+        self._dropped[index].inc()
+        self._unlogged_drops[index] += 1
+        now = asyncio.get_running_loop().time()
+        if now - self._last_drop_log[index] >= 10:
+            logger.warning(f"⚠️  Dropped {self._unlogged_drops[index]} update(s) for worker {index}, "
+                           f"latest {update.get('update_id')}: {reason}")
+            self._last_drop_log[index] = now
+            self._unlogged_drops[index] = 0
+
+    async def _post(self, index: int, update: dict) -> bool:
+        """Deliver one update, retrying a worker that is down; False once the retry time is up"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._retry_seconds
+        delay = 0.1
+        while True:
+            try:
+                async with self._session.post(self._urls[index], json=update, headers=self._headers) as response:
+                    if response.status < 500:
+                        if response.status != 200:
+                            logger.warning(f"⚠️  Worker {index} rejected update {update.get('update_id')}: HTTP {response.status}")
+                        return True
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            forward_failures.inc()
+            if loop.time() + delay > deadline:
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5.0)
+
+    async def _forward(self, index: int) -> None:
+        queue = self._queues[index]
+        while True:
+            update = await queue.get()
+            if await self._post(index, update):
+                self._routed[index].inc()
+            else:
+                self._drop(index, update, f"worker unreachable for {self._retry_seconds:.0f}s")
+            self._depth[index].set(queue.qsize())
+            queue.task_done()
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Deliver what is queued (up to ``timeout``), then stop"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️  {sum(q.qsize() for q in self._queues)} updates not delivered to workers")
+        for task in self._tasks:
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+
+
+class WorkerPool:
+    """Runs the worker processes and restarts any that exit"""
+
+    def __init__(self, command: List[str], workers: int, secret_token: str,
+                 base_port: int = WORKER_BASE_PORT):
+        self._command = command
+        self._workers = workers
+        self._secret_token = secret_token
+        self._base_port = base_port
+        self._processes: Dict[int, asyncio.subprocess.Process] = {}
+        self._supervisors: List[asyncio.Task] = []
+        self._stopping = False
+
+    def _environment(self, index: int) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "BOT_MODE": "webhook",
+            "WEBHOOK_REGISTER": "0",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "PORT": str(self._base_port + index),
+            "WEBHOOK_SECRET": self._secret_token,
+            "WORKER_INDEX": str(index),
+            "WORKER_COUNT": str(self._workers),
+            # Telegram's global limit is per bot, so the workers split it
+            "TG_GLOBAL_RATE": str(float(os.environ.get("TG_GLOBAL_RATE", "30")) / self._workers),
+        })
+        # Local files can't be shared between processes; the state store can
+        if env.get("PERSISTENCE_PATH") and not env.get("STATE_STORE_URL"):
+            env["PERSISTENCE_PATH"] = _worker_path(env["PERSISTENCE_PATH"], index)
+        # Each worker only holds its own users' progress
+        snapshot_path = env.get("CACHE_SNAPSHOT_PATH", "cache_snapshot.json.gz")
+        if snapshot_path:
+            env["CACHE_SNAPSHOT_PATH"] = _worker_path(snapshot_path, index)
+        return env
+
+    async def _spawn(self, index: int) -> None:
+        self._processes[index] = await asyncio.create_subprocess_exec(*self._command, env=self._environment(index))
+
+    async def _supervise(self, index: int) -> None:
+        while not self._stopping:
+            code = await self._processes[index].wait()
+            if self._stopping:
+                return
+            worker_restarts.inc()
+            logger.error(f"❌ Worker {index} exited with code {code}; restarting")
+            delay = 1.0
+            while True:
+                await asyncio.sleep(delay)
+                if self._stopping:
+                    return
+                try:
+                    await self._spawn(index)
+                    break
+                except Exception as e:
+                    delay = min(delay * 2, 60.0)
+                    logger.error(f"❌ Could not restart worker {index}: {e}; retrying in {delay:.0f}s")
+
+    async def start(self, ready_timeout: float = 60.0) -> None:
+        """Start all workers and wait until each reports ready"""
+        for index in range(self._workers):
+            await self._spawn(index)
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=2)) as session:
+            await asyncio.gather(*(self._wait_ready(session, i, ready_timeout) for i in range(self._workers)))
+        self._supervisors = [asyncio.create_task(self._supervise(i)) for i in range(self._workers)]
+        logger.info(f"✅ {self._workers} workers ready")
+
+    async def _wait_ready(self, session: aiohttp.ClientSession, index: int, timeout: float) -> None:
+        url = f"http://127.0.0.1:{self._base_port + index}/readyz"
+        deadline = asyncio.get_running_loop().time() + timeout
+        while asyncio.get_running_loop().time() < deadline:
+            if self._processes[index].returncode is not None:
+                raise RuntimeError(f"Worker {index} exited during startup")
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            await asyncio.sleep(0.5)
+        raise RuntimeError(f"Worker {index} not ready after {timeout:.0f}s")
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """SIGTERM every worker (they flush state on the way out) and wait"""
+        self._stopping = True
+        for task in self._supervisors:
+            task.cancel()
+        for process in self._processes.values():
+            if process.returncode is None:
+                process.terminate()
+        for index, process in self._processes.items():
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"⚠️  Worker {index} did not stop in time; killing it")
+                process.kill()
+                await process.wait()
+
+
+async def _api(session: aiohttp.ClientSession, token: str, method: str, **params):
+    async with session.post(f"https://api.telegram.org/bot{token}/{method}", json=params) as response:
+        body = await response.json()
+    if not body.get("ok"):
+        raise RuntimeError(f"{method} failed: {body.get('description')}")
+    return body["result"]
+
+
+async def _poll(token: str, router: ShardRouter, stop_event: asyncio.Event) -> None:
+    timeout = aiohttp.ClientTimeout(total=40)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        # Same start as the single-process poller: no webhook; the backlog is kept with CATCH_UP
+        await _api(session, token, "deleteWebhook", drop_pending_updates=not CATCH_UP)
+        offset = 0
+        while not stop_event.is_set():
+            try:
+                updates = await _api(session, token, "getUpdates", offset=offset, timeout=30,
+                                     allowed_updates=Update.ALL_TYPES)
+            except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+                logger.warning(f"⚠️  getUpdates failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                router.route(update)
+                offset = update["update_id"] + 1
+
+
+def _ingress_app(router: ShardRouter, secret_token: str) -> web.Application:
+    if not secret_token:
+        raise ValueError("secret_token is required")
+
+    async def handle_update(request: web.Request) -> web.Response:
+        received = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(received.encode(), secret_token.encode()):
+            return web.Response(status=403)
+        try:
+            update = await request.json()
+        except ValueError:
+            # Malformed JSON or a body that isn't UTF-8
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+        router.route(update)
+        return web.Response(status=200)
+
+    async def healthz(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=bot_metrics.render_text(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+async def run_ingress(token: str, worker_command: Optional[List[str]] = None,
+                      workers: int = WORKER_COUNT, mode: str = INGRESS_MODE) -> None:
+    """Start the workers, then receive updates and route them until SIGINT/SIGTERM"""
+    stop_event = stop_signal_event()
+    # The workers are only reachable on localhost, but still require a secret
+    internal_secret = secrets.token_urlsafe(32)
+    pool = WorkerPool(worker_command or [sys.executable, os.path.abspath(sys.argv[0])], workers, internal_secret)
+    router = ShardRouter(workers, secret_token=internal_secret)
+
+    await pool.start()
+    await router.start()
+    logger.info(f"🚀 Routing updates to {workers} workers ({mode})")
+    runner = None
+    try:
+        if mode == "webhook":
+            if not WEBHOOK_URL:
+                raise RuntimeError("WEBHOOK_URL must be set for the webhook ingress")
+            # The ingress always registers the webhook, so a missing secret is generated
+            secret_token = webhook_secret(register=True)
+            runner = web.AppRunner(_ingress_app(router, secret_token))
+            await runner.setup()
+            await web.TCPSite(runner, "0.0.0.0", WEBHOOK_PORT).start()
+            async with aiohttp.ClientSession() as session:
+                await _api(session, token, "setWebhook", url=WEBHOOK_URL + WEBHOOK_PATH,
+                           secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+            logger.info(f"✅ Webhook registered: {WEBHOOK_URL}{WEBHOOK_PATH}")
+            await stop_event.wait()
+        else:
+            poller = asyncio.create_task(_poll(token, router, stop_event))
+            stop_waiter = asyncio.create_task(stop_event.wait())
+            await asyncio.wait({poller, stop_waiter}, return_when=asyncio.FIRST_COMPLETED)
+            stop_waiter.cancel()
+            if poller.done():
+                # Polling can only end by failing to start (bad token, network)
+                poller.result()
+            poller.cancel()
+    finally:
+        logger.info("⏹  Stopping ingress...")
+        if runner is not None:
+            await runner.cleanup()
+        await router.close()
+        await pool.stop()
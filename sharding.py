@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Routing of users to worker processes
+Shared by the sharded ingress and the workers, so both agree on which
+worker owns which user
+"""
+
+import os
+import zlib
+from typing import Callable, Optional
+
+# Worker processes behind the ingress (1 = no sharding)
+WORKER_COUNT = max(1, int(os.environ.get("WORKER_COUNT", "1")))
+# Set by the ingress in each worker's environment
+WORKER_INDEX = int(os.environ.get("WORKER_INDEX", "0"))
+
+# Update fields carrying the acting user, in the order they are looked up
+USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "my_chat_member", "chat_member", "chat_join_request",
+    "business_message", "edited_business_message", "message_reaction", "purchased_paid_media",
+    "poll_answer",
+)
+
+
+def shard_for(user_id: int, workers: int) -> int:
+    """Worker index for ``user_id``; stable across processes and restarts"""
+    if workers <= 1:
+        return 0
+    return zlib.crc32(str(user_id).encode("ascii")) % workers
+
+
+def update_user_id(update: dict) -> int:
+    """Id of the user behind a raw update (0 if it has none)"""
+    for field in USER_FIELDS:
+        item = update.get(field)
+        if item:
+            user = item.get("from") or item.get("user")
+            if user:
+                return user["id"]
+            chat = item.get("chat")
+            if chat:
+                return chat["id"]
+    return 0
+
+
+def shard_filter() -> Optional[Callable[[int], bool]]:
+    """Filter of the users owned by this worker, or None when not sharded"""
+    if WORKER_COUNT <= 1:
+        return None
+    return lambda user_id: shard_for(user_id, WORKER_COUNT) == WORKER_INDEX
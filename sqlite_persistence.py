@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Durable user and conversation state for the learning bot
+A python-telegram-bot persistence backed by a local SQLite file (or a
+shared state store for sharded workers), so a redeploy in the middle of
+an exam or a registration doesn't lose it
+"""
+
+import os
+import json
+import pickle
+import asyncio
+import hashlib
+import logging
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import bot_metrics
+
+logger = logging.getLogger(__name__)
+
+# SQLite file holding the state (empty = no persistence)
+PERSISTENCE_PATH = os.environ.get("PERSISTENCE_PATH", "bot_state.sqlite3").strip()
+# Seconds between flushes of changed users to disk
+PERSISTENCE_INTERVAL = float(os.environ.get("PERSISTENCE_INTERVAL", "30"))
+
+rows_written = bot_metrics.counter("persistence_rows_written_total", "User/conversation rows written to storage")
+rows_unchanged = bot_metrics.counter("persistence_rows_unchanged_total", "User data updates skipped because nothing changed")
+flushes = bot_metrics.counter("persistence_flushes_total", "Batched state writes")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+
+def _dumps(obj: Any) -> bytes:
+    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=8).digest()
+
+
+class BatchedPersistence(BasePersistence, ABC):
+    """user_data and conversation states, pickled and written in batches
+
+    The application hands over the users touched since the last interval;
+    a user whose pickled data is byte-identical to what was last written
+    is skipped, the rest are queued and handed to the storage backend in
+    one batch per interval. chat_data, bot_data and callback_data are not
+    used by the bot and are not stored.
+
+    With ``user_filter`` only the matching users (and conversations whose
+    key ends with a matching user id) are loaded - a sharded worker only
+    restores the users routed to it.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_INTERVAL,
+                 user_filter: Optional[Callable[[int], bool]] = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self._user_filter = user_filter
+        # Digest of what is stored, per user - the dirty check
+        self._written: Dict[int, bytes] = {}
+        # Queued writes: user_id -> pickled data (None = delete)
+        self._pending_users: Dict[int, Optional[bytes]] = {}
+        # (conversation name, key as JSON) -> pickled state (None = delete)
+        self._pending_conversations: Dict[Tuple[str, str], Optional[bytes]] = {}
+        self._commit_task: Optional[asyncio.Task] = None
+
+    # ==================== storage backend ====================
+
+    @abstractmethod
+    async def _load_users(self) -> Iterable[Tuple[int, bytes]]:
+        """All stored (user_id, pickled user_data) pairs"""
+
+    @abstractmethod
+    async def _load_conversations(self, name: str) -> Iterable[Tuple[str, bytes]]:
+        """All stored (key as JSON, pickled state) pairs of a conversation"""
+
+    @abstractmethod
+    async def _store(self, users: Dict[int, Optional[bytes]],
+                     conversations: Dict[Tuple[str, str], Optional[bytes]]) -> None:
+        """Write one batch; None values are deletions"""
+
+    async def _close(self) -> None:
+        pass
+
+    def _owns(self, user_id: int) -> bool:
+        return self._user_filter is None or self._user_filter(user_id)
+
+    # ==================== batching ====================
+
+    def _schedule_commit(self) -> None:
+        # The application reports all changed users of an interval together;
+        # the commit task runs after them and writes them in one batch
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.create_task(self._commit())
+
+    async def _commit(self) -> None:
+        while self._pending_users or self._pending_conversations:
+            users, self._pending_users = self._pending_users, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            try:
+                await self._store(users, conversations)
+            except Exception as e:
+                logger.error(f"❌ Error writing bot state: {e}")
+                # Requeue for the next interval, keeping anything newer that arrived meanwhile
+                self._pending_users = {**users, **self._pending_users}
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                return
+            flushes.inc()
+            rows_written.inc(len(users) + len(conversations))
+
+    # ==================== user_data ====================
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        user_data = {}
+        for user_id, blob in await self._load_users():
+            if not self._owns(user_id):
+                continue
+            try:
+                user_data[user_id] = pickle.loads(blob)
+            except Exception as e:
+                # Written by an incompatible version of the code - start that user fresh
+                logger.warning(f"⚠️  Dropping unreadable state of user {user_id}: {e}")
+                continue
+            self._written[user_id] = _digest(blob)
+        logger.info(f"✅ Restored state of {len(user_data)} users")
+        return user_data
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        blob = _dumps(data)
+        digest = _digest(blob)
+        if self._written.get(user_id) == digest:
+            rows_unchanged.inc()
+            return
+        self._written[user_id] = digest
+        self._pending_users[user_id] = blob
+        self._schedule_commit()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._written.pop(user_id, None)
+        self._pending_users[user_id] = None
+        self._schedule_commit()
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        pass
+
+    # ==================== conversations ====================
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[int, ...], object]:
+        conversations = {}
+        for key, state in await self._load_conversations(name):
+            key = tuple(json.loads(key))
+            if key and self._owns(key[-1]):
+                conversations[key] = pickle.loads(state)
+        return conversations
+
+    async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        blob = None if new_state is None else _dumps(new_state)
+        self._pending_conversations[(name, json.dumps(list(key)))] = blob
+        self._schedule_commit()
+
+    # ==================== unused stores ====================
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        pass
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def update_bot_data(self, data: Any) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    # ==================== shutdown ====================
+
+    async def flush(self) -> None:
+        """Write everything still queued and close the storage"""
+        if self._commit_task is not None:
+            await self._commit_task
+        await self._commit()
+        await self._close()
+
+
+class SQLitePersistence(BatchedPersistence):
+    """Bot state in a local SQLite file
+
+    All SQLite access happens on a single worker thread; each interval's
+    batch is one transaction.
+    """
+
+    def __init__(self, path: str = PERSISTENCE_PATH, update_interval: float = PERSISTENCE_INTERVAL,
+                 user_filter: Optional[Callable[[int], bool]] = None):
+        super().__init__(update_interval, user_filter)
+        self._path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistence")
+
+    # ==================== storage thread ====================
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def _read_all(self, query: str, params: tuple = ()) -> list:
+        return self._connect().execute(query, params).fetchall()
+
+    def _write_batch(self, users: Dict[int, Optional[bytes]],
+                     conversations: Dict[Tuple[str, str], Optional[bytes]]) -> None:
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT INTO user_data (user_id, data) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                [(user_id, blob) for user_id, blob in users.items() if blob is not None]
+            )
+            connection.executemany(
+                "DELETE FROM user_data WHERE user_id = ?",
+                [(user_id,) for user_id, blob in users.items() if blob is None]
+            )
+            connection.executemany(
+                "INSERT INTO conversations (name, key, state) VALUES (?, ?, ?) "
+                "ON CONFLICT(name, key) DO UPDATE SET state = excluded.state",
+                [(name, key, blob) for (name, key), blob in conversations.items() if blob is not None]
+            )
+            connection.executemany(
+                "DELETE FROM conversations WHERE name = ? AND key = ?",
+                [(name, key) for (name, key), blob in conversations.items() if blob is None]
+            )
+
+    async def _in_thread(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # ==================== backend hooks ====================
+
+    async def _load_users(self) -> Iterable[Tuple[int, bytes]]:
+        return await self._in_thread(self._read_all, "SELECT user_id, data FROM user_data")
+
+    async def _load_conversations(self, name: str) -> Iterable[Tuple[str, bytes]]:
+        return await self._in_thread(
+            self._read_all, "SELECT key, state FROM conversations WHERE name = ?", (name,)
+        )
+
+    async def _store(self, users: Dict[int, Optional[bytes]],
+                     conversations: Dict[Tuple[str, str], Optional[bytes]]) -> None:
+        await self._in_thread(self._write_batch, users, conversations)
+
+    async def _close(self) -> None:
+        if self._connection is not None:
+            await self._in_thread(self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=True)
+
+
+class StateStorePersistence(BatchedPersistence):
+    """Bot state in a shared StateStore (Redis), for workers on several hosts
+
+    Keys are ``user:<id>`` and ``conv:<name>:<key as JSON>``.
+    """
+
+    def __init__(self, store, update_interval: float = PERSISTENCE_INTERVAL,
+                 user_filter: Optional[Callable[[int], bool]] = None):
+        super().__init__(update_interval, user_filter)
+        self._store_backend = store
+
+    async def _load_keys(self, prefix: str) -> List[Tuple[str, bytes]]:
+        keys = [key async for key in self._store_backend.keys(prefix)]
+        values = await self._store_backend.get_many(keys)
+        return [(key[len(prefix):], value) for key, value in zip(keys, values) if value is not None]
+
+    async def _load_users(self) -> Iterable[Tuple[int, bytes]]:
+        return [(int(user_id), blob) for user_id, blob in await self._load_keys("user:")]
+
+    async def _load_conversations(self, name: str) -> Iterable[Tuple[str, bytes]]:
+        return await self._load_keys(f"conv:{name}:")
+
+    async def _store(self, users: Dict[int, Optional[bytes]],
+                     conversations: Dict[Tuple[str, str], Optional[bytes]]) -> None:
+        items = {f"user:{user_id}": blob for user_id, blob in users.items()}
+        items.update({f"conv:{name}:{key}": blob for (name, key), blob in conversations.items()})
+        await self._store_backend.write_batch(items)
+
+    async def _close(self) -> None:
+        await self._store_backend.close()
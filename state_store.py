@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Shared state tier for sharded workers
+A minimal async key/value interface with a Redis implementation and an
+in-process stand-in for local runs and tests
+"""
+
+import os
+import time
+import asyncio
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+# redis://host:6379/0 (any Redis-compatible server) or memory:// (single process only)
+STATE_STORE_URL = os.environ.get("STATE_STORE_URL", "").strip()
+
+
+class StateStore(ABC):
+    """Async bytes key/value store"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        ...
+
+    @abstractmethod
+    async def write_batch(self, items: Dict[str, Optional[bytes]]) -> None:
+        """Set every key to its value, deleting keys mapped to None"""
+
+    @abstractmethod
+    def keys(self, prefix: str) -> AsyncIterator[str]:
+        """Iterate over every key starting with ``prefix``"""
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """In-process stand-in with the same semantics (including TTLs)"""
+
+    def __init__(self):
+        # key -> (value, expires_at or None)
+        self._items: Dict[str, Tuple[bytes, Optional[float]]] = {}
+
+    def _live(self, key: str) -> Optional[bytes]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._items[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._live(key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        self._items[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    async def delete(self, key: str) -> None:
+        self._items.pop(key, None)
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        return [self._live(key) for key in keys]
+
+    async def write_batch(self, items: Dict[str, Optional[bytes]]) -> None:
+        for key, value in items.items():
+            if value is None:
+                self._items.pop(key, None)
+            else:
+                self._items[key] = (value, None)
+
+    async def keys(self, prefix: str) -> AsyncIterator[str]:
+        for key in [k for k in self._items if k.startswith(prefix)]:
+            if self._live(key) is not None:
+                yield key
+            await asyncio.sleep(0)
+
+
+class RedisStateStore(StateStore):
+    """Redis (or any server speaking its protocol) via redis-py's asyncio client"""
+
+    def __init__(self, url: str, namespace: str = "learnbot:"):
+        try:
+            from redis import asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("STATE_STORE_URL points to Redis but the 'redis' package is not installed "
+                               "(pip install 'redis>=5.0')") from e
+        self._redis = redis_asyncio.from_url(url)
+        self._namespace = namespace
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._redis.get(self._namespace + key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        await self._redis.set(self._namespace + key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, key: str) -> None:
+        await self._redis.delete(self._namespace + key)
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        if not keys:
+            return []
+        return await self._redis.mget([self._namespace + key for key in keys])
+
+    async def write_batch(self, items: Dict[str, Optional[bytes]]) -> None:
+        # One round trip for the whole batch
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                if value is None:
+                    pipe.delete(self._namespace + key)
+                else:
+                    pipe.set(self._namespace + key, value)
+            await pipe.execute()
+
+    async def keys(self, prefix: str) -> AsyncIterator[str]:
+        skip = len(self._namespace)
+        async for key in self._redis.scan_iter(match=self._namespace + prefix + "*", count=500):
+            yield key.decode()[skip:]
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_state_store(url: str = STATE_STORE_URL) -> Optional[StateStore]:
+    """Store for ``url``, or None if no shared store is configured"""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemoryStateStore()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStateStore(url)
+    raise ValueError(f"Unsupported STATE_STORE_URL: {url}")
@@ -0,0 +1,22 @@
+-- Lessons content watermark
+-- The bot caches the lesson catalog in memory and revalidates it by
+-- comparing (row count, max(updated_at)); keep updated_at current on edits.
+
+ALTER TABLE lessons ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+CREATE OR REPLACE FUNCTION set_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_lessons_updated_at ON lessons;
+CREATE TRIGGER trg_lessons_updated_at
+    BEFORE UPDATE ON lessons
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_lessons_updated_at ON lessons(updated_at);
+
+COMMENT ON COLUMN lessons.updated_at IS 'Last content change; used by the bot to invalidate its lesson cache';
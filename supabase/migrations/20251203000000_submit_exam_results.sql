@@ -0,0 +1,34 @@
+-- Persist a finished exam in one round trip and one transaction
+-- p_answers: JSON array of {"question_id", "user_answer", "is_correct"}
+
+CREATE OR REPLACE FUNCTION submit_exam_results(
+    p_telegram_id BIGINT,
+    p_lesson_id INTEGER,
+    p_answers JSONB,
+    p_passed BOOLEAN
+)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO question_answers (telegram_id, question_id, user_answer, is_correct, answered_at)
+    SELECT p_telegram_id,
+           (a->>'question_id')::INTEGER,
+           a->>'user_answer',
+           (a->>'is_correct')::BOOLEAN,
+           NOW()
+    FROM jsonb_array_elements(COALESCE(p_answers, '[]'::jsonb)) AS a
+    ON CONFLICT (telegram_id, question_id) DO UPDATE
+        SET user_answer = EXCLUDED.user_answer,
+            is_correct = EXCLUDED.is_correct,
+            answered_at = EXCLUDED.answered_at;
+
+    IF p_passed THEN
+        INSERT INTO user_progress (telegram_id, lesson_id, is_completed, completed_at)
+        VALUES (p_telegram_id, p_lesson_id, TRUE, NOW())
+        ON CONFLICT (telegram_id, lesson_id) DO UPDATE
+            SET is_completed = TRUE,
+                completed_at = EXCLUDED.completed_at;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION submit_exam_results IS 'Saves all answers of an exam and the lesson progress atomically';
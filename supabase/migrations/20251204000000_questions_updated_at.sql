@@ -0,0 +1,15 @@
+-- Questions content watermark
+-- The bot keeps the question bank in memory and revalidates it by
+-- comparing (row count, max(updated_at)), like the lessons catalog.
+-- Reuses set_updated_at() from the lessons watermark migration.
+
+ALTER TABLE questions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+DROP TRIGGER IF EXISTS trg_questions_updated_at ON questions;
+CREATE TRIGGER trg_questions_updated_at
+    BEFORE UPDATE ON questions
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_questions_updated_at ON questions(updated_at);
+
+COMMENT ON COLUMN questions.updated_at IS 'Last content change; used by the bot to invalidate its question bank';
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Token bucket used for outbound and inbound rate limiting
+"""
+
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, at most ``capacity``
+
+    ``reserve`` always succeeds and returns how long the caller must wait
+    for its token. Tokens may go negative, which queues callers in
+    reservation order without any lock.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def try_take(self, amount: float = 1, now: Optional[float] = None) -> bool:
+        """Take tokens if available right now"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def wait_time(self, amount: float = 1, now: Optional[float] = None) -> float:
+        """Seconds until ``amount`` tokens are available (0 if they are)"""
+        self._refill(time.monotonic() if now is None else now)
+        missing = amount - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def reserve(self, amount: float = 1, now: Optional[float] = None) -> float:
+        """Take tokens now, possibly on credit; returns the seconds to wait"""
+        self._refill(time.monotonic() if now is None else now)
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def is_full(self, now: Optional[float] = None) -> bool:
+        self._refill(time.monotonic() if now is None else now)
+        return self.tokens >= self.capacity
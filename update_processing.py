@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Update processor for python-telegram-bot
+Handles updates of different users in parallel while every user's own
+updates stay strictly ordered, so per-user exam state never races
+"""
+
+import os
+import time
+import logging
+from typing import Any, Awaitable, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import api_calls
+import bot_metrics
+from catch_up import UpdateWatermark
+from keyed_scheduler import KeyedSerializer
+
+logger = logging.getLogger(__name__)
+
+# Updates accepted by the processor but not yet finished (includes queued ones)
+MAX_PENDING_UPDATES = int(os.environ.get("MAX_PENDING_UPDATES", "1024"))
+# Queued updates from which menu taps, then lesson requests, get a "busy" reply instead
+SHED_LOW_DEPTH = int(os.environ.get("SHED_LOW_DEPTH", "200"))
+SHED_NORMAL_DEPTH = int(os.environ.get("SHED_NORMAL_DEPTH", "600"))
+
+BUSY_TEXT = "⏳ ربات در حال حاضر شلوغ است. لطفاً چند لحظه دیگر دوباره تلاش کنید."
+
+
+class InboundPriority:
+    """Admission classes of incoming updates; lower is served first"""
+    CRITICAL = 0  # exam answers, registration steps
+    NORMAL = 1    # lesson delivery and anything unclassified
+    LOW = 2       # menus, /lessons, /progress
+
+    NAMES = {CRITICAL: "critical", NORMAL: "normal", LOW: "low"}
+
+
+CRITICAL_CALLBACK_PREFIXES = ("exam_", "start_exam_", "python_", "e:")
+LOW_CALLBACKS = frozenset({"lessons_menu", "main_menu", "my_progress"})
+CRITICAL_COMMANDS = frozenset({"start", "cancel"})
+LOW_COMMANDS = frozenset({"lessons", "progress"})
+
+queue_depth = {
+    p: bot_metrics.gauge(f'inbound_queue_depth{{priority="{name}"}}', "Updates waiting for a handler slot")
+    for p, name in InboundPriority.NAMES.items()
+}
+wait_seconds = {
+    p: bot_metrics.counter(f'inbound_wait_seconds_total{{priority="{name}"}}', "Time updates spent queued")
+    for p, name in InboundPriority.NAMES.items()
+}
+started_updates = {
+    p: bot_metrics.counter(f'inbound_started_total{{priority="{name}"}}', "Updates that reached a handler")
+    for p, name in InboundPriority.NAMES.items()
+}
+shed_updates = {
+    p: bot_metrics.counter(f'inbound_shed_total{{priority="{name}"}}', "Updates answered busy instead of handled")
+    for p, name in InboundPriority.NAMES.items()
+}
+
+
+def update_key(update: object) -> Optional[Hashable]:
+    """Ordering key of an update: the user, else the chat, else none"""
+    if isinstance(update, Update):
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return ("chat", update.effective_chat.id)
+    return None
+
+
+def update_priority(update: object) -> int:
+    """Admission class of an update"""
+    if not isinstance(update, Update):
+        return InboundPriority.NORMAL
+    if update.callback_query:
+        data = update.callback_query.data or ""
+        if data.startswith(CRITICAL_CALLBACK_PREFIXES):
+            return InboundPriority.CRITICAL
+        if data in LOW_CALLBACKS:
+            return InboundPriority.LOW
+        return InboundPriority.NORMAL
+    message = update.effective_message
+    if message is not None:
+        if message.text and message.text.startswith("/"):
+            command = message.text[1:].split(maxsplit=1)[0].split("@", 1)[0].lower() if len(message.text) > 1 else ""
+            if command in CRITICAL_COMMANDS:
+                return InboundPriority.CRITICAL
+            if command in LOW_COMMANDS:
+                return InboundPriority.LOW
+            return InboundPriority.NORMAL
+        if message.text or message.contact:
+            # Typed exam answers and registration steps (name, phone)
+            return InboundPriority.CRITICAL
+    return InboundPriority.NORMAL
+
+
+async def reply_busy(update: object) -> None:
+    """Cheapest possible "try again" for a shed update"""
+    if not isinstance(update, Update):
+        return
+    try:
+        if update.callback_query:
+            # A toast on the pressed button; answerCallbackQuery isn't rate limited
+            await update.callback_query.answer(BUSY_TEXT)
+        elif update.effective_message:
+            await update.effective_message.reply_text(BUSY_TEXT)
+    except Exception as e:
+        logger.debug(f"Could not send busy reply: {e}")
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Parallel across users, sequential per user
+
+    ``max_concurrent_updates`` handlers run at the same time. The base class
+    is given ``max_pending`` so that updates waiting behind the same user
+    don't occupy a handler slot. With a ``watermark``, every update is
+    reported to it when it arrives and when it is done.
+
+    Free handler slots go to critical updates (exam answers, registration)
+    before lesson requests and menus. Once ``shed_low`` updates are queued,
+    new low-priority updates are answered "busy" instead of queued; from
+    ``shed_normal`` on, normal ones too. Critical updates are never shed.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending: int = MAX_PENDING_UPDATES,
+                 watermark: Optional[UpdateWatermark] = None,
+                 shed_low: int = SHED_LOW_DEPTH, shed_normal: int = SHED_NORMAL_DEPTH):
+        # The base semaphore bounds pending work; must be > 1 for PTB to dispatch in parallel
+        super().__init__(max(2, max_pending, max_concurrent_updates))
+        self._handler_slots = max(1, max_concurrent_updates)
+        self._serializer: Optional[KeyedSerializer] = None
+        self._watermark = watermark
+        self._shed_depth = {InboundPriority.LOW: shed_low, InboundPriority.NORMAL: shed_normal}
+
+    @property
+    def handler_slots(self) -> int:
+        return self._handler_slots
+
+    async def initialize(self) -> None:
+        # Created here so the semaphore belongs to the running event loop
+        self._serializer = KeyedSerializer(self._handler_slots)
+
+    async def shutdown(self) -> None:
+        self._serializer = None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # Called in queue order, before waiting for the semaphore
+        update_id = update.update_id if self._watermark is not None and isinstance(update, Update) else None
+        if update_id is not None:
+            self._watermark.started(update_id)
+        try:
+            await super().process_update(update, coroutine)
+        finally:
+            if update_id is not None:
+                self._watermark.finished(update_id)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        if self._serializer is None:
+            self._serializer = KeyedSerializer(self._handler_slots)
+        priority = update_priority(update)
+        shed_depth = self._shed_depth.get(priority)
+        if shed_depth is not None and self._serializer.waiting() >= shed_depth:
+            close = getattr(coroutine, "close", None)
+            if close is not None:
+                close()
+            shed_updates[priority].inc()
+            await reply_busy(update)
+            return
+
+        queued_at = time.monotonic()
+        started = False
+
+        async def timed() -> Any:
+            nonlocal started
+            started = True
+            queue_depth[priority].dec()
+            wait_seconds[priority].inc(time.monotonic() - queued_at)
+            started_updates[priority].inc()
+            return await coroutine
+
+        queue_depth[priority].inc()
+        token = None
+        try:
+            # Bot API calls made while handling this update are counted against it
+            token = api_calls.begin(api_calls.interaction_name(update))
+            await self._serializer.run(update_key(update), timed(), priority)
+        finally:
+            if not started:
+                # Cancelled while queued (or failed before queueing)
+                queue_depth[priority].dec()
+                close = getattr(coroutine, "close", None)
+                if close is not None:
+                    close()
+            if token is not None:
+                api_calls.end(token)
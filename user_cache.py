@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Per-user caches for the learning bot
+Completed-lesson sets of active learners are kept in a bounded LRU and
+written through when an exam is passed
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import FrozenSet, List
+
+import bot_metrics
+
+logger = logging.getLogger(__name__)
+
+# Max users whose progress is kept in memory
+PROGRESS_CACHE_SIZE = int(os.environ.get("PROGRESS_CACHE_SIZE", "5000"))
+# Seconds of inactivity after which a user's progress is evicted
+PROGRESS_CACHE_IDLE = float(os.environ.get("PROGRESS_CACHE_IDLE", "1800"))
+
+progress_hits = bot_metrics.counter("progress_cache_hits_total", "Progress lookups served from memory")
+progress_misses = bot_metrics.counter("progress_cache_misses_total", "Progress lookups loaded from the database")
+progress_size = bot_metrics.gauge("progress_cache_users", "Users with cached progress")
+
+
+class ProgressCache:
+    """Completed lesson ids per user, bounded LRU with idle expiry
+
+    Entries are kept in access order, so the least recently used entry is
+    always first: idle eviction pops from the front and stops at the first
+    live entry, and capacity eviction drops the front as well.
+    """
+
+    def __init__(self, repository, max_users: int = PROGRESS_CACHE_SIZE,
+                 idle_ttl: float = PROGRESS_CACHE_IDLE):
+        self._repository = repository
+        self._max_users = max(1, max_users)
+        self._idle_ttl = idle_ttl
+        # telegram_id -> (completed lesson ids, last access)
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._loading = {}
+        # Passes recorded while the user's progress was being loaded
+        self._pending = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, telegram_id: int) -> bool:
+        return telegram_id in self._entries
+
+    async def completed(self, telegram_id: int) -> FrozenSet[int]:
+        """Return the ids of lessons the user completed"""
+        now = time.monotonic()
+        self.evict_idle(now)
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            progress_hits.inc()
+            self._entries[telegram_id] = (entry[0], now)
+            self._entries.move_to_end(telegram_id)
+            return entry[0]
+
+        progress_misses.inc()
+        # Coalesce concurrent loads for the same user
+        task = self._loading.get(telegram_id)
+        if task is None:
+            task = asyncio.ensure_future(self._repository.get_completed_lesson_ids(telegram_id))
+            self._loading[telegram_id] = task
+            try:
+                # A write-through may have landed while loading; merge it in
+                lesson_ids = frozenset(await task) | self._pending.get(telegram_id, frozenset())
+            finally:
+                self._loading.pop(telegram_id, None)
+                self._pending.pop(telegram_id, None)
+            self._store(telegram_id, lesson_ids)
+            return lesson_ids
+        lesson_ids = frozenset(await task)
+        entry = self._entries.get(telegram_id)
+        return entry[0] if entry is not None else lesson_ids
+
+    def mark_completed(self, telegram_id: int, lesson_id: int) -> None:
+        """Write-through after the database recorded a pass"""
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            self._store(telegram_id, entry[0] | {lesson_id})
+        elif telegram_id in self._loading:
+            self._pending[telegram_id] = self._pending.get(telegram_id, frozenset()) | {lesson_id}
+
+    def evict(self, telegram_id: int) -> None:
+        """Forget a user's cached progress"""
+        self._entries.pop(telegram_id, None)
+        progress_size.set(len(self._entries))
+
+    def evict_idle(self, now: float = None) -> int:
+        """Drop users idle longer than the TTL; returns how many were dropped"""
+        if now is None:
+            now = time.monotonic()
+        deadline = now - self._idle_ttl
+        dropped = 0
+        while self._entries:
+            telegram_id, (_, last_access) = next(iter(self._entries.items()))
+            if last_access > deadline:
+                break
+            self._entries.popitem(last=False)
+            dropped += 1
+        if dropped:
+            progress_size.set(len(self._entries))
+        return dropped
+
+    def export_state(self) -> List[List]:
+        """[telegram_id, completed lesson ids] pairs, least recently used first"""
+        return [[telegram_id, sorted(entry[0])] for telegram_id, entry in self._entries.items()]
+
+    def restore(self, entries: List[List]) -> None:
+        """Install entries from ``export_state`` as if just accessed"""
+        for telegram_id, lesson_ids in entries:
+            if telegram_id not in self._entries:
+                self._store(telegram_id, frozenset(lesson_ids))
+
+    def _store(self, telegram_id: int, lesson_ids: FrozenSet[int]) -> None:
+        self._entries[telegram_id] = (lesson_ids, time.monotonic())
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self._max_users:
+            self._entries.popitem(last=False)
+        progress_size.set(len(self._entries))
+
+
+registration_hits = bot_metrics.counter("registration_index_hits_total", "Registration checks answered from memory")
+registration_misses = bot_metrics.counter("registration_index_misses_total", "Registration checks confirmed in the database")
+registration_size = bot_metrics.gauge("registration_index_users", "Confirmed users in the membership index")
+
+
+class RegistrationIndex:
+    """Set of confirmed users, warmed at startup
+
+    A hit is authoritative (registrations are never revoked by the bot);
+    a miss is confirmed against the database and remembered if positive.
+    """
+
+    CONFIRMED = "confirmed"
+
+    def __init__(self, repository):
+        self._repository = repository
+        self._confirmed = set()
+
+    def __len__(self) -> int:
+        return len(self._confirmed)
+
+    def __contains__(self, telegram_id: int) -> bool:
+        return telegram_id in self._confirmed
+
+    async def warm(self) -> int:
+        """Load every confirmed user id; returns the index size"""
+        ids = await self._repository.get_confirmed_user_ids()
+        self._confirmed.update(ids)
+        registration_size.set(len(self._confirmed))
+        logger.info(f"✅ Registration index warmed: {len(self._confirmed)} users")
+        return len(self._confirmed)
+
+    def add(self, telegram_id: int) -> None:
+        """Record a confirmed registration (call after the database write)"""
+        self._confirmed.add(telegram_id)
+        registration_size.set(len(self._confirmed))
+
+    def export_state(self) -> List[int]:
+        return sorted(self._confirmed)
+
+    def restore(self, telegram_ids: List[int]) -> None:
+        self._confirmed.update(telegram_ids)
+        registration_size.set(len(self._confirmed))
+
+    async def lookup(self, telegram_id: int):
+        """Return the registration row ({"status": ...}) or None"""
+        if telegram_id in self._confirmed:
+            registration_hits.inc()
+            return {"status": self.CONFIRMED}
+
+        registration_misses.inc()
+        existing = await self._repository.get_registration(telegram_id)
+        if existing and existing.get("status") == self.CONFIRMED:
+            self.add(telegram_id)
+        return existing
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Per-user throttling of database-backed actions
+A token bucket per user in front of the handlers; commands and buttons
+that query Supabase are dropped once a user exceeds their budget, before
+any handler (or query) runs
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Collection, Optional
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+import bot_metrics
+from token_bucket import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Database-backed actions per second a user can sustain, and the burst allowed on top
+USER_RATE = float(os.environ.get("USER_RATE", "0.5"))
+USER_BURST = float(os.environ.get("USER_BURST", "5"))
+
+# Seconds between "slow down" notices to the same user
+NOTICE_INTERVAL = 30.0
+# Tracked users before full (idle) buckets are dropped
+MAX_TRACKED_USERS = 10000
+
+THROTTLED_TEXT = "⏳ لطفاً کمی آهسته‌تر! چند ثانیه صبر کنید و دوباره تلاش کنید."
+
+# Commands and buttons that read registration, lessons or progress from the database;
+# exam answers and registration steps are not throttled
+THROTTLED_COMMANDS = frozenset({"start", "lessons", "progress"})
+THROTTLED_CALLBACK_PREFIXES = ("lesson_", "lessons_menu", "main_menu", "my_progress", "start_exam_")
+
+throttled_updates = bot_metrics.counter("user_throttled_total", "Updates dropped by the per-user throttle")
+tracked_users = bot_metrics.gauge("user_throttle_tracked", "Users with a partly used throttle bucket")
+
+
+def is_throttled_action(update: Update) -> bool:
+    """Whether ``update`` costs a token"""
+    if update.callback_query:
+        return (update.callback_query.data or "").startswith(THROTTLED_CALLBACK_PREFIXES)
+    message = update.effective_message
+    if message and message.text and message.text.startswith("/") and len(message.text) > 1:
+        command = message.text[1:].split(maxsplit=1)[0].split("@", 1)[0].lower()
+        return command in THROTTLED_COMMANDS
+    return False
+
+
+class UserThrottle:
+    """Token bucket per user
+
+    Only users who used part of their budget are tracked: a bucket that
+    has refilled carries no state and is dropped when the table grows,
+    so memory follows the number of recently active users. Buckets are
+    kept in last-seen order, so the ones that refilled are at the front
+    and dropping them never scans the users that are still active.
+    """
+
+    def __init__(self, rate: float = USER_RATE, burst: float = USER_BURST,
+                 exempt: Collection[int] = ()):
+        self._rate = rate
+        self._burst = burst
+        self._exempt = frozenset(exempt)
+        # user_id -> bucket, least recently seen first
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        # user_id -> when they were last told to slow down, oldest first
+        self._noticed: "OrderedDict[int, float]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, user_id: int, now: Optional[float] = None) -> bool:
+        """Take a token for ``user_id``; False if they are over their budget"""
+        if user_id in self._exempt:
+            return True
+        bucket = self._buckets.get(user_id)
+        if bucket is not None:
+            self._buckets.move_to_end(user_id)
+        else:
+            if len(self._buckets) >= MAX_TRACKED_USERS:
+                self._purge_idle(now)
+            bucket = self._buckets[user_id] = TokenBucket(self._rate, self._burst, now)
+            tracked_users.set(len(self._buckets))
+        return bucket.try_take(now=now)
+
+    def should_notify(self, user_id: int, now: Optional[float] = None) -> bool:
+        """True at most once per NOTICE_INTERVAL per user"""
+        now = time.monotonic() if now is None else now
+        if now - self._noticed.get(user_id, float("-inf")) < NOTICE_INTERVAL:
+            return False
+        self._noticed[user_id] = now
+        self._noticed.move_to_end(user_id)
+        return True
+
+    def _purge_idle(self, now: Optional[float] = None) -> None:
+        # A full bucket is the same as no bucket; stop at the first user still refilling
+        while self._buckets:
+            user_id, bucket = next(iter(self._buckets.items()))
+            if not bucket.is_full(now):
+                break
+            del self._buckets[user_id]
+        now = time.monotonic() if now is None else now
+        while self._noticed:
+            user_id, at = next(iter(self._noticed.items()))
+            if now - at < NOTICE_INTERVAL:
+                break
+            del self._noticed[user_id]
+        tracked_users.set(len(self._buckets))
+
+    async def check_update(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handler for group -1: stops throttled updates before the real handlers"""
+        if not isinstance(update, Update) or not update.effective_user:
+            return
+        if not is_throttled_action(update):
+            return
+        user_id = update.effective_user.id
+        if self.allow(user_id):
+            return
+
+        throttled_updates.inc()
+        try:
+            if update.callback_query:
+                # Toast on the button; answering a query is free
+                await update.callback_query.answer(THROTTLED_TEXT)
+            elif self.should_notify(user_id) and update.effective_message:
+                await update.effective_message.reply_text(THROTTLED_TEXT)
+        except Exception as e:
+            logger.debug(f"Could not send throttle notice: {e}")
+        raise ApplicationHandlerStop
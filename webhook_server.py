@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Webhook serving mode for the learning bot
+Telegram pushes updates to an aiohttp endpoint instead of the bot
+long-polling getUpdates; the service can sleep and wake on request
+"""
+
+import os
+import hmac
+import json
+import logging
+import secrets
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+import bot_metrics
+from bot_runner import stop_signal_event
+
+logger = logging.getLogger(__name__)
+
+# Public base URL Telegram should call, e.g. https://mybot.onrender.com
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").strip().rstrip("/")
+# Path of the update endpoint
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram").strip() or "/telegram"
+# Shared secret Telegram sends in X-Telegram-Bot-Api-Secret-Token
+# (empty = a random one is generated and registered on every start)
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "").strip()
+# Interface and port to listen on (Render/Railway set PORT)
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("PORT", os.environ.get("WEBHOOK_PORT", "8080")))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Example values from env_template.txt and the docs; never accepted as the secret
+PLACEHOLDER_SECRETS = frozenset({"change_me_random_string", "some-long-random-string"})
+
+webhook_requests = bot_metrics.counter("webhook_requests_total", "Update requests received")
+webhook_rejected = bot_metrics.counter("webhook_rejected_total", "Update requests rejected (bad secret or body)")
+
+
+def webhook_secret(register: bool) -> str:
+    """Secret the update endpoint requires
+
+    Without one anybody who finds the URL could post forged updates (e.g.
+    as an admin). When the webhook is registered on start a random secret
+    is generated if none is configured; otherwise one must be set so the
+    sender (post_update.py, the sharded ingress) can present it.
+    """
+    if WEBHOOK_SECRET in PLACEHOLDER_SECRETS:
+        raise RuntimeError("WEBHOOK_SECRET is still the example value - set your own or leave it empty")
+    if WEBHOOK_SECRET:
+        return WEBHOOK_SECRET
+    if not register:
+        raise RuntimeError("WEBHOOK_SECRET must be set when the webhook is not registered by the bot")
+    logger.info("🔑 WEBHOOK_SECRET not set - using a random secret for this run")
+    return secrets.token_urlsafe(32)
+
+
+def build_web_app(application: Application, secret_token: str,
+                  path: str = WEBHOOK_PATH) -> web.Application:
+    """aiohttp app with the update endpoint and health routes"""
+    if not secret_token:
+        raise ValueError("secret_token is required")
+
+    async def handle_update(request: web.Request) -> web.Response:
+        webhook_requests.inc()
+        received = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(received.encode(), secret_token.encode()):
+            webhook_rejected.inc()
+            logger.warning(f"⚠️  Rejected webhook request from {request.remote}: bad secret token")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            update = Update.de_json(data, application.bot)
+        except (json.JSONDecodeError, ValueError, TypeError, KeyError) as e:
+            webhook_rejected.inc()
+            logger.warning(f"⚠️  Rejected malformed update: {e}")
+            return web.Response(status=400)
+        await application.update_queue.put(update)
+        return web.Response(status=200)
+
+    async def healthz(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def readyz(request: web.Request) -> web.Response:
+        if application.running:
+            return web.Response(text="ready")
+        return web.Response(status=503, text="starting")
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=bot_metrics.render_text(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+async def run_webhook(application: Application, register: bool = True) -> None:
+    """Serve updates over HTTP until SIGINT/SIGTERM
+
+    With ``register`` the webhook is (re)registered with Telegram on start;
+    set it to False for local testing with post_update.py (WEBHOOK_SECRET
+    is then required).
+    """
+    stop_event = stop_signal_event()
+    secret_token = webhook_secret(register)
+
+    runner = web.AppRunner(build_web_app(application, secret_token))
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+
+        if register:
+            if not WEBHOOK_URL:
+                raise RuntimeError("WEBHOOK_URL must be set to register the webhook")
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL + WEBHOOK_PATH,
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES
+            )
+            logger.info(f"✅ Webhook registered: {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+        await application.start()
+        await runner.setup()
+        site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+        await site.start()
+        logger.info(f"🚀 Listening for updates on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+        try:
+            await stop_event.wait()
+        finally:
+            logger.info("⏹  Stopping webhook server...")
+            await runner.cleanup()
+            await application.stop()
+
+    if application.post_shutdown:
+        await application.post_shutdown(application)
@@ -7,17 +7,17 @@ All lessons are FREE - no payment required
 
 import os
 import io
+import sys
+import hashlib
 import json
 import logging
 import asyncio
-from datetime import datetime, timezone
+import time
 from functools import wraps
-from typing import List, Optional
+from typing import Callable, List, NamedTuple, Optional
 
-import jdatetime
 from dotenv import load_dotenv
-from supabase import create_client, Client
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, Bot
+from telegram import Update, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.error import Conflict, TimedOut, NetworkError
 from telegram.ext import (
     Application,
@@ -26,15 +26,29 @@ from telegram.ext import (
     MessageHandler,
     ConversationHandler,
     ContextTypes,
+    TypeHandler,
     filters
 )
 
-# Import new lessons content
-try:
-    from lessons_content_new import get_all_lessons, get_lesson_by_number
-except ImportError:
-    # Fallback to old content if new doesn't exist
-    from lessons_content import get_all_lessons, get_lesson_by_number
+import api_calls
+from callback_dedup import deduplicated
+from user_throttle import UserThrottle
+from lesson_db import LessonRepository, is_unavailable
+from lesson_cache import LessonCatalog, QuestionBank, RenderedLessonCache
+from user_cache import PROGRESS_CACHE_IDLE, ProgressCache, RegistrationIndex
+from cache_snapshot import CacheSnapshot
+from sqlite_persistence import PERSISTENCE_PATH, SQLitePersistence, StateStorePersistence
+from state_store import create_state_store
+from update_processing import PerUserUpdateProcessor
+from catch_up import CATCH_UP, UpdateWatermark
+from bot_runner import connect_bot, run_polling
+from outbound_limiter import Priority, PriorityRateLimiter
+from follow_ups import schedule_follow_up
+from exam_session import EXAM_SESSION_KEY, PASS_PERCENT, ExamSession, SessionReaper
+from exam_codec import (
+    ACTION_ANSWER, ACTION_NEXT, ACTION_SHOW, PREFIX as EXAM_CALLBACK_PREFIX,
+    ExamCodec, InvalidCallbackData, content_tag, fits_callback_data, session_from_token, token_for
+)
 
 # Load environment variables
 load_dotenv()
@@ -69,27 +83,48 @@ if missing_vars:
         logger.error("⚠️  Bot cannot start without BOT_TOKEN!")
         exit(1)
 
-# Initialize Supabase client
-supabase: Optional[Client] = None
-if SUPABASE_URL and SUPABASE_KEY:
-    try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-        logger.info("✅ Supabase client initialized successfully")
-    except Exception as e:
-        logger.error(f"❌ Error initializing Supabase client: {e}")
-        logger.error("Bot will continue but database features will be disabled")
-        supabase = None
-else:
+def create_supabase_client():
+    """Build the Supabase client (imports the supabase package on first use)"""
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+if not (SUPABASE_URL and SUPABASE_KEY):
     logger.warning("⚠️  Supabase credentials not found, client not initialized")
     logger.warning("Bot will continue but database features will be disabled")
 
+# Async data access layer - all handlers go through this, never the raw client.
+# The client is created by the first query, off the startup path.
+db = LessonRepository(client_factory=create_supabase_client if SUPABASE_URL and SUPABASE_KEY else None)
+
+# Confirmed users - /start and /lessons skip the database for known learners
+registration_index = RegistrationIndex(db)
+
 # Admin IDs
 ADMIN_IDS_STR = os.environ.get("ADMIN_IDS", "")
 ADMIN_IDS = [int(admin_id.strip()) for admin_id in ADMIN_IDS_STR.split(",") if admin_id.strip()]
 
+# How updates are received: "polling" (getUpdates), "webhook" (HTTP endpoint) or
+# "sharded" (an ingress routing updates to WORKER_COUNT worker processes)
+BOT_MODE = os.environ.get("BOT_MODE", "polling").strip().lower()
+# Register the webhook with Telegram on start (disable for local testing)
+WEBHOOK_REGISTER = os.environ.get("WEBHOOK_REGISTER", "1").strip().lower() not in ("0", "false", "no")
+# Updates processed at the same time (each user's updates still run one at a time)
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "16"))
+
 # Total lessons: 15 (all free)
 TOTAL_LESSONS = 15
 
+# Pause before the next question (after answer feedback) and the next lesson (after a pass)
+NEXT_QUESTION_DELAY = 1
+NEXT_LESSON_DELAY = 2
+
+# Exam UI: "single" renders the exam in one message edited per answer, "classic" sends a message per question
+EXAM_UI = os.environ.get("EXAM_UI", "single").strip().lower()
+# "stateless" is the single-message UI with the exam state in signed callback data, so
+# any worker can handle any button (exams with typed answers still keep a session);
+# the key defaults to one derived from the bot token
+EXAM_CALLBACK_SECRET = os.environ.get("EXAM_CALLBACK_SECRET", "").strip()
+
 # Conversation states
 WAITING_NAME, WAITING_PHONE, WAITING_PYTHON_STATUS = range(3)
 WAITING_EXAM_ANSWER = 10  # For answering exam questions
@@ -106,16 +141,13 @@ def restricted(func):
         return await func(update, context, *args, **kwargs)
     return wrapper
 
-def check_existing_registration(telegram_id: int) -> dict:
+async def check_existing_registration(telegram_id: int) -> dict:
     """Check if user already has a registration"""
-    if not supabase:
+    if not db.available:
         logger.error("Supabase client not initialized")
         return None
     try:
-        result = supabase.table("users").select("id,status").eq("telegram_id", telegram_id).execute()
-        if result.data:
-            return result.data[0]
-        return None
+        return await registration_index.lookup(telegram_id)
     except Exception as e:
         logger.error(f"Error checking existing registration: {e}")
         return None
@@ -133,7 +165,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             return ConversationHandler.END
         
         # Check for existing registration
-        existing = check_existing_registration(user_id)
+        existing = await check_existing_registration(user_id)
         if existing:
             status = existing.get("status", "")
             if status == "confirmed":
@@ -240,32 +272,22 @@ async def finish_registration(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text("❌ اطلاعات ناقص است.")
             return
         
-        if not supabase:
+        if not db.available:
             await update.message.reply_text("⚠️ دیتابیس در دسترس نیست. لطفاً بعداً تلاش کنید.")
             return
         
         # Check if user exists
-        existing = check_existing_registration(user_id)
-        if existing:
-            # Update existing user
-            supabase.table("users").update({
-                "name": user_name,
-                "phone": user_phone,
-                "plan": "رایگان",
-                "payment_method": "none",
-                "status": "confirmed"
-            }).eq("telegram_id", user_id).execute()
-        else:
-            # Insert new user
-            user_data = {
-                "telegram_id": user_id,
-                "name": user_name,
-                "phone": user_phone,
-                "plan": "رایگان",
-                "payment_method": "none",
-                "status": "confirmed"
-            }
-            supabase.table("users").insert(user_data).execute()
+        existing = await check_existing_registration(user_id)
+        user_data = {
+            "name": user_name,
+            "phone": user_phone,
+            "plan": "رایگان",
+            "payment_method": "none",
+            "status": "confirmed"
+        }
+        # Update existing user or insert new one
+        await db.save_registration(user_id, user_data, exists=bool(existing))
+        registration_index.add(user_id)
         
         logger.info(f"User {user_id} registered successfully")
         
@@ -310,34 +332,45 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data.clear()
     return ConversationHandler.END
 
-def check_lesson_exam_passed(telegram_id: int, lesson_number: int) -> bool:
+async def completed_lesson_ids(telegram_id: int) -> Optional[frozenset]:
+    """Ids of the user's completed lessons, or None if unknown because the database is down"""
+    try:
+        return await progress_cache.completed(telegram_id)
+    except Exception as e:
+        if not is_unavailable(e):
+            raise
+        # Degraded mode: cached progress was served above, nothing is known for this user
+        return None
+
+async def check_lesson_exam_passed(telegram_id: int, lesson_number: int) -> bool:
     """Check if user passed exam for a lesson"""
     # If no database, allow access to all lessons
-    if not supabase:
+    if not db.available:
         logger.info(f"⚠️  No database connection - allowing access to lesson {lesson_number}")
         return True
     
     try:
-        # Get lesson ID
-        lesson_result = supabase.table("lessons").select("id").eq("lesson_number", lesson_number).execute()
-        if not lesson_result.data:
+        # Get lesson ID from the catalog cache
+        lesson = await lesson_catalog.get(lesson_number)
+        if not lesson:
             logger.debug(f"Lesson {lesson_number} not found")
             return False
         
-        lesson_id = lesson_result.data[0]["id"]
-        
-        # Check progress
-        progress_result = supabase.table("user_progress").select("is_completed").eq("telegram_id", telegram_id).eq("lesson_id", lesson_id).execute()
-        
-        if not progress_result.data:
-            logger.debug(f"No progress record for user {telegram_id}, lesson {lesson_number}")
-            return False
-        
-        is_completed = progress_result.data[0].get("is_completed", False)
+        # Check progress (cached for active users)
+        completed_ids = await completed_lesson_ids(telegram_id)
+        if completed_ids is None:
+            # Don't lock learners out during an outage; the exam still records the pass
+            logger.info(f"⚠️  Database unavailable - allowing access to lesson {lesson_number}")
+            return True
+        is_completed = lesson["id"] in completed_ids
         logger.debug(f"User {telegram_id}, lesson {lesson_number}: is_completed = {is_completed}")
         return is_completed
         
     except Exception as e:
+        if is_unavailable(e):
+            # Outage, not a failed exam - same as unknown progress above
+            logger.warning(f"⚠️  Database unavailable - allowing access to lesson {lesson_number}: {e}")
+            return True
         logger.error(f"Error checking exam status: {e}")
         return False
 
@@ -346,25 +379,32 @@ async def show_lessons_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = update.effective_user.id
         
-        if not supabase:
+        if not db.available:
             await update.effective_message.reply_text("⚠️ دیتابیس در دسترس نیست.")
             return
         
-        # Get all lessons from database
-        result = supabase.table("lessons").select("id,lesson_number,title,is_free").order("lesson_number").execute()
+        # Lessons come from the catalog cache, progress from the per-user cache
+        lessons = await lesson_catalog.all()
         
-        if not result.data:
+        if not lessons:
             await update.effective_message.reply_text(
                 "⚠️ در حال حاضر درسی موجود نیست.\n"
                 "لطفاً با ادمین تماس بگیرید."
             )
             return
         
+        completed_ids = await completed_lesson_ids(user_id)
+        if completed_ids is None:
+            # Progress unknown during an outage: show every lesson as open
+            completed_numbers = {lesson["lesson_number"] for lesson in lessons}
+        else:
+            completed_numbers = {lesson["lesson_number"] for lesson in lessons if lesson["id"] in completed_ids}
+        
         # Build keyboard
         keyboard = []
         buttons_per_row = 2
         
-        for lesson in result.data:
+        for lesson in lessons:
             try:
                 lesson_num = lesson["lesson_number"]
                 title = lesson.get("title", "")
@@ -374,7 +414,7 @@ async def show_lessons_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     status_icon = "🆓"  # First lesson is always free
                 else:
                     # Check if previous lesson exam passed
-                    prev_passed = check_lesson_exam_passed(user_id, lesson_num - 1)
+                    prev_passed = (lesson_num - 1) in completed_numbers
                     if not prev_passed:
                         status_icon = "🔒"  # Locked
                     else:
@@ -417,66 +457,166 @@ async def show_lessons_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.effective_message:
             await update.effective_message.reply_text("❌ خطا در نمایش منوی درس‌ها.")
 
-def get_lesson_data(lesson_number: int):
-    """Get lesson data from database or fallback to local content"""
-    # Try database first
-    if supabase:
-        try:
-            result = supabase.table("lessons").select("*").eq("lesson_number", lesson_number).execute()
-            if result.data and len(result.data) > 0:
-                logger.info(f"✅ Lesson {lesson_number} loaded from database")
-                return result.data[0]
-        except Exception as e:
-            logger.warning(f"⚠️  Error getting lesson {lesson_number} from database: {e}")
-            logger.info(f"💡 Falling back to local lesson content...")
+def local_lesson_row(lesson_data: dict) -> dict:
+    """Convert a lesson from the local content module to database format"""
+    lesson_number = lesson_data["lesson_number"]
+    # Note: content in lessons_content_new.py is already JSON string, so use it directly
+    content_raw = lesson_data.get("content", "[]")
+    if isinstance(content_raw, str):
+        # Already JSON string, use as is
+        content = content_raw
+    else:
+        # List, convert to JSON string
+        content = json.dumps(content_raw, ensure_ascii=False)
+    
+    code_examples_raw = lesson_data.get("code_examples", "[]")
+    if isinstance(code_examples_raw, str):
+        code_examples = code_examples_raw
+    else:
+        code_examples = json.dumps(code_examples_raw, ensure_ascii=False)
+    
+    expected_outputs_raw = lesson_data.get("expected_outputs", "[]")
+    if isinstance(expected_outputs_raw, str):
+        expected_outputs = expected_outputs_raw
+    else:
+        expected_outputs = json.dumps(expected_outputs_raw, ensure_ascii=False)
+    
+    return {
+        "id": lesson_number,
+        "lesson_number": lesson_number,
+        "title": lesson_data.get("title", f"درس {lesson_number}"),
+        "content": content,
+        "code_examples": code_examples,
+        "expected_outputs": expected_outputs,
+        "is_free": True
+    }
+
+def local_lessons_content():
+    """Local lesson content module, imported on first use (it is large)"""
+    try:
+        import lessons_content_new as content
+    except ImportError:
+        # Fallback to old content if new doesn't exist
+        import lessons_content as content
+    return content
+
+def load_local_lessons() -> List[dict]:
+    """Load the whole local lesson catalog in database format"""
+    return [local_lesson_row(lesson) for lesson in local_lessons_content().get_all_lessons()]
+
+# Lesson catalog cache - lesson opens are served from memory
+lesson_catalog = LessonCatalog(db, local_loader=load_local_lessons)
+
+# Completed lessons of active users - navigation taps don't hit the database
+progress_cache = ProgressCache(db)
+
+async def get_lesson_data(lesson_number: int):
+    """Get lesson data from the catalog cache or fallback to local content"""
+    lesson = await lesson_catalog.get(lesson_number)
+    if lesson:
+        return lesson
     
-    # Fallback to local content
+    # Fallback to local content (lesson missing from the database catalog)
     try:
-        lesson_data = get_lesson_by_number(lesson_number)
+        lesson_data = local_lessons_content().get_lesson_by_number(lesson_number)
         if lesson_data:
             logger.info(f"✅ Lesson {lesson_number} loaded from local content")
-            # Convert local format to database format
-            # Note: content in lessons_content_new.py is already JSON string, so use it directly
-            content_raw = lesson_data.get("content", "[]")
-            if isinstance(content_raw, str):
-                # Already JSON string, use as is
-                content = content_raw
-            else:
-                # List, convert to JSON string
-                content = json.dumps(content_raw, ensure_ascii=False)
-            
-            code_examples_raw = lesson_data.get("code_examples", "[]")
-            if isinstance(code_examples_raw, str):
-                code_examples = code_examples_raw
-            else:
-                code_examples = json.dumps(code_examples_raw, ensure_ascii=False)
-            
-            expected_outputs_raw = lesson_data.get("expected_outputs", "[]")
-            if isinstance(expected_outputs_raw, str):
-                expected_outputs = expected_outputs_raw
-            else:
-                expected_outputs = json.dumps(expected_outputs_raw, ensure_ascii=False)
-            
-            return {
-                "id": lesson_number,
-                "lesson_number": lesson_number,
-                "title": lesson_data.get("title", f"درس {lesson_number}"),
-                "content": content,
-                "code_examples": code_examples,
-                "expected_outputs": expected_outputs,
-                "is_free": True
-            }
+            return local_lesson_row(lesson_data)
     except Exception as e:
         logger.error(f"❌ Error getting lesson {lesson_number} from local content: {e}", exc_info=True)
     
     return None
 
-async def send_lesson(update_or_bot, chat_id: int, lesson_number: int, context=None):
-    """Send a complete lesson to user"""
+class LessonMessage(NamedTuple):
+    """Final payload of a lesson delivery"""
+    text: str
+    parse_mode: str
+    reply_markup: InlineKeyboardMarkup
+    exam_prompt: str
+    exam_reply_markup: InlineKeyboardMarkup
+
+def _parse_json_list(raw, field: str, lesson_number: int) -> list:
+    """Parse a JSON list column - handle both string and list formats"""
+    if isinstance(raw, str):
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError as e:
+            logger.error(f"Error parsing {field} JSON for lesson {lesson_number}: {e}")
+            if field == "content":
+                logger.error(f"Content: {raw[:200]}...")
+                return [raw] if raw else []
+            return []
+    return raw if isinstance(raw, list) else []
+
+def render_lesson_message(lesson_data: dict) -> LessonMessage:
+    """Build the lesson text and keyboards (cached by rendered_lessons)"""
+    lesson_number = lesson_data["lesson_number"]
+    separator = "\n" + "─" * 30 + "\n\n"
+    
+    content = _parse_json_list(lesson_data.get("content", "[]"), "content", lesson_number)
+    if not content:
+        logger.warning(f"⚠️  No content found for lesson {lesson_number}")
+        content = [f"درس {lesson_number} در حال آماده‌سازی است..."]
+    
+    title = lesson_data.get("title", f"درس {lesson_number}")
+    
+    parts = [f"📚 **{title}**\n\n", separator.join(content)]
+    
+    code_examples = _parse_json_list(lesson_data.get("code_examples", "[]"), "code_examples", lesson_number)
+    expected_outputs = _parse_json_list(lesson_data.get("expected_outputs", "[]"), "expected_outputs", lesson_number)
+    
+    if code_examples:
+        parts.append("\n" + separator)
+        parts.append("💻 **مثال‌های کد:**\n\n")
+        for i, code in enumerate(code_examples, 1):
+            parts.append(f"```python\n{code}\n```\n\n")
+            if i < len(expected_outputs):
+                parts.append(f"**خروجی:**\n```\n{expected_outputs[i-1]}\n```\n\n")
+    
+    # Navigation buttons
+    keyboard = []
+    if lesson_number > 1:
+        keyboard.append([InlineKeyboardButton("⬅️ درس قبلی", callback_data=f"lesson_{lesson_number - 1}")])
+    
+    if lesson_number < TOTAL_LESSONS:
+        keyboard.append([InlineKeyboardButton("➡️ درس بعدی", callback_data=f"lesson_{lesson_number + 1}")])
+    
+    keyboard.append([
+        InlineKeyboardButton("📚 منوی درس‌ها", callback_data="lessons_menu"),
+        InlineKeyboardButton("🏠 منوی اصلی", callback_data="main_menu")
+    ])
+    
+    exam_keyboard = [[InlineKeyboardButton("📝 شروع آزمون", callback_data=f"start_exam_{lesson_number}")]]
+    
+    return LessonMessage(
+        text="".join(parts),
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        exam_prompt=f"✅ درس {lesson_number} ارسال شد!\n\n📝 برای شروع آزمون، دکمه زیر را بزنید:",
+        exam_reply_markup=InlineKeyboardMarkup(exam_keyboard)
+    )
+
+# Pre-rendered lesson messages, invalidated together with the catalog
+rendered_lessons = RenderedLessonCache(lesson_catalog)
+
+# Exam questions by lesson_id, loaded with the catalog
+question_bank = QuestionBank(db, lesson_catalog)
+
+# Caches saved to disk on shutdown and restored on boot (warm start after a sleep)
+cache_snapshot = CacheSnapshot(db, lesson_catalog, question_bank, progress_cache, registration_index,
+                               progress_max_age=PROGRESS_CACHE_IDLE)
+
+async def send_lesson(update_or_bot, chat_id: int, lesson_number: int, context=None,
+                      rate_limit_args: Optional[int] = None):
+    """Send a complete lesson to user
+
+    ``rate_limit_args`` picks the outbound lane (Priority) of messages sent
+    through the bot.
+    """
     try:
         logger.info(f"Sending lesson {lesson_number} to user {chat_id}")
         
-        lesson_data = get_lesson_data(lesson_number)
+        lesson_data = await get_lesson_data(lesson_number)
         if not lesson_data:
             error_msg = "❌ درس یافت نشد."
             if isinstance(update_or_bot, Update):
@@ -484,12 +624,12 @@ async def send_lesson(update_or_bot, chat_id: int, lesson_number: int, context=N
             elif hasattr(update_or_bot, 'edit_message_text'):
                 await update_or_bot.edit_message_text(error_msg)
             else:
-                await update_or_bot.send_message(chat_id=chat_id, text=error_msg)
+                await update_or_bot.send_message(chat_id=chat_id, text=error_msg, rate_limit_args=rate_limit_args)
             return
         
         # Check if previous lesson exam is passed (except for first lesson)
         if lesson_number > 1:
-            prev_passed = check_lesson_exam_passed(chat_id, lesson_number - 1)
+            prev_passed = await check_lesson_exam_passed(chat_id, lesson_number - 1)
             if not prev_passed:
                 error_msg = (
                     f"🔒 **این درس قفل است!**\n\n"
@@ -501,91 +641,26 @@ async def send_lesson(update_or_bot, chat_id: int, lesson_number: int, context=N
                 elif hasattr(update_or_bot, 'edit_message_text'):
                     await update_or_bot.edit_message_text(error_msg, parse_mode='Markdown')
                 else:
-                    await update_or_bot.send_message(chat_id=chat_id, text=error_msg, parse_mode='Markdown')
+                    await update_or_bot.send_message(chat_id=chat_id, text=error_msg, parse_mode='Markdown', rate_limit_args=rate_limit_args)
                 return
         
-        # Parse content - handle both string and list formats
-        content_raw = lesson_data.get("content", "[]")
-        if isinstance(content_raw, str):
-            try:
-                content = json.loads(content_raw)
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing content JSON for lesson {lesson_number}: {e}")
-                logger.error(f"Content: {content_raw[:200]}...")
-                content = [content_raw] if content_raw else []
-        else:
-            content = content_raw if isinstance(content_raw, list) else []
-        
-        if not content:
-            logger.warning(f"⚠️  No content found for lesson {lesson_number}")
-            content = [f"درس {lesson_number} در حال آماده‌سازی است..."]
-        
-        title = lesson_data.get("title", f"درس {lesson_number}")
-        
-        # Send lesson content
-        lesson_text = f"📚 **{title}**\n\n"
-        
-        for i, section in enumerate(content, 1):
-            if i > 1:
-                lesson_text += "\n" + "─" * 30 + "\n\n"
-            lesson_text += section
-        
-        # Parse code examples - handle both string and list formats
-        code_examples_raw = lesson_data.get("code_examples", "[]")
-        if isinstance(code_examples_raw, str):
-            try:
-                code_examples = json.loads(code_examples_raw)
-            except json.JSONDecodeError:
-                logger.error(f"Error parsing code_examples JSON for lesson {lesson_number}")
-                code_examples = []
-        else:
-            code_examples = code_examples_raw if isinstance(code_examples_raw, list) else []
-        
-        expected_outputs_raw = lesson_data.get("expected_outputs", "[]")
-        if isinstance(expected_outputs_raw, str):
-            try:
-                expected_outputs = json.loads(expected_outputs_raw)
-            except json.JSONDecodeError:
-                logger.error(f"Error parsing expected_outputs JSON for lesson {lesson_number}")
-                expected_outputs = []
-        else:
-            expected_outputs = expected_outputs_raw if isinstance(expected_outputs_raw, list) else []
-        
-        if code_examples:
-            lesson_text += "\n\n" + "─" * 30 + "\n\n"
-            lesson_text += "💻 **مثال‌های کد:**\n\n"
-            for i, code in enumerate(code_examples, 1):
-                lesson_text += f"```python\n{code}\n```\n\n"
-                if i < len(expected_outputs):
-                    lesson_text += f"**خروجی:**\n```\n{expected_outputs[i-1]}\n```\n\n"
-        
-        # Navigation buttons
-        keyboard = []
-        if lesson_number > 1:
-            keyboard.append([InlineKeyboardButton("⬅️ درس قبلی", callback_data=f"lesson_{lesson_number - 1}")])
-        
-        if lesson_number < TOTAL_LESSONS:
-            keyboard.append([InlineKeyboardButton("➡️ درس بعدی", callback_data=f"lesson_{lesson_number + 1}")])
-        
-        keyboard.append([
-            InlineKeyboardButton("📚 منوی درس‌ها", callback_data="lessons_menu"),
-            InlineKeyboardButton("🏠 منوی اصلی", callback_data="main_menu")
-        ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Pre-rendered message payload (built once per catalog version)
+        message = rendered_lessons.get(lesson_number, lambda: render_lesson_message(lesson_data))
+        lesson_text = message.text
+        reply_markup = message.reply_markup
         
         # Send lesson - always send as new message, never edit
         sent_message = None
         bot = context.bot if hasattr(context, 'bot') and context else None
         
         if isinstance(update_or_bot, Update):
-            sent_message = await update_or_bot.message.reply_text(lesson_text, reply_markup=reply_markup, parse_mode='Markdown')
+            sent_message = await update_or_bot.message.reply_text(lesson_text, reply_markup=reply_markup, parse_mode=message.parse_mode)
         elif bot:
             # Use bot from context to send new message
-            sent_message = await bot.send_message(chat_id=chat_id, text=lesson_text, reply_markup=reply_markup, parse_mode='Markdown')
+            sent_message = await bot.send_message(chat_id=chat_id, text=lesson_text, reply_markup=reply_markup, parse_mode=message.parse_mode, rate_limit_args=rate_limit_args)
         elif hasattr(update_or_bot, 'send_message'):
             # update_or_bot is a Bot instance
-            sent_message = await update_or_bot.send_message(chat_id=chat_id, text=lesson_text, reply_markup=reply_markup, parse_mode='Markdown')
+            sent_message = await update_or_bot.send_message(chat_id=chat_id, text=lesson_text, reply_markup=reply_markup, parse_mode=message.parse_mode, rate_limit_args=rate_limit_args)
         else:
             logger.error(f"Cannot send lesson - no valid bot instance available")
             return
@@ -602,24 +677,25 @@ async def send_lesson(update_or_bot, chat_id: int, lesson_number: int, context=N
             if context:
                 context.user_data["lesson_message_id"] = sent_message.message_id
         
-        # Don't auto-start exam - let user click a button to start exam
-        exam_keyboard = [[InlineKeyboardButton("📝 شروع آزمون", callback_data=f"start_exam_{lesson_number}")]]
-        exam_reply_markup = InlineKeyboardMarkup(exam_keyboard)
+        # Load this lesson's questions now so the exam starts without a DB wait
+        question_bank.prefetch(lesson_data["id"])
         
-        exam_prompt = f"✅ درس {lesson_number} ارسال شد!\n\n📝 برای شروع آزمون، دکمه زیر را بزنید:"
+        # Don't auto-start exam - let user click a button to start exam
+        exam_prompt = message.exam_prompt
+        exam_reply_markup = message.exam_reply_markup
         
         # Always send as new message, never edit
         bot = context.bot if hasattr(context, 'bot') else None
         if isinstance(update_or_bot, Update):
             await update_or_bot.message.reply_text(exam_prompt, reply_markup=exam_reply_markup)
         elif bot:
-            await bot.send_message(chat_id=chat_id, text=exam_prompt, reply_markup=exam_reply_markup)
+            await bot.send_message(chat_id=chat_id, text=exam_prompt, reply_markup=exam_reply_markup, rate_limit_args=rate_limit_args)
         elif hasattr(update_or_bot, 'send_message'):
-            await update_or_bot.send_message(chat_id=chat_id, text=exam_prompt, reply_markup=exam_reply_markup)
+            await update_or_bot.send_message(chat_id=chat_id, text=exam_prompt, reply_markup=exam_reply_markup, rate_limit_args=rate_limit_args)
         else:
             # Fallback: try to send new message instead of edit
             if bot:
-                await bot.send_message(chat_id=chat_id, text=exam_prompt, reply_markup=exam_reply_markup)
+                await bot.send_message(chat_id=chat_id, text=exam_prompt, reply_markup=exam_reply_markup, rate_limit_args=rate_limit_args)
             else:
                 logger.error("Cannot send exam prompt - no bot instance available")
         
@@ -631,15 +707,93 @@ async def send_lesson(update_or_bot, chat_id: int, lesson_number: int, context=N
         elif hasattr(update_or_bot, 'edit_message_text'):
             await update_or_bot.edit_message_text(error_msg)
         else:
-            await update_or_bot.send_message(chat_id=chat_id, text=error_msg)
+            await update_or_bot.send_message(chat_id=chat_id, text=error_msg, rate_limit_args=rate_limit_args)
+
+# Discards exams abandoned midway so user_data doesn't grow forever
+exam_reaper = SessionReaper()
+
+# Signs stateless exam buttons; every worker of the same bot derives the same key
+exam_codec = ExamCodec(
+    EXAM_CALLBACK_SECRET.encode() if EXAM_CALLBACK_SECRET
+    else hashlib.sha256(b"exam-callback:" + BOT_TOKEN.encode()).digest()
+)
+
+def get_exam_session(context) -> Optional[ExamSession]:
+    """Return the user's running exam session, if any"""
+    return context.user_data.get(EXAM_SESSION_KEY)
+
+def exam_progress_line(session: ExamSession) -> str:
+    """One mark per question: correct, wrong, revealed, current, pending"""
+    marks = []
+    for index, answer in enumerate(session.answers):
+        if session.is_shown(index):
+            marks.append("💡")
+        elif answer is not None:
+            marks.append("✅" if answer[1] else "❌")
+        elif index == session.current:
+            marks.append("🔸")
+        else:
+            marks.append("▫️")
+    return "".join(marks)
+
+def session_button_data(index: int) -> Callable[[int, int], str]:
+    """callback_data of exam buttons whose state lives in user_data"""
+    def build(action: int, option: int) -> str:
+        if action == ACTION_ANSWER:
+            return f"exam_answer_{index}_{option}"
+        if action == ACTION_SHOW:
+            return f"exam_show_answer_{index}"
+        return f"exam_next_{index}"
+    return build
+
+def signed_button_data(session: ExamSession, user_id: int) -> Callable[[int, int], str]:
+    """callback_data of stateless exam buttons: the signed exam state itself"""
+    tag = content_tag(session.questions)
+    return lambda action, option: exam_codec.encode(token_for(session, action, option, tag), user_id)
+
+def render_exam_view(session: ExamSession, feedback: str = "", reveal: bool = False,
+                     button_data: Optional[Callable[[int, int], str]] = None):
+    """Text and keyboard of the single-message exam at the current question
+
+    With ``reveal`` the current question's answer is shown with a "next"
+    button instead of the answer options. ``button_data(action, option)``
+    builds the callback data of each button.
+    """
+    index = session.current
+    if button_data is None:
+        button_data = session_button_data(index)
+    question = session.question(index)
+    text = f"📝 *آزمون درس {session.lesson_number}*\n{exam_progress_line(session)}\n\n"
+    if feedback:
+        text += f"{feedback}\n\n"
+    text += f"❓ *سوال {index + 1} از {session.total}:*\n\n{question.question_text}"
+    
+    keyboard = []
+    if reveal:
+        text += f"\n\n💡 *جواب صحیح:* {question.correct_answer}"
+        if question.explanation:
+            text += f"\n\n📝 *توضیح:* {question.explanation}"
+        keyboard.append([InlineKeyboardButton("➡️ سوال بعدی", callback_data=button_data(ACTION_NEXT, 0))])
+    else:
+        if question.question_type == "multiple_choice" and question.options:
+            for i, option in enumerate(question.options):
+                keyboard.append([InlineKeyboardButton(option, callback_data=button_data(ACTION_ANSWER, i))])
+        keyboard.append([InlineKeyboardButton("💡 نمایش جواب", callback_data=button_data(ACTION_SHOW, 0))])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def show_exam_view(query, session: ExamSession, feedback: str = "", reveal: bool = False,
+                         button_data: Optional[Callable[[int, int], str]] = None):
+    """Edit the exam message in place to show the current question"""
+    text, reply_markup = render_exam_view(session, feedback, reveal, button_data)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
 async def start_lesson_exam(update_or_bot, chat_id: int, lesson_id: int, lesson_number: int, context=None):
     """Start exam for a lesson"""
     try:
         # Get questions from database
-        result = supabase.table("questions").select("*").eq("lesson_id", lesson_id).order("question_number").execute()
+        questions = await question_bank.get(lesson_id)
         
-        if not result.data:
+        if not questions:
             logger.warning(f"No questions found for lesson {lesson_number}")
             error_msg = "❌ سوالی برای این درس یافت نشد."
             if hasattr(update_or_bot, 'edit_message_text'):
@@ -648,8 +802,6 @@ async def start_lesson_exam(update_or_bot, chat_id: int, lesson_id: int, lesson_
                 await update_or_bot.send_message(chat_id=chat_id, text=error_msg)
             return
         
-        questions = result.data
-        
         # Get context
         if context is None:
             if hasattr(update_or_bot, 'context') and update_or_bot.context:
@@ -665,17 +817,15 @@ async def start_lesson_exam(update_or_bot, chat_id: int, lesson_id: int, lesson_
                 logger.error("Cannot get context for exam")
                 return
         
-        # Store exam data in context
-        context.user_data["exam_questions"] = questions
-        context.user_data["exam_current_question"] = 0
-        context.user_data["exam_lesson_id"] = lesson_id
-        context.user_data["exam_lesson_number"] = lesson_number
-        context.user_data["exam_answers"] = []
-        context.user_data["exam_shown_answers"] = set()
-        context.user_data["waiting_exam_answer"] = True
+        # Store exam session in context (questions are shared, not copied)
+        session = context.user_data[EXAM_SESSION_KEY] = ExamSession(lesson_id, lesson_number, questions)
+        exam_reaper.touch(chat_id, context.user_data)
         
-        # Send first question
-        await send_exam_question(update_or_bot, chat_id, context, 0)
+        # Send first question (single-message UI turns the tapped message into the exam)
+        if EXAM_UI != "classic" and isinstance(update_or_bot, CallbackQuery):
+            await show_exam_view(update_or_bot, session)
+        else:
+            await send_exam_question(update_or_bot, chat_id, context, 0)
         
     except Exception as e:
         logger.error(f"Error starting exam: {e}", exc_info=True)
@@ -685,23 +835,22 @@ async def start_lesson_exam(update_or_bot, chat_id: int, lesson_id: int, lesson_
         elif hasattr(update_or_bot, 'send_message'):
             await update_or_bot.send_message(chat_id=chat_id, text=error_msg)
 
-async def send_exam_question(update_or_bot, chat_id: int, context, question_index: int):
-    """Send an exam question"""
+async def send_exam_question(update_or_bot, chat_id: int, context, question_index: int,
+                             rate_limit_args: Optional[int] = None):
+    """Send an exam question (``rate_limit_args`` as in send_lesson)"""
     try:
-        questions = context.user_data.get("exam_questions", [])
-        if question_index >= len(questions):
+        session = get_exam_session(context)
+        question = session.question(question_index) if session else None
+        if not question:
             return
         
-        question = questions[question_index]
-        lesson_number = context.user_data.get("exam_lesson_number", "?")
-        question_text = f"📝 *آزمون درس {lesson_number}*\n\n❓ *سوال {question_index + 1} از {len(questions)}:*\n\n{question['question_text']}"
+        question_text = f"📝 *آزمون درس {session.lesson_number}*\n\n❓ *سوال {question_index + 1} از {session.total}:*\n\n{question.question_text}"
         
         keyboard = []
         
-        # Parse options if multiple choice
-        if question.get("question_type") == "multiple_choice" and question.get("options"):
-            options = json.loads(question["options"])
-            for i, option in enumerate(options):
+        # Options are parsed once when the question bank loads
+        if question.question_type == "multiple_choice" and question.options:
+            for i, option in enumerate(question.options):
                 keyboard.append([InlineKeyboardButton(option, callback_data=f"exam_answer_{question_index}_{i}")])
         
         # Add show answer button
@@ -717,9 +866,9 @@ async def send_exam_question(update_or_bot, chat_id: int, context, question_inde
             await update_or_bot.message.reply_text(question_text, reply_markup=reply_markup, parse_mode='Markdown')
         elif bot:
             # Use bot.send_message to send new message
-            await bot.send_message(chat_id=chat_id, text=question_text, reply_markup=reply_markup, parse_mode='Markdown')
+            await bot.send_message(chat_id=chat_id, text=question_text, reply_markup=reply_markup, parse_mode='Markdown', rate_limit_args=rate_limit_args)
         elif hasattr(update_or_bot, 'send_message'):
-            await update_or_bot.send_message(chat_id=chat_id, text=question_text, reply_markup=reply_markup, parse_mode='Markdown')
+            await update_or_bot.send_message(chat_id=chat_id, text=question_text, reply_markup=reply_markup, parse_mode='Markdown', rate_limit_args=rate_limit_args)
         elif hasattr(update_or_bot, 'message') and hasattr(update_or_bot.message, 'reply_text'):
             await update_or_bot.message.reply_text(question_text, reply_markup=reply_markup, parse_mode='Markdown')
         else:
@@ -734,38 +883,30 @@ async def handle_exam_answer(update: Update, context: ContextTypes.DEFAULT_TYPE)
         user_id = update.effective_user.id
         
         # Check if in exam mode
-        if not context.user_data.get("waiting_exam_answer", False):
+        session = get_exam_session(context)
+        if not session or session.finished:
             return
+        exam_reaper.touch(user_id, context.user_data)
         
         user_answer = update.message.text.strip() if update.message and update.message.text else None
         if not user_answer:
             return
         
-        current_question = context.user_data.get("exam_current_question", 0)
-        questions = context.user_data.get("exam_questions", [])
-        
-        if current_question >= len(questions):
-            return
-        
-        question = questions[current_question]
-        correct_answer = question.get("correct_answer", "").strip().lower()
+        question = session.question(session.current)
+        correct_answer = question.correct_answer.strip().lower()
         user_answer_lower = user_answer.strip().lower()
         
         is_correct = user_answer_lower == correct_answer
         
         # Store answer
-        context.user_data["exam_answers"].append({
-            "question_id": question["id"],
-            "user_answer": user_answer,
-            "is_correct": is_correct
-        })
+        session.record_answer(session.current, user_answer, is_correct)
         
         if is_correct:
             await update.message.reply_text("✅ صحیح! سوال بعدی...")
-            context.user_data["exam_current_question"] += 1
+            session.current += 1
             
-            if context.user_data["exam_current_question"] < len(questions):
-                await send_exam_question(update, user_id, context, context.user_data["exam_current_question"])
+            if not session.finished:
+                await send_exam_question(update, user_id, context, session.current)
             else:
                 await finish_exam(update, context)
         else:
@@ -774,44 +915,53 @@ async def handle_exam_answer(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except Exception as e:
         logger.error(f"Error handling exam answer: {e}", exc_info=True)
 
+@deduplicated
 async def handle_exam_answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle exam answer from callback (multiple choice)"""
     try:
         query = update.callback_query
         await query.answer()
         
+        # Any exam button counts as activity on a running exam
+        if get_exam_session(context):
+            exam_reaper.touch(query.from_user.id, context.user_data)
+        
         # Handle start exam button
         if query.data.startswith("start_exam_"):
             lesson_number = int(query.data.split("_")[-1])
-            lesson_data = get_lesson_data(lesson_number)
+            lesson_data = await get_lesson_data(lesson_number)
             if not lesson_data:
                 await query.edit_message_text("❌ درس یافت نشد.")
                 return
             
-            # Start exam - pass context explicitly
-            # Answer callback first
-            await query.answer("⏳ در حال شروع آزمون...")
-            # Send new message instead of editing
-            bot = context.bot
-            await bot.send_message(chat_id=query.from_user.id, text="⏳ در حال شروع آزمون...")
-            await start_lesson_exam(bot, query.from_user.id, lesson_data["id"], lesson_number, context)
+            # Start exam - pass context explicitly (questions are usually prefetched already)
+            if EXAM_UI == "stateless":
+                await start_signed_exam(query, lesson_data["id"], lesson_number, context)
+            elif EXAM_UI != "classic":
+                await start_lesson_exam(query, query.from_user.id, lesson_data["id"], lesson_number, context)
+            else:
+                await start_lesson_exam(context.bot, query.from_user.id, lesson_data["id"], lesson_number, context)
             return
         
         # Check if showing answer
         if query.data.startswith("exam_show_answer_"):
             question_index = int(query.data.split("_")[-1])
-            questions = context.user_data.get("exam_questions", [])
-            if question_index < len(questions):
-                question = questions[question_index]
-                correct_answer = question.get("correct_answer", "")
-                explanation = question.get("explanation", "")
+            session = get_exam_session(context)
+            question = session.question(question_index) if session else None
+            if question and EXAM_UI != "classic":
+                if question_index == session.current:
+                    session.mark_shown(question_index)
+                    await show_exam_view(query, session, reveal=True)
+            elif question:
+                correct_answer = question.correct_answer
+                explanation = question.explanation
                 
                 answer_text = f"💡 **جواب صحیح:** {correct_answer}"
                 if explanation:
                     answer_text += f"\n\n📝 **توضیح:** {explanation}"
                 
                 # Mark as shown (doesn't count in score)
-                context.user_data["exam_shown_answers"].add(question_index)
+                session.mark_shown(question_index)
                 
                 # Add next button
                 keyboard = [[InlineKeyboardButton("➡️ سوال بعدی", callback_data=f"exam_next_{question_index}")]]
@@ -823,16 +973,27 @@ async def handle_exam_answer_callback(update: Update, context: ContextTypes.DEFA
         # Handle next after showing answer
         if query.data.startswith("exam_next_"):
             question_index = int(query.data.split("_")[-1])
-            context.user_data["exam_current_question"] = question_index + 1
+            session = get_exam_session(context)
+            if not session:
+                return
+            if EXAM_UI != "classic":
+                if question_index != session.current:
+                    return  # stale button
+                session.current += 1
+                if not session.finished:
+                    await show_exam_view(query, session)
+                else:
+                    await finish_exam(query, context)
+                return
+            session.current = question_index + 1
             
             await query.answer()
-            questions = context.user_data.get("exam_questions", [])
             bot = context.bot if hasattr(context, 'bot') else None
-            if context.user_data["exam_current_question"] < len(questions):
+            if not session.finished:
                 if bot:
-                    await send_exam_question(bot, query.from_user.id, context, context.user_data["exam_current_question"])
+                    await send_exam_question(bot, query.from_user.id, context, session.current)
                 else:
-                    await send_exam_question(query, query.from_user.id, context, context.user_data["exam_current_question"])
+                    await send_exam_question(query, query.from_user.id, context, session.current)
             else:
                 await finish_exam(query, context)
             return
@@ -843,26 +1004,34 @@ async def handle_exam_answer_callback(update: Update, context: ContextTypes.DEFA
             question_index = int(parts[2])
             option_index = int(parts[3])
             
-            questions = context.user_data.get("exam_questions", [])
-            if question_index >= len(questions):
+            session = get_exam_session(context)
+            question = session.question(question_index) if session else None
+            if not question:
                 return
             
-            question = questions[question_index]
-            options = json.loads(question.get("options", "[]"))
-            user_answer = options[option_index]
-            correct_answer = question.get("correct_answer", "").strip()
+            if EXAM_UI != "classic" and question_index != session.current:
+                return  # stale button (double tap)
+            
+            user_answer = question.options[option_index]
+            correct_answer = question.correct_answer.strip()
             
-            is_correct = user_answer.strip() == correct_answer.strip()
+            is_correct = user_answer.strip() == correct_answer
             
             # Store answer
-            context.user_data["exam_answers"].append({
-                "question_id": question["id"],
-                "user_answer": user_answer,
-                "is_correct": is_correct
-            })
+            session.record_answer(question_index, user_answer, is_correct)
+            
+            if EXAM_UI != "classic":
+                # Feedback and the next question in one edit of the same message
+                session.current = question_index + 1
+                if session.finished:
+                    await finish_exam(query, context)
+                else:
+                    feedback = "✅ صحیح!" if is_correct else f"❌ اشتباه! جواب صحیح: {correct_answer}"
+                    await show_exam_view(query, session, feedback=f"سوال {question_index + 1}: {feedback}")
+                return
             
             # Update current question index
-            context.user_data["exam_current_question"] = question_index + 1
+            session.current = question_index + 1
             
             # Send feedback as new message
             bot = context.bot if hasattr(context, 'bot') else None
@@ -878,67 +1047,64 @@ async def handle_exam_answer_callback(update: Update, context: ContextTypes.DEFA
             except Exception as e:
                 logger.warning(f"Could not edit message: {e}")
             
-            # Send next question or finish exam
-            if context.user_data["exam_current_question"] < len(questions):
-                await asyncio.sleep(1)
-                # Send next question as new message
-                if bot:
-                    await send_exam_question(bot, query.from_user.id, context, context.user_data["exam_current_question"])
-                else:
-                    await send_exam_question(query, query.from_user.id, context, context.user_data["exam_current_question"])
+            # Send next question (after the feedback has been read) or finish exam
+            if not session.finished:
+                schedule_follow_up(context, NEXT_QUESTION_DELAY, send_next_question_follow_up,
+                                   query.from_user.id, (query.from_user.id, session, session.current))
             else:
                 await finish_exam(query, context)
                 
     except Exception as e:
         logger.error(f"Error handling exam callback: {e}", exc_info=True)
 
+async def send_next_question_follow_up(context, data):
+    """Delayed send of the next exam question"""
+    user_id, session, question_index = data
+    # Skip if the exam was finished, restarted or moved on in the meantime
+    if get_exam_session(context) is not session or session.current != question_index:
+        return
+    await send_exam_question(context.bot, user_id, context, question_index,
+                             rate_limit_args=Priority.BACKGROUND)
+
+async def send_next_lesson_follow_up(context, data):
+    """Delayed auto-send of the next lesson after a passed exam"""
+    user_id, lesson_number = data
+    await send_lesson(context.bot, user_id, lesson_number, context,
+                      rate_limit_args=Priority.BACKGROUND)
+
 async def finish_exam(update_or_bot, context):
     """Finish exam and show results"""
     try:
         user_id = update_or_bot.from_user.id if hasattr(update_or_bot, 'from_user') else update_or_bot.effective_user.id
-        questions = context.user_data.get("exam_questions", [])
-        answers = context.user_data.get("exam_answers", [])
-        shown_answers = context.user_data.get("exam_shown_answers", set())
-        lesson_id = context.user_data.get("exam_lesson_id")
-        lesson_number = context.user_data.get("exam_lesson_number")
+        # Take the session out of user_data so a second tap can't finish it twice
+        session = context.user_data.pop(EXAM_SESSION_KEY, None)
+        if not session:
+            return
+        exam_reaper.discard(user_id)
+        await report_exam_result(update_or_bot, user_id, session, context)
+    except Exception as e:
+        logger.error(f"Error finishing exam: {e}", exc_info=True)
+
+async def report_exam_result(update_or_bot, user_id: int, session: ExamSession, context):
+    """Save a finished exam and show the results"""
+    try:
+        lesson_id = session.lesson_id
+        lesson_number = session.lesson_number
         
         # Calculate score (excluding shown answers)
-        total_questions = len(questions)
-        answered_questions = len([a for i, a in enumerate(answers) if i not in shown_answers])
-        correct_answers = len([a for i, a in enumerate(answers) if a.get("is_correct") and i not in shown_answers])
-        
-        if answered_questions == 0:
-            score_percent = 0
-        else:
-            score_percent = int((correct_answers / answered_questions) * 100)
-        
-        # Save answers to database
-        if supabase:
-            try:
-                for answer in answers:
-                    supabase.table("question_answers").upsert({
-                        "telegram_id": user_id,
-                        "question_id": answer["question_id"],
-                        "user_answer": answer["user_answer"],
-                        "is_correct": answer["is_correct"]
-                    }, on_conflict="telegram_id,question_id").execute()
-            except Exception as e:
-                logger.error(f"Error saving answers: {e}")
+        correct_answers, answered_questions, score_percent = session.score()
         
         # Check if passed (70%)
-        passed = score_percent >= 70
+        passed = score_percent >= PASS_PERCENT
         
-        # Update progress
-        if supabase and passed:
+        # Save answers and progress in a single request
+        if db.available:
             try:
-                supabase.table("user_progress").upsert({
-                    "telegram_id": user_id,
-                    "lesson_id": lesson_id,
-                    "is_completed": True,
-                    "completed_at": datetime.now(timezone.utc).isoformat()
-                }, on_conflict="telegram_id,lesson_id").execute()
+                await db.save_exam_results(user_id, lesson_id, session.answer_rows(), passed)
+                if passed:
+                    progress_cache.mark_completed(user_id, lesson_id)
             except Exception as e:
-                logger.error(f"Error updating progress: {e}")
+                logger.error(f"Error saving exam results: {e}")
         
         # Prepare result message
         result_text = (
@@ -952,7 +1118,7 @@ async def finish_exam(update_or_bot, context):
             if lesson_number < TOTAL_LESSONS:
                 result_text += f"درس بعدی ({lesson_number + 1}) خودکار ارسال می‌شود..."
         else:
-            result_text += "❌ متأسفانه قبول نشدید.\n\nنمره قبولی: 70%\n\nلطفاً درس را دوباره مطالعه کنید."
+            result_text += f"❌ متأسفانه قبول نشدید.\n\nنمره قبولی: {PASS_PERCENT}%\n\nلطفاً درس را دوباره مطالعه کنید."
         
         # Navigation buttons
         keyboard = []
@@ -969,26 +1135,91 @@ async def finish_exam(update_or_bot, context):
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         # Send result
-        if hasattr(update_or_bot, 'edit_message_text'):
+        if isinstance(update_or_bot, Update):
+            await update_or_bot.message.reply_text(result_text, reply_markup=reply_markup, parse_mode='Markdown')
+        elif hasattr(update_or_bot, 'edit_message_text'):
             await update_or_bot.edit_message_text(result_text, reply_markup=reply_markup, parse_mode='Markdown')
         elif hasattr(update_or_bot, 'send_message'):
             await update_or_bot.send_message(chat_id=user_id, text=result_text, reply_markup=reply_markup, parse_mode='Markdown')
         
         # Auto-send next lesson if passed
         if passed and lesson_number < TOTAL_LESSONS:
-            await asyncio.sleep(2)
-            await send_lesson(update_or_bot, user_id, lesson_number + 1, context)
+            schedule_follow_up(context, NEXT_LESSON_DELAY, send_next_lesson_follow_up,
+                               user_id, (user_id, lesson_number + 1))
         
-        # Clear exam data
-        context.user_data.pop("exam_questions", None)
-        context.user_data.pop("exam_current_question", None)
-        context.user_data.pop("exam_answers", None)
-        context.user_data.pop("waiting_exam_answer", None)
-        context.user_data.pop("exam_shown_answers", None)
+    except Exception as e:
+        logger.error(f"Error reporting exam result: {e}", exc_info=True)
+
+async def start_signed_exam(query, lesson_id: int, lesson_number: int, context):
+    """Start a stateless exam: nothing is stored, the buttons carry the state"""
+    questions = await question_bank.get(lesson_id)
+    if not questions:
+        await query.edit_message_text("❌ سوالی برای این درس یافت نشد.")
+        return
+    if not fits_callback_data(questions):
+        # Text questions or too large for callback data - run this exam from user_data instead
+        logger.info(f"Exam of lesson {lesson_number} needs a session, not signed callback data")
+        await start_lesson_exam(query, query.from_user.id, lesson_id, lesson_number, context)
+        return
+    session = ExamSession(lesson_id, lesson_number, questions)
+    await show_exam_view(query, session, button_data=signed_button_data(session, query.from_user.id))
+
+@deduplicated
+async def handle_signed_exam_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stateless exam step - all state comes from the signed callback data"""
+    try:
+        query = update.callback_query
+        await query.answer()
+        user_id = query.from_user.id
         
+        try:
+            token = exam_codec.decode(query.data, user_id)
+        except InvalidCallbackData as e:
+            logger.warning(f"⚠️  Rejected exam button from user {user_id}: {e}")
+            return
+        
+        lesson_data = await get_lesson_data(token.lesson_number)
+        questions = await question_bank.get(lesson_data["id"]) if lesson_data else ()
+        if not questions or len(questions) != len(token.answers) or content_tag(questions) != token.content_tag:
+            # Questions changed since the button was rendered
+            keyboard = [[InlineKeyboardButton("🔄 شروع دوباره آزمون", callback_data=f"start_exam_{token.lesson_number}")]]
+            await query.edit_message_text(
+                "⚠️ سوالات این آزمون به‌روزرسانی شده است. لطفاً آزمون را دوباره شروع کنید.",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+            return
+        
+        session = session_from_token(token, lesson_data["id"], questions)
+        question = session.question(session.current)
+        if not question:
+            return
+        
+        if token.action == ACTION_SHOW:
+            session.mark_shown(session.current)
+            await show_exam_view(query, session, reveal=True, button_data=signed_button_data(session, user_id))
+            return
+        
+        feedback = ""
+        if token.action == ACTION_ANSWER:
+            if not 0 <= token.option < len(question.options):
+                return
+            user_answer = question.options[token.option]
+            correct_answer = question.correct_answer.strip()
+            is_correct = user_answer.strip() == correct_answer
+            session.record_answer(session.current, user_answer, is_correct)
+            feedback = "✅ صحیح!" if is_correct else f"❌ اشتباه! جواب صحیح: {correct_answer}"
+            feedback = f"سوال {session.current + 1}: {feedback}"
+        
+        session.current += 1
+        if session.finished:
+            await report_exam_result(query, user_id, session, context)
+        else:
+            await show_exam_view(query, session, feedback=feedback, button_data=signed_button_data(session, user_id))
+    
     except Exception as e:
-        logger.error(f"Error finishing exam: {e}", exc_info=True)
+        logger.error(f"Error handling signed exam callback: {e}", exc_info=True)
 
+@deduplicated
 async def handle_lesson_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle lesson selection from menu"""
     try:
@@ -1012,17 +1243,15 @@ async def handle_lesson_selection(update: Update, context: ContextTypes.DEFAULT_
         lesson_number = int(query.data.split("_")[1])
         
         # Check if lesson exists
-        lesson_data = get_lesson_data(lesson_number)
+        lesson_data = await get_lesson_data(lesson_number)
         if not lesson_data:
             await query.edit_message_text("❌ درس یافت نشد.")
             return
         
         # Send lesson - pass context to send_lesson
         # Don't edit the menu message, send lesson as new message
-        await query.answer("⏳ در حال بارگذاری درس...")
-        bot = context.bot
-        await bot.send_message(chat_id=user_id, text="⏳ در حال بارگذاری درس...")
-        await send_lesson(bot, user_id, lesson_number, context)
+        # (lessons come from the in-memory catalog, no loading notice needed)
+        await send_lesson(context.bot, user_id, lesson_number, context)
         
     except Exception as e:
         logger.error(f"Error handling lesson selection: {e}", exc_info=True)
@@ -1033,7 +1262,7 @@ async def lessons_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /lessons command"""
     # Check registration
     user_id = update.effective_user.id
-    existing = check_existing_registration(user_id)
+    existing = await check_existing_registration(user_id)
     if not existing or existing.get("status") != "confirmed":
         await update.message.reply_text(
             "⚠️ برای استفاده از درس‌ها باید ابتدا ثبت‌نام کنید.\n"
@@ -1048,14 +1277,17 @@ async def progress_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = update.effective_user.id
         
-        if not supabase:
+        if not db.available:
             await update.message.reply_text("⚠️ دیتابیس در دسترس نیست.")
             return
         
         # Get user progress
-        progress_result = supabase.table("user_progress").select("lesson_id,is_completed").eq("telegram_id", user_id).eq("is_completed", True).execute()
+        completed_ids = await completed_lesson_ids(user_id)
+        if completed_ids is None:
+            await update.message.reply_text("⚠️ پیشرفت شما موقتاً در دسترس نیست. لطفاً چند دقیقه دیگر دوباره تلاش کنید.")
+            return
         
-        completed_count = len(progress_result.data) if progress_result.data else 0
+        completed_count = len(completed_ids)
         
         progress_text = (
             f"📊 **پیشرفت شما:**\n\n"
@@ -1070,6 +1302,27 @@ async def progress_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in progress_command: {e}")
         await update.message.reply_text("❌ خطا در نمایش پیشرفت.")
 
+@restricted
+async def reload_lessons_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /reload_lessons command - drop the lesson cache and reload it (admins only)"""
+    try:
+        lesson_catalog.invalidate()
+        await lesson_catalog.refresh()
+        # Questions can change without the lessons; reload them explicitly
+        question_count = await question_bank.load_all() if db.available else None
+        stats = lesson_catalog.stats()
+        await update.message.reply_text(
+            f"✅ درس‌ها دوباره بارگذاری شدند.\n\n"
+            f"📚 تعداد: {stats['lessons']}\n"
+            f"❓ سؤال‌ها: {question_count if question_count is not None else '-'}\n"
+            f"🏷 نسخه: {stats['version']}\n"
+            f"📦 منبع: {stats['source']}\n"
+            f"🎯 hit/miss: {stats['hits']}/{stats['misses']}"
+        )
+    except Exception as e:
+        logger.error(f"Error in reload_lessons_command: {e}")
+        await update.message.reply_text("❌ خطا در بارگذاری مجدد درس‌ها.")
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors"""
     error = context.error
@@ -1099,29 +1352,98 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
         except:
             pass
 
-async def test_bot_connection(token: str, max_retries: int = 3) -> bool:
-    """Test bot connection to Telegram API"""
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"Testing connection to Telegram API (attempt {attempt + 1}/{max_retries})...")
-            bot = Bot(token=token)
-            await bot.initialize()
-            me = await bot.get_me()
-            await bot.shutdown()
-            logger.info(f"✅ Connection successful! Bot: @{me.username}")
-            return True
-        except Exception as e:
-            error_msg = str(e)
-            if attempt < max_retries - 1:
-                wait_time = (attempt + 1) * 2
-                logger.warning(f"⚠️  Connection failed (attempt {attempt + 1}/{max_retries}): {error_msg[:100]}")
-                logger.info(f"⏳ Retrying in {wait_time} seconds...")
-                await asyncio.sleep(wait_time)
+# Long-running tasks started in on_startup, cancelled in on_shutdown
+background_tasks: List[asyncio.Task] = []
+
+async def warm_caches() -> None:
+    """Load the lesson catalog and registration index before the first update arrives"""
+    # A valid snapshot replaces the full loads with a single watermark query
+    try:
+        restored = await cache_snapshot.restore()
+    except Exception as e:
+        logger.warning(f"⚠️  Could not restore cache snapshot: {e}")
+        restored = set()
+    warmups = []
+    if "catalog" not in restored:
+        # A changed catalog reloads the question bank through its listener
+        warmups.append(lesson_catalog.refresh())
+    elif db.available and "questions" not in restored:
+        warmups.append(question_bank.load_all())
+    if db.available and "registrations" not in restored:
+        warmups.append(registration_index.warm())
+    results = await asyncio.gather(*warmups, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"⚠️  Cache warm-up failed: {result}")
+
+async def bind_exam_session(session: ExamSession) -> bool:
+    """Attach a session restored from persistence to the question bank"""
+    try:
+        questions = await question_bank.get(session.lesson_id)
+    except Exception as e:
+        logger.warning(f"⚠️  Could not load questions of lesson {session.lesson_number} for a restored exam: {e}")
+        return False
+    return session.bind(questions)
+
+async def on_startup(application: Application) -> None:
+    """Start background tasks once the application is initialized"""
+    if application.persistence:
+        # Exams restored from disk are rebound to the shared question bank and
+        # get a fresh idle timeout; dropped and reaped ones are written back
+        dropped = []
+        for user_id, user_data in application.user_data.items():
+            session = user_data.get(EXAM_SESSION_KEY)
+            if session is None:
+                continue
+            if await bind_exam_session(session):
+                exam_reaper.touch(user_id, user_data)
             else:
-                logger.error(f"❌ Failed to connect after {max_retries} attempts")
-                logger.error(f"Error: {error_msg}")
-                return False
-    return False
+                del user_data[EXAM_SESSION_KEY]
+                dropped.append(user_id)
+        if dropped:
+            logger.info(f"🧹 Dropped {len(dropped)} restored exams whose questions changed")
+            application.mark_data_for_update_persistence(user_ids=dropped)
+        exam_reaper.on_reap = lambda user_ids: application.mark_data_for_update_persistence(user_ids=user_ids)
+    
+    # Background sweep of idle exam sessions
+    background_tasks.append(asyncio.create_task(exam_reaper.run()))
+    # Periodic cache snapshot, so a crash still leaves a recent one
+    background_tasks.append(asyncio.create_task(cache_snapshot.run()))
+
+async def on_shutdown(application: Application) -> None:
+    """Stop background tasks, snapshot the caches and release the database worker threads"""
+    while background_tasks:
+        background_tasks.pop().cancel()
+    await cache_snapshot.save()
+    db.close()
+    logger.info(f"📊 Bot API calls per interaction: {api_calls.calls_per_interaction()}")
+
+async def serve(application: Application, watermark: Optional[UpdateWatermark] = None) -> None:
+    """Connect to Telegram while the caches load, then receive updates until stopped"""
+    started = time.perf_counter()
+    # getMe on the application's own bot and the first database queries overlap
+    connected, _ = await asyncio.gather(connect_bot(application.bot), warm_caches())
+    if not connected:
+        logger.error("\n" + "=" * 60)
+        logger.error("❌ Cannot connect to Telegram API!")
+        logger.error("=" * 60)
+        logger.error("\n💡 Troubleshooting:")
+        logger.error("   1. Check your internet connection")
+        logger.error("   2. Verify BOT_TOKEN is correct in .env file")
+        logger.error("   3. If in Iran, use VPN/proxy to access Telegram")
+        logger.error("   4. Check firewall/proxy settings")
+        logger.error("   5. Try accessing https://api.telegram.org in browser")
+        logger.error("\n⚠️  Bot will not start without connection.")
+        await application.bot.shutdown()
+        db.close()
+        return
+    logger.info(f"⚡ Connected and caches warm in {time.perf_counter() - started:.2f}s")
+    
+    if BOT_MODE == "webhook":
+        from webhook_server import run_webhook
+        await run_webhook(application, register=WEBHOOK_REGISTER)
+    else:
+        await run_polling(application, watermark)
 
 def main() -> None:
     """Start the bot"""
@@ -1134,28 +1456,45 @@ def main() -> None:
     logger.info("🤖 Starting Telegram Bot...")
     logger.info("=" * 60)
     
-    # Test connection first
-    try:
-        connection_ok = asyncio.run(test_bot_connection(BOT_TOKEN))
-        if not connection_ok:
-            logger.error("\n" + "=" * 60)
-            logger.error("❌ Cannot connect to Telegram API!")
-            logger.error("=" * 60)
-            logger.error("\n💡 Troubleshooting:")
-            logger.error("   1. Check your internet connection")
-            logger.error("   2. Verify BOT_TOKEN is correct in .env file")
-            logger.error("   3. If in Iran, use VPN/proxy to access Telegram")
-            logger.error("   4. Check firewall/proxy settings")
-            logger.error("   5. Try accessing https://api.telegram.org in browser")
-            logger.error("\n⚠️  Bot will not start without connection.")
-            return
-    except Exception as e:
-        logger.error(f"❌ Error testing connection: {e}")
+    if BOT_MODE == "sharded":
+        # This process only routes updates; the workers run this script in webhook mode
+        from sharded_ingress import run_ingress
+        try:
+            asyncio.run(run_ingress(BOT_TOKEN, [sys.executable, os.path.abspath(__file__)]))
+        except Exception as e:
+            logger.error(f"❌ Fatal error in ingress: {e}", exc_info=True)
         return
     
+    user_filter = None
+    if os.environ.get("WORKER_INDEX"):
+        # Started by the sharded ingress: only restore the users routed here
+        from sharding import shard_filter
+        user_filter = shard_filter()
+    
+    # Polling only: Telegram keeps a webhook's undelivered updates and retries them itself
+    watermark = UpdateWatermark() if CATCH_UP and BOT_MODE == "polling" else None
+    
     try:
         logger.info("📱 Creating bot application...")
-        application = Application.builder().token(BOT_TOKEN).build()
+        builder = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY, watermark=watermark))
+            .rate_limiter(PriorityRateLimiter())
+            .post_init(on_startup)
+            .post_shutdown(on_shutdown)
+        )
+        state_store = create_state_store()
+        if state_store is not None:
+            # Registration steps and running exams in the shared store, reachable from any worker
+            builder = builder.persistence(StateStorePersistence(state_store, user_filter=user_filter))
+        elif PERSISTENCE_PATH:
+            # Registration steps and running exams survive restarts
+            builder = builder.persistence(SQLitePersistence(PERSISTENCE_PATH, user_filter=user_filter))
+        if BOT_MODE == "webhook":
+            # Updates arrive over HTTP - no getUpdates long-polling
+            builder = builder.updater(None)
+        application = builder.build()
         logger.info("✅ Application created successfully")
     except Exception as e:
         logger.error(f"❌ Error creating application: {e}")
@@ -1181,33 +1520,34 @@ def main() -> None:
         },
         fallbacks=[CommandHandler("start", start), CommandHandler("cancel", cancel)],
         per_chat=True,
-        per_user=True
+        per_user=True,
+        name="registration",
+        persistent=application.persistence is not None
     )
     
     # Add handlers
     logger.info("📝 Registering handlers...")
+    # Runs before every other handler: drops a user's excess database-backed requests
+    application.add_handler(TypeHandler(Update, UserThrottle(exempt=ADMIN_IDS).check_update), group=-1)
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("lessons", lessons_command))
     application.add_handler(CommandHandler("progress", progress_command))
+    application.add_handler(CommandHandler("reload_lessons", reload_lessons_command))
     application.add_handler(CallbackQueryHandler(handle_lesson_selection, pattern="^lesson_"))
     application.add_handler(CallbackQueryHandler(handle_lesson_selection, pattern="^lessons_menu"))
     application.add_handler(CallbackQueryHandler(handle_lesson_selection, pattern="^main_menu"))
     application.add_handler(CallbackQueryHandler(handle_exam_answer_callback, pattern="^(exam_|start_exam_)"))
+    application.add_handler(CallbackQueryHandler(handle_signed_exam_callback, pattern=f"^{EXAM_CALLBACK_PREFIX}"))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_exam_answer))
     application.add_error_handler(error_handler)
     
     logger.info("✅ All handlers registered")
     logger.info("=" * 60)
-    logger.info("🚀 Bot is ready! Starting polling...")
+    logger.info(f"🚀 Bot is ready! Starting {BOT_MODE}...")
     logger.info("=" * 60)
     
-    # run_polling automatically deletes webhook when drop_pending_updates=True
     try:
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True,
-            close_loop=False
-        )
+        asyncio.run(serve(application, watermark))
     except KeyboardInterrupt:
         logger.info("\n⚠️  Bot stopped by user")
     except Conflict as e: